@@ -0,0 +1,230 @@
+"""
+Framebuffer animations drawn with NumPy.
+
+The engine keeps one float RGB framebuffer. Every frame it starts from a base image (the composed
+clock, or black), lets each running effect transform the whole buffer with array operations and
+pushes the result to the panel with a single SetImage. Effects run on monotonic time like the
+brightness fades, so they look the same at any frame rate.
+"""
+from abc import ABC, abstractmethod
+import math
+import time
+
+import numpy as np
+from PIL import Image
+
+from fade import EASINGS
+
+class Effect(ABC):
+    ''' Base class for effects. Subclasses implement apply() '''
+    # Seconds the effect runs for, or None to run until it's removed
+    duration = None
+
+    @abstractmethod
+    def apply(self, frame, elapsed, dt):
+        '''
+        Draw into frame, a float32 (height, width, 3) array of 0-255 values holding everything
+        below this effect. elapsed is the time since the effect was added, dt since the last frame.
+        '''
+
+    def finished(self, elapsed):
+        return self.duration is not None and elapsed >= self.duration
+
+class Sweep(Effect):
+    '''
+    A horizontal line sweeping down the panel, leaving a trail that decays behind it.
+    speed is in rows/sec and decay in trail brightness/sec (the trail starts at 1). The defaults
+    are utils/sweep_animation.py's original per frame steps at 60 fps. gap is how many rows off
+    the bottom the line travels before it wraps, and passes limits how many times it sweeps.
+    '''
+    def __init__(self, speed=12, decay=1.2, color=(0, 255, 255), trail=(0, 100, 255), gap=5, passes=None):
+        self.speed = speed
+        self.decay = decay
+        self.color = np.array(color, dtype=np.float32)
+        self.trail = np.array(trail, dtype=np.float32)
+        self.gap = gap
+        self.passes = passes
+        self.position = 0.0
+        self.heat = None
+
+    def _leave_rows(self, start, end, end_position):
+        ''' Heat up the rows the line moved off of between positions start and end '''
+        rows = np.arange(math.floor(start), min(math.floor(end), len(self.heat)))
+        if len(rows):
+            # How long ago the line left each row, so a slow frame doesn't leave gaps in the trail
+            heat = 1 - self.decay*(end_position - (rows + 1))/self.speed
+            self.heat[rows] = np.maximum(self.heat[rows], np.clip(heat, 0, 1))
+
+    def apply(self, frame, elapsed, dt):
+        height = frame.shape[0]
+        if self.heat is None:
+            self.heat = np.zeros(height, dtype=np.float32)
+        cycle = height + self.gap
+
+        np.maximum(self.heat - self.decay*dt, 0, out=self.heat)
+        end = self.position + self.speed*min(dt, cycle/self.speed)
+        if end >= cycle:
+            self._leave_rows(self.position, cycle, end)
+            end -= cycle
+            self._leave_rows(0, end, end)
+        else:
+            self._leave_rows(self.position, end, end)
+        self.position = end
+
+        # Lighten the frame with the trail, row by row across the full width
+        np.maximum(frame, self.heat[:, np.newaxis, np.newaxis]*self.trail, out=frame)
+        row = int(self.position)
+        if row < height:
+            frame[row] = self.color
+
+    def finished(self, elapsed):
+        if self.passes is None or self.heat is None:
+            return False
+        return elapsed*self.speed >= self.passes*(len(self.heat) + self.gap)
+
+class Tint(Effect):
+    '''
+    Blend the frame towards a solid color over duration seconds, e.g. fade to black for a
+    transition. With reverse it starts at the color and fades back to the frame.
+    '''
+    def __init__(self, color=(0, 0, 0), duration=0.5, easing='ease_in_out', reverse=False):
+        if easing not in EASINGS:
+            raise ValueError(f"Unknown easing {easing!r}, expected one of {', '.join(EASINGS)}")
+        self.color = np.array(color, dtype=np.float32)
+        self.duration = duration
+        self.easing = EASINGS[easing]
+        self.reverse = reverse
+
+    def apply(self, frame, elapsed, dt):
+        amount = self.easing(min(elapsed/self.duration, 1) if self.duration > 0 else 1)
+        if self.reverse:
+            amount = 1 - amount
+        frame *= 1 - amount
+        frame += amount*self.color
+
+class Pulse(Effect):
+    '''
+    An alert: the color pulses over the frame (or just over rect, (x, y, width, height)) once
+    every period seconds, up to strength of the way there
+    '''
+    def __init__(self, color=(255, 0, 0), period=1.0, strength=0.6, duration=None, rect=None):
+        self.color = np.array(color, dtype=np.float32)
+        self.period = period
+        self.strength = strength
+        self.duration = duration
+        self.rect = rect
+
+    def apply(self, frame, elapsed, dt):
+        amount = self.strength*(1 - math.cos(2*math.pi*elapsed/self.period))/2
+        if self.rect is not None:
+            x, y, width, height = self.rect
+            frame = frame[max(y, 0):y + height, max(x, 0):x + width]
+        frame *= 1 - amount
+        frame += amount*self.color
+
+class Scroll(Effect):
+    ''' Scroll everything below by velocity (x, y) pixels/sec, wrapping around the edges '''
+    def __init__(self, velocity=(-8, 0), duration=None):
+        self.velocity = velocity
+        self.duration = duration
+
+    def apply(self, frame, elapsed, dt):
+        shift = (int(elapsed*self.velocity[1]) % frame.shape[0], int(elapsed*self.velocity[0]) % frame.shape[1])
+        if shift != (0, 0):
+            frame[:] = np.roll(frame, shift, axis=(0, 1))
+
+class Slide(Effect):
+    '''
+    Screen transition: previous (a frame of the old screen) slides off towards direction,
+    (-1, 0) being left, uncovering what's below
+    '''
+    def __init__(self, previous, duration=0.5, direction=(-1, 0), easing='ease_in_out'):
+        if easing not in EASINGS:
+            raise ValueError(f"Unknown easing {easing!r}, expected one of {', '.join(EASINGS)}")
+        self.previous = np.array(previous, dtype=np.float32)
+        self.duration = duration
+        self.direction = direction
+        self.easing = EASINGS[easing]
+
+    def apply(self, frame, elapsed, dt):
+        height, width, _ = frame.shape
+        amount = self.easing(min(elapsed/self.duration, 1) if self.duration > 0 else 1)
+        dx, dy = int(round(self.direction[0]*amount*width)), int(round(self.direction[1]*amount*height))
+        # The part of the old frame still on the panel after moving it by dx, dy
+        x0, x1 = max(dx, 0), min(width + dx, width)
+        y0, y1 = max(dy, 0), min(height + dy, height)
+        if x0 < x1 and y0 < y1:
+            frame[y0:y1, x0:x1] = self.previous[y0 - dy:y1 - dy, x0 - dx:x1 - dx]
+
+class Trail(Effect):
+    ''' Motion blur: anything that moves leaves a trail fading out at decay brightness/sec '''
+    def __init__(self, decay=4.0, duration=None):
+        self.decay = decay
+        self.duration = duration
+        self.buffer = None
+
+    def apply(self, frame, elapsed, dt):
+        if self.buffer is None or self.buffer.shape != frame.shape:
+            self.buffer = frame.copy()
+        self.buffer *= max(1 - self.decay*dt, 0)
+        np.maximum(self.buffer, frame, out=self.buffer)
+        frame[:] = self.buffer
+
+class AnimationEngine:
+    def __init__(self, width, height, clock=time.monotonic):
+        self.width = width
+        self.height = height
+        self.clock = clock
+        self.frame = np.zeros((height, width, 3), dtype=np.float32)
+        self.output = np.zeros((height, width, 3), dtype=np.uint8)
+        # [effect, start time], applied in the order they were added
+        self.effects = []
+        # Incremented on every rendered frame
+        self.version = 0
+        self._last_time = None
+
+    @property
+    def active(self):
+        return bool(self.effects)
+
+    def add(self, effect):
+        ''' Start an effect on top of the ones already running. Returns the effect '''
+        now = self.clock()
+        if not self.effects:
+            self._last_time = now
+        self.effects.append([effect, now])
+        return effect
+
+    def remove(self, effect):
+        self.effects = [entry for entry in self.effects if entry[0] is not effect]
+
+    def clear(self):
+        self.effects = []
+
+    def render(self, base=None, now=None):
+        '''
+        Run every effect over base (an RGB array of the panel's size, or black) and return the
+        result as a uint8 RGB array. The array is reused for the next frame.
+        '''
+        if now is None:
+            now = self.clock()
+        dt = 0.0 if self._last_time is None else max(now - self._last_time, 0.0)
+        self._last_time = now
+
+        if base is None:
+            self.frame.fill(0)
+        else:
+            self.frame[:] = base
+        for effect, start in self.effects:
+            effect.apply(self.frame, now - start, dt)
+        self.effects = [[effect, start] for effect, start in self.effects if not effect.finished(now - start)]
+
+        np.clip(self.frame, 0, 255, out=self.frame)
+        np.add(self.frame, 0.5, out=self.frame)
+        np.copyto(self.output, self.frame, casting='unsafe')
+        self.version += 1
+        return self.output
+
+    def push(self, canvas, base=None, now=None):
+        ''' Render a frame and draw it onto canvas with one SetImage '''
+        canvas.SetImage(Image.fromarray(self.render(base, now)), 0, 0)
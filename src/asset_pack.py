@@ -0,0 +1,143 @@
+"""
+Precompiled pack of the clock's fonts and icons.
+
+Parsing the BDF fonts and decoding and converting every PNG takes a noticeable part of startup
+on a pi. This compiles them once into a single file: a small JSON header followed by the raw
+glyph atlases and RGB pixel arrays, which are memory mapped straight back in at startup. The
+header records the size and modification time of every source file, and a pack that doesn't
+match the sources any more is ignored so the clock falls back to loading them directly.
+
+Build it from the root of the project (it's also rebuilt by running this after changing assets):
+
+    python3 src/asset_pack.py
+"""
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from PIL import Image
+
+from glyph_atlas import GlyphAtlas
+
+ASSET_PACK_FILE = "resources/assets.pack"
+
+PACK_MAGIC = b'LEDPACK'
+PACK_FORMAT_VERSION = 2
+# Magic, format version and header length
+_PREAMBLE = struct.Struct('<7sBI')
+_ALIGNMENT = 16
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _load_image(path):
+    return np.asarray(Image.open(path).convert('RGB'))
+
+def build_pack(path, fonts, images):
+    '''
+    fonts: {name: bdf path}, images: {name: image path}
+    Writes the pack via a temp file so a running clock never sees half of one
+    '''
+    arrays = {}
+    header = {'sources': {}, 'fonts': {}, 'images': {}, 'arrays': {}}
+    for name, font_path in fonts.items():
+        atlas = GlyphAtlas(font_path)
+        arrays[f'font/{name}'] = atlas.atlas
+        header['fonts'][name] = {
+            'width': atlas.width,
+            'height': atlas.height,
+            'baseline': atlas.baseline,
+            'source': font_path,
+            'columns': {str(codepoint): list(columns) for codepoint, columns in atlas._columns.items()},
+        }
+        header['sources'][font_path] = _source_stamp(font_path)
+    for name, image_path in images.items():
+        arrays[f'image/{name}'] = _load_image(image_path)
+        header['images'][name] = {'array': f'image/{name}', 'source': image_path}
+        header['sources'][image_path] = _source_stamp(image_path)
+
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        offset += -(-array.nbytes//_ALIGNMENT)*_ALIGNMENT
+
+    encoded_header = json.dumps(header).encode()
+    data_start = -(-(_PREAMBLE.size + len(encoded_header))//_ALIGNMENT)*_ALIGNMENT
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(PACK_MAGIC, PACK_FORMAT_VERSION, len(encoded_header)))
+        f.write(encoded_header)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+class AssetPack:
+    def __init__(self, buffer, header, data_start):
+        self._buffer = buffer
+        self.header = header
+        self._data_start = data_start
+
+    def _array(self, name):
+        info = self.header['arrays'][name]
+        return np.frombuffer(self._buffer, dtype=np.dtype(info['dtype']),
+                             count=int(np.prod(info['shape'])),
+                             offset=self._data_start + info['offset']).reshape(info['shape'])
+
+    def font_atlas(self, name):
+        info = self.header['fonts'][name]
+        columns = {int(codepoint): tuple(columns) for codepoint, columns in info['columns'].items()}
+        return GlyphAtlas.from_table(info['width'], info['height'], info['baseline'],
+                                     self._array(f'font/{name}'), columns)
+
+    def image(self, name):
+        ''' Read-only RGB array of shape (height, width, 3) '''
+        return self._array(self.header['images'][name]['array'])
+
+def load_pack(path, fonts, images):
+    '''
+    Memory map the pack at path. Returns None if it's missing, from another format version or
+    stale, i.e. it wasn't built from exactly these fonts and images as they are on disk now.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, IOError, ValueError):
+        return None
+
+    try:
+        magic, version, header_length = _PREAMBLE.unpack_from(buffer)
+        if magic != PACK_MAGIC or version != PACK_FORMAT_VERSION:
+            return None
+        header = json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+    except (struct.error, ValueError):
+        return None
+
+    if set(header['fonts']) != set(fonts) or set(header['images']) != set(images):
+        return None
+    if any(header['fonts'][name]['source'] != path for name, path in fonts.items()):
+        return None
+    if any(header['images'][name]['source'] != path for name, path in images.items()):
+        return None
+    for source in list(fonts.values()) + list(images.values()):
+        try:
+            if header['sources'].get(source) != _source_stamp(source):
+                return None
+        except OSError:
+            return None
+
+    data_start = -(-(_PREAMBLE.size + header_length)//_ALIGNMENT)*_ALIGNMENT
+    return AssetPack(buffer, header, data_start)
+
+if __name__ == '__main__':
+    import time
+    from run_clock import FONT_FILES, image_files
+
+    start = time.perf_counter()
+    build_pack(ASSET_PACK_FILE, FONT_FILES, image_files())
+    print(f"Wrote {ASSET_PACK_FILE} ({os.path.getsize(ASSET_PACK_FILE)} bytes) "
+          f"in {1000*(time.perf_counter() - start):.1f} ms")
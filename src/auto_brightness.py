@@ -0,0 +1,156 @@
+"""
+Ambient light driven brightness and panel power profiles.
+
+The VEML7700's lux readings are smoothed (in log space, since perceived brightness is roughly
+logarithmic) and mapped through a configurable lux -> brightness curve. Hysteresis keeps a lamp
+flickering or someone walking past from making the panel pump. The smoothed lux also picks a
+power profile, which sets how many PWM bits the panel is refreshed with: in the dark there's no
+point spending CPU on 11 bits of color depth for a panel running at 10% brightness.
+"""
+import math
+import time
+
+import numpy as np
+
+from fade import LUMINANCE_LUT
+
+# (lux, brightness %) points, linearly interpolated over log10(lux + 1)
+DEFAULT_CURVE = [(0, 8), (5, 15), (50, 40), (300, 75), (1000, 100)]
+
+# Profiles from darkest to brightest. A profile is used while the smoothed lux is below max_lux.
+DEFAULT_PROFILES = [
+    {'name': 'night', 'max_lux': 5, 'pwm_bits': 7},
+    {'name': 'dim', 'max_lux': 100, 'pwm_bits': 9},
+    {'name': 'day', 'max_lux': None, 'pwm_bits': 11},
+]
+
+# Rough power model of a 64x32 panel: what it draws dark and with every LED full white
+PANEL_IDLE_WATTS = 0.6
+PANEL_FULL_WHITE_WATTS = 20.0
+
+def _log_lux(lux):
+    return math.log10(max(lux, 0) + 1)
+
+class AutoBrightness:
+    def __init__(self, curve=DEFAULT_CURVE, profiles=DEFAULT_PROFILES, smoothing_seconds=10,
+                 hysteresis=3, profile_hysteresis=0.15):
+        '''
+        hysteresis: how many brightness percentage points the curve has to move before the output follows
+        profile_hysteresis: how far past a profile's max_lux (as a fraction) the light has to go to switch
+        '''
+        self.curve = sorted((_log_lux(lux), brightness) for lux, brightness in curve)
+        self.profiles = profiles
+        self.smoothing_seconds = smoothing_seconds
+        self.hysteresis = hysteresis
+        self.profile_hysteresis = profile_hysteresis
+        self.lux = None
+        self.brightness = None
+        self.profile = profiles[-1]
+        self._log_lux = None
+        self._last_t = None
+
+    @classmethod
+    def from_config(cls, config):
+        ''' Built from the config's "auto_brightness" object, None if it isn't enabled '''
+        settings = config.get('auto_brightness')
+        if not settings or not settings.get('enabled', True):
+            return None
+        return cls(curve=settings.get('curve', DEFAULT_CURVE),
+                   profiles=settings.get('profiles', DEFAULT_PROFILES),
+                   smoothing_seconds=settings.get('smoothing_seconds', 10),
+                   hysteresis=settings.get('hysteresis', 3),
+                   profile_hysteresis=settings.get('profile_hysteresis', 0.15))
+
+    def _curve_at(self, log_lux):
+        points = self.curve
+        if log_lux <= points[0][0]:
+            return points[0][1]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            if log_lux <= x1:
+                return y0 + (y1 - y0)*(log_lux - x0)/(x1 - x0)
+        return points[-1][1]
+
+    def _pick_profile(self, lux):
+        ''' The profile for lux, sticking with the current one until lux is clearly past its boundary '''
+        current = self.profiles.index(self.profile)
+        candidate = len(self.profiles) - 1
+        for i, profile in enumerate(self.profiles):
+            if profile['max_lux'] is None or lux < profile['max_lux']:
+                candidate = i
+                break
+        if candidate > current:
+            # Brighter: must clear the current profile's max by the margin
+            if lux < self.profile['max_lux']*(1 + self.profile_hysteresis):
+                return self.profile
+        elif candidate < current:
+            # Darker: must drop below the candidate's max by the margin
+            if lux > self.profiles[candidate]['max_lux']*(1 - self.profile_hysteresis):
+                return self.profile
+        return self.profiles[candidate]
+
+    def update(self, lux, t=None):
+        ''' Feed a lux reading. Returns True if the brightness or profile changed '''
+        if lux is None:
+            return False
+        if t is None:
+            t = time.time()
+
+        sample = _log_lux(lux)
+        if self._log_lux is None:
+            self._log_lux = sample
+        else:
+            alpha = 1 - math.exp(-max(t - self._last_t, 0)/self.smoothing_seconds)
+            self._log_lux += alpha*(sample - self._log_lux)
+        self._last_t = t
+        self.lux = 10**self._log_lux - 1
+
+        changed = False
+        brightness = self._curve_at(self._log_lux)
+        if self.brightness is None or abs(brightness - self.brightness) >= self.hysteresis:
+            self.brightness = round(brightness)
+            changed = True
+
+        profile = self._pick_profile(self.lux)
+        if profile is not self.profile:
+            self.profile = profile
+            changed = True
+        return changed
+
+def estimate_panel_watts(frame_pixels, brightness, idle_watts=PANEL_IDLE_WATTS,
+                         full_white_watts=PANEL_FULL_WHITE_WATTS):
+    ''' LED current scales with the light emitted, i.e. the PWM duty cycle of every subpixel '''
+    brightness = min(max(int(round(brightness)), 0), 100)
+    lit_fraction = np.bincount(frame_pixels.ravel(), minlength=256) @ LUMINANCE_LUT[brightness]/(255*frame_pixels.size)
+    return idle_watts + full_white_watts*lit_fraction
+
+class PowerMonitor:
+    '''
+    Accumulates time, CPU and estimated panel energy per power profile. CPU is the process' CPU
+    time, which includes the rgbmatrix refresh thread since it runs inside this process.
+    '''
+    def __init__(self, clock=time.monotonic, cpu_clock=time.process_time):
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.totals = {}
+        self._last = None
+
+    def sample(self, profile_name, watts):
+        ''' Attribute the time since the last sample to the profile that was active '''
+        now, cpu = self.clock(), self.cpu_clock()
+        if self._last is not None:
+            last_now, last_cpu, last_profile, last_watts = self._last
+            totals = self.totals.setdefault(last_profile, {'seconds': 0.0, 'cpu_seconds': 0.0, 'joules': 0.0})
+            totals['seconds'] += now - last_now
+            totals['cpu_seconds'] += cpu - last_cpu
+            totals['joules'] += (now - last_now)*last_watts
+        self._last = (now, cpu, profile_name, watts)
+
+    def report(self):
+        lines = ["power profiles:"]
+        for name, totals in self.totals.items():
+            seconds = totals['seconds']
+            if seconds <= 0:
+                continue
+            lines.append(f"  {name:<8} {seconds:9.1f} s  cpu {100*totals['cpu_seconds']/seconds:5.1f}%"
+                         f"  panel ~{totals['joules']/seconds:5.2f} W")
+        return '\n'.join(lines)
@@ -0,0 +1,170 @@
+"""
+Benchmark the clock's render loop on the emulated display backend with fake data sources.
+Run from the root of the project:
+
+    python3 src/benchmark.py --frames 1000
+
+The timed frames run on a fixed time source that moves on a second every frame, with new sensor
+and weather data written before each one, so every frame redraws the time and every widget. That
+makes it the worst case frame rather than a typical one; --scheduled runs the real paced loop
+with the fake worker processes instead.
+"""
+import argparse
+import json
+import os
+import time
+
+import animation
+import emulated_matrix
+from fake_sources import fake_sensor_data, fake_internet_data, fake_socketio, sensor_readings, weather_readings
+from run_clock import LEDClock, CONFIG_FILE
+from time_source import FixedTime, SystemTime
+
+EXAMPLE_CONFIG_FILE = "example.config.json"
+
+# Effects that can be run over the clock while benchmarking, to time the animation engine
+ANIMATIONS = {
+    'sweep': lambda: animation.Sweep(),
+    'pulse': lambda: animation.Pulse(),
+    'scroll': lambda: animation.Scroll(),
+}
+
+# Panel geometries for --scaling as (rows, cols, chain_length, parallel)
+SCALING_GEOMETRIES = [(32, 64, 1, 1), (32, 64, 2, 2), (32, 64, 3, 2), (64, 64, 4, 2), (64, 64, 6, 3)]
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct/100*(len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def report(frame_times, stage_totals, total_time):
+    frame_count = len(frame_times)
+    frame_times = sorted(frame_times)
+    print(f"frames:       {frame_count}")
+    print(f"frames/sec:   {frame_count/total_time:.1f}")
+    print(f"frame p50:    {_percentile(frame_times, 50)*1000:.3f} ms")
+    print(f"frame p99:    {_percentile(frame_times, 99)*1000:.3f} ms")
+    print(f"frame max:    {frame_times[-1]*1000:.3f} ms")
+    print("per-stage mean:")
+    frame_total = sum(frame_times)
+    for name, total in sorted(stage_totals.items(), key=lambda item: -item[1]):
+        print(f"  {name:<10} {total/frame_count*1000:8.3f} ms  {100*total/frame_total:5.1f}%")
+
+def run_benchmark(clock, frames, warmup=10, seed=0):
+    '''
+    Time back to back frames of a clock built with a FixedTime and no workers. The wall clock
+    moves on a second every frame and the monotonic one by a frame at target_fps, so fades and
+    effects last as many frames as they would on the panel.
+    '''
+    time_source = clock.time_source
+    frame_interval = 1/clock.config.get('target_fps', 30)
+    sensor = sensor_readings(seed)
+    weather = weather_readings(seed)
+    clock.display_state.update({'enabled': True, 'brightness': 100})
+
+    def next_frame():
+        time_source.set(time_source.time() + 1, time_source.monotonic() + frame_interval, time_source.utc_offset())
+        clock.sensor_state.update(next(sensor))
+        clock.weather_state.update(next(weather))
+
+    for _ in range(warmup):
+        next_frame()
+        clock._draw_loop()
+
+    frame_times = []
+    stage_totals = {}
+    start = time.perf_counter()
+    for _ in range(frames):
+        next_frame()
+        frame_start = time.perf_counter()
+        clock._draw_loop()
+        frame_times.append(time.perf_counter() - frame_start)
+        for name, duration in clock.stage_timer.last_frame.items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + duration
+    total_time = time.perf_counter() - start
+
+    return frame_times, stage_totals, total_time
+
+def run_scheduled(clock, seconds):
+    ''' Run the real paced main loop for a while and report how much of it was idle '''
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        clock._tick()
+    print(clock.scheduler.report())
+    print(clock.power_monitor.report())
+
+def _fixed_time_clock(config_file=None, config=None):
+    ''' A clock with no workers on a FixedTime starting now, for run_benchmark() '''
+    system_time = SystemTime()
+    time_source = FixedTime(system_time.time(), system_time.monotonic(), system_time.utc_offset())
+    return LEDClock(backend=emulated_matrix, config_file=config_file, config=config, sensor_source=None,
+                    weather_source=None, socketio_source=None, weather_cache_file=None, time_source=time_source)
+
+def run_scaling(config_file, frames, warmup=10, effect=None):
+    '''
+    Time the worst case frame for each panel geometry. The face is drawn at its layout's size
+    and scaled up, so what grows with the panel is scaling it, animation effects and the SetImage.
+    '''
+    with open(config_file) as f:
+        config = json.load(f)
+    print(f"{'panel':<10}{'scale':>6}{'frames/sec':>12}{'p50':>12}{'p99':>12}")
+    for rows, cols, chain_length, parallel in SCALING_GEOMETRIES:
+        panel = {'rows': rows, 'cols': cols, 'chain_length': chain_length, 'parallel': parallel}
+        clock = _fixed_time_clock(config=dict(config, panel=panel))
+        if effect is not None:
+            clock.show(ANIMATIONS[effect]())
+        try:
+            frame_times, _, total_time = run_benchmark(clock, frames, warmup)
+        finally:
+            clock.stop()
+        frame_times.sort()
+        print(f"{f'{clock.matrix.width}x{clock.matrix.height}':<10}{clock.compositor.scale:>5}x"
+              f"{len(frame_times)/total_time:12.1f}{_percentile(frame_times, 50)*1000:9.3f} ms"
+              f"{_percentile(frame_times, 99)*1000:9.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=500, help='number of frames to time')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed frames to render first')
+    parser.add_argument('--config', default=None, help='config file (defaults to config.json, then example.config.json)')
+    parser.add_argument('--scheduled', type=float, default=None, metavar='SECONDS',
+                        help='instead of timing back to back frames, run the paced main loop for this long')
+    parser.add_argument('--dump-dir', default=None, help='write every frame to this directory as a PNG')
+    parser.add_argument('--animation', choices=ANIMATIONS, default=None,
+                        help='composite this effect over the clock for the whole run')
+    parser.add_argument('--scaling', action='store_true',
+                        help='time the clock on several panel sizes instead of the configured one')
+    args = parser.parse_args()
+
+    config_file = args.config
+    if config_file is None:
+        config_file = CONFIG_FILE if os.path.exists(CONFIG_FILE) else EXAMPLE_CONFIG_FILE
+    if args.scaling:
+        run_scaling(config_file, args.frames, args.warmup, args.animation)
+        return
+
+    if args.scheduled is not None:
+        clock = LEDClock(backend=emulated_matrix, config_file=config_file,
+                         sensor_source=fake_sensor_data,
+                         weather_source=fake_internet_data,
+                         socketio_source=fake_socketio,
+                         weather_cache_file=None)
+    else:
+        clock = _fixed_time_clock(config_file)
+    if args.dump_dir is not None:
+        os.makedirs(args.dump_dir, exist_ok=True)
+        clock.matrix.dump_dir = args.dump_dir
+    if args.animation is not None:
+        clock.show(ANIMATIONS[args.animation]())
+
+    try:
+        if args.scheduled is not None:
+            run_scheduled(clock, args.scheduled)
+        else:
+            report(*run_benchmark(clock, args.frames, args.warmup))
+    finally:
+        clock.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Layered frame compositor.
+
+Static images are prerendered once onto a background layer. Everything else is a widget with a
+fixed rect on top of it, and a widget is only redrawn when the key describing its inputs changes.
+The composed frame is then pushed to the panel with a single SetImage.
+
+The layout is composed at the size it was designed for. On a bigger panel the composed frame is
+scaled up by the largest whole factor that fits and centered.
+"""
+import numpy as np
+from PIL import Image
+
+from emulated_matrix import FrameCanvas
+
+class _Widget:
+    def __init__(self, x, y, width, height):
+        self.rect = (slice(y, y + height), slice(x, x + width))
+        self.key = None
+        self.dirty = True
+
+class Compositor:
+    def __init__(self, width, height, panel_width=None, panel_height=None):
+        ''' Compose a width x height layout for a panel of panel_width x panel_height (by default the same) '''
+        self.width = width
+        self.height = height
+        self.panel_width = panel_width or width
+        self.panel_height = panel_height or height
+        if self.panel_width < width or self.panel_height < height:
+            raise ValueError(f"A {width}x{height} layout doesn't fit on a {self.panel_width}x{self.panel_height} panel")
+        self.scale = min(self.panel_width//width, self.panel_height//height)
+        self.offset = ((self.panel_width - width*self.scale)//2, (self.panel_height - height*self.scale)//2)
+        self.background = FrameCanvas(width, height)
+        self.frame = FrameCanvas(width, height)
+        self._scratch = FrameCanvas(width, height)
+        self._widgets = {}
+        # Incremented whenever the composed frame changes
+        self.version = 0
+        self.redraw_count = 0
+        # The frame as it goes on the panel. When the layout fills the panel that's the frame itself
+        if (self.panel_width, self.panel_height) == (width, height):
+            self.panel_pixels = self.frame.pixels
+        else:
+            self.panel_pixels = np.zeros((self.panel_height, self.panel_width, 3), dtype=np.uint8)
+        self._scaled_version = None
+
+    def add_static_image(self, image, x, y):
+        ''' Draw an image that never changes onto the background layer '''
+        self.background.SetImage(image, x, y)
+        self.frame.SetImage(image, x, y)
+        self.version += 1
+
+    def add_widget(self, name, x, y, width, height):
+        ''' Reserve a rect for a widget. The widget can only draw inside of it '''
+        self._widgets[name] = _Widget(x, y, width, height)
+
+    def invalidate(self):
+        for widget in self._widgets.values():
+            widget.dirty = True
+
+    def update(self, name, key, draw):
+        '''
+        Redraw widget `name` with draw(layer) if `key` differs from the last drawn key.
+        The layer has the same API as a matrix canvas and starts out as the background.
+        Returns True if the widget was redrawn.
+        '''
+        widget = self._widgets[name]
+        if not widget.dirty and widget.key == key:
+            return False
+
+        layer = self._scratch
+        layer.pixels[widget.rect] = self.background.pixels[widget.rect]
+        draw(layer)
+        self.frame.pixels[widget.rect] = layer.pixels[widget.rect]
+
+        widget.key = key
+        widget.dirty = False
+        self.version += 1
+        self.redraw_count += 1
+        return True
+
+    def panel_frame(self):
+        ''' The composed frame as it goes on the panel, scaled up and centered '''
+        if self.panel_pixels is not self.frame.pixels and self._scaled_version != self.version:
+            x, y = self.offset
+            scaled = self.frame.pixels.repeat(self.scale, axis=0).repeat(self.scale, axis=1)
+            self.panel_pixels[y:y + scaled.shape[0], x:x + scaled.shape[1]] = scaled
+            self._scaled_version = self.version
+        return self.panel_pixels
+
+    def blit(self, canvas):
+        canvas.SetImage(Image.fromarray(self.panel_frame()), 0, 0)
@@ -0,0 +1,63 @@
+"""
+Software implementation of rgbmatrix.graphics, covering Color, Font, DrawText and DrawLine.
+Used by the emulated display backend and by the compositor to draw into in-memory layers.
+"""
+from glyph_atlas import GlyphAtlas
+from text_cache import TextCache
+
+class Color:
+    def __init__(self, red=0, green=0, blue=0):
+        self.red = red
+        self.green = green
+        self.blue = blue
+
+# Shared by every font, so any widget redrawing a string it has drawn before just copies pixels
+text_cache = TextCache()
+
+class Font:
+    def __init__(self):
+        self.atlas = None
+        self.width = 0
+        self.height = 0
+        self.baseline = 0
+
+    def LoadFont(self, path):
+        self.LoadAtlas(GlyphAtlas(path))
+
+    def LoadAtlas(self, atlas):
+        ''' Not in rgbmatrix: use an already built GlyphAtlas, e.g. from the asset pack '''
+        self.atlas = atlas
+        self.width = self.atlas.width
+        self.height = self.atlas.height
+        self.baseline = self.atlas.baseline
+
+    def CharacterWidth(self, char):
+        return self.atlas.character_width(char)
+
+    def DrawGlyph(self, canvas, x, y, color, char):
+        return DrawText(canvas, self, x, y, color, chr(char))
+
+def DrawText(canvas, font, x, y, color, text):
+    pixels, mask = text_cache.render(font.atlas, text, (color.red, color.green, color.blue))
+    canvas._blit_masked(pixels, mask, x, y - font.baseline)
+    return mask.shape[1]
+
+def DrawLine(canvas, x0, y0, x1, y1, color):
+    ''' Bresenham line, same as the rgbmatrix implementation '''
+    # rgbmatrix's binding takes ints, so floats get truncated on the way in
+    x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+        canvas.SetPixel(x0, y0, color.red, color.green, color.blue)
+        if x0 == x1 and y0 == y1:
+            break
+        e2 = 2*err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
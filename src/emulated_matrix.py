@@ -0,0 +1,113 @@
+"""
+In-memory stand-in for the rgbmatrix module so the clock can run (and be profiled) without a panel.
+Exposes RGBMatrix, RGBMatrixOptions and graphics just like `import rgbmatrix` does.
+"""
+import os
+
+import numpy as np
+
+import emulated_graphics as graphics
+from fade import DISPLAY_LUT
+
+class RGBMatrixOptions:
+    def __init__(self):
+        self.rows = 32
+        self.cols = 32
+        self.chain_length = 1
+        self.parallel = 1
+        self.brightness = 100
+        self.pwm_bits = 11
+        self.pwm_lsb_nanoseconds = 130
+        self.limit_refresh_rate_hz = 0
+        self.gpio_slowdown = 1
+        self.hardware_mapping = 'regular'
+        self.drop_privileges = True
+
+class FrameCanvas:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width, 3), dtype=np.uint8)
+
+    def Clear(self):
+        self.pixels[:] = 0
+
+    def Fill(self, red, green, blue):
+        self.pixels[:] = (red, green, blue)
+
+    def SetPixel(self, x, y, red, green, blue):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y, x] = (red, green, blue)
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        if getattr(image, 'mode', 'RGB') != 'RGB':
+            raise Exception('Currently, only RGB mode is supported for SetImage(). Please create images with mode "RGB" or convert first with image = image.convert("RGB").')
+        self._blit(np.asarray(image), offset_x, offset_y)
+
+    def _clip(self, width, height, x, y):
+        ''' Returns the destination and source slices of a width x height rect placed at x, y '''
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (slice(y0, y1), slice(x0, x1)), (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+
+    def _blit(self, pixels, x, y):
+        clipped = self._clip(pixels.shape[1], pixels.shape[0], x, y)
+        if clipped is not None:
+            dest, src = clipped
+            self.pixels[dest] = pixels[src][..., :3]
+
+    def _blit_masked(self, pixels, mask, x, y):
+        ''' Copy only the pixels that are set in mask '''
+        clipped = self._clip(mask.shape[1], mask.shape[0], x, y)
+        if clipped is not None:
+            dest, src = clipped
+            np.copyto(self.pixels[dest], pixels[src], where=mask[src][..., None])
+
+    def to_numpy(self):
+        return self.pixels.copy()
+
+    def save_png(self, path):
+        from PIL import Image
+        Image.fromarray(self.pixels).save(path)
+
+class RGBMatrix:
+    def __init__(self, options=None):
+        options = options or RGBMatrixOptions()
+        self.options = options
+        self.width = options.cols*options.chain_length
+        self.height = options.rows*options.parallel
+        self.brightness = options.brightness
+        self.pwmBits = options.pwm_bits
+        self.frame_count = 0
+        # When set, every swapped frame is written here as a PNG
+        self.dump_dir = None
+        self._front = FrameCanvas(self.width, self.height)
+
+    def CreateFrameCanvas(self):
+        return FrameCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction=1):
+        ''' Shows canvas and hands back the previous front buffer, like the real double buffering '''
+        previous, self._front = self._front, canvas
+        self.frame_count += 1
+        if self.dump_dir is not None:
+            canvas.save_png(os.path.join(self.dump_dir, f'frame_{self.frame_count:06d}.png'))
+        return previous
+
+    def displayed_frame(self):
+        ''' The frame currently on the (virtual) panel as an RGB array, dimmed by brightness like the panel would '''
+        return DISPLAY_LUT[min(max(int(round(self.brightness)), 0), 100)][self._front.pixels]
+
+    def Clear(self):
+        self._front.Clear()
+
+    def Fill(self, red, green, blue):
+        self._front.Fill(red, green, blue)
+
+    def SetPixel(self, x, y, red, green, blue):
+        self._front.SetPixel(x, y, red, green, blue)
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        self._front.SetImage(image, offset_x, offset_y, unsafe)
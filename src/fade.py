@@ -0,0 +1,90 @@
+"""
+Time based brightness fades.
+
+A fade runs for a fixed duration of monotonic time with an easing curve, so it looks the same
+whether the loop renders 5 or 60 frames during it.
+
+Brightness values are perceptual, like the rgbmatrix brightness which scales CIE lightness before
+converting to PWM duty. The precomputed lookup tables here turn (brightness, pixel value) into
+the light the panel actually emits (for power estimates) and into what a gamma 2.2 monitor needs
+to show the same thing (for the emulated panel), so dim frames look dim the way the panel does
+instead of being scaled linearly.
+"""
+import math
+import time
+
+import numpy as np
+
+DISPLAY_GAMMA = 2.2
+
+EASINGS = {
+    'linear': lambda x: x,
+    'ease_in': lambda x: x*x,
+    'ease_out': lambda x: 1 - (1 - x)**2,
+    'ease_in_out': lambda x: x*x*(3 - 2*x),
+    'sine': lambda x: (1 - math.cos(math.pi*x))/2,
+}
+
+def _cie1931_luminance(lightness):
+    ''' CIE 1931 lightness (0-100) to relative luminance (0-1), the same curve rgbmatrix corrects with '''
+    lightness = np.asarray(lightness, dtype=np.float64)
+    return np.where(lightness <= 8, lightness/902.3, ((lightness + 16)/116)**3)
+
+def _build_luminance_lut():
+    '''
+    LUT[brightness, value] is the luminance (0-255) a pixel value shows at a brightness in percent.
+    Like rgbmatrix, brightness scales the value in lightness before it's converted to luminance.
+    '''
+    brightness = np.arange(101, dtype=np.float64)[:, np.newaxis]
+    value = np.arange(256, dtype=np.float64)[np.newaxis, :]
+    return (255*_cie1931_luminance(value*brightness/255)).astype(np.float32)
+
+def _build_display_lut(gamma=DISPLAY_GAMMA):
+    ''' LUT[brightness, value] is value dimmed to brightness percent, encoded for a gamma 2.2 display '''
+    factor = _cie1931_luminance(np.arange(101, dtype=np.float64))**(1/gamma)
+    value = np.arange(256, dtype=np.float64)
+    return np.round(factor[:, np.newaxis]*value[np.newaxis, :]).astype(np.uint8)
+
+LUMINANCE_LUT = _build_luminance_lut()
+DISPLAY_LUT = _build_display_lut()
+
+class Fade:
+    def __init__(self, duration=0.75, easing='ease_in_out', value=0, clock=time.monotonic):
+        if easing not in EASINGS:
+            raise ValueError(f"Unknown easing {easing!r}, expected one of {', '.join(EASINGS)}")
+        self.duration = duration
+        self.easing = EASINGS[easing]
+        self.clock = clock
+        self.target = value
+        self._start_value = value
+        self._start_time = None
+
+    @classmethod
+    def from_config(cls, config, value=0, clock=time.monotonic):
+        settings = config.get('fade', {})
+        return cls(duration=settings.get('duration', 0.75), easing=settings.get('easing', 'ease_in_out'),
+                   value=value, clock=clock)
+
+    def start(self, target):
+        ''' Fade from wherever the current fade is now to target. Retargeting mid fade doesn't jump '''
+        if target == self.target:
+            return
+        now = self.clock()
+        self._start_value = self.value(now)
+        self._start_time = now
+        self.target = target
+
+    def value(self, now=None):
+        if self._start_time is None:
+            return self.target
+        if now is None:
+            now = self.clock()
+        progress = (now - self._start_time)/self.duration if self.duration > 0 else 1
+        if progress >= 1:
+            self._start_time = None
+            return self.target
+        return self._start_value + (self.target - self._start_value)*self.easing(max(progress, 0))
+
+    @property
+    def active(self):
+        return self._start_time is not None
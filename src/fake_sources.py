@@ -0,0 +1,58 @@
+"""
+Fake data sources that stand in for the I2C sensors, the weather APIs and the socketio client.
+They have the same signatures as the real worker functions in run_clock.py so they can be
+passed straight to LEDClock when running headless. The metrics mailboxes are accepted but left empty.
+They beat the supervisor's heartbeat like the real ones.
+"""
+import random
+import time
+
+FAKE_WEATHER_ICONS = ['01d', '02d', '03d', '04n', '10d', '13n', '50d', 'bogus']
+
+def sensor_readings(seed=0):
+    ''' Endless fake sensor readings that drift like real ones '''
+    rng = random.Random(seed)
+    sensor_data = {'temp': 70.0, 'humid': 40.0, 'co2': 600, 'light': 100.0}
+    while True:
+        sensor_data['temp'] += rng.uniform(-0.2, 0.2)
+        sensor_data['humid'] = min(max(sensor_data['humid'] + rng.uniform(-1, 1), 0), 100)
+        sensor_data['co2'] = min(max(sensor_data['co2'] + rng.randint(-50, 50), 400), 3000)
+        sensor_data['light'] = rng.uniform(0, 500)
+        yield dict(sensor_data)
+
+def weather_readings(seed=0):
+    ''' Endless random weather, covering every icon and AQI color '''
+    rng = random.Random(seed)
+    while True:
+        yield {
+            'temp': rng.uniform(-10, 110),
+            'low_temp': rng.uniform(-10, 60),
+            'high_temp': rng.uniform(60, 110),
+            'humid': rng.uniform(0, 100),
+            'icon': rng.choice(FAKE_WEATHER_ICONS),
+            'aqi': rng.randint(0, 300),
+            'aqi_color': (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)),
+        }
+
+def fake_sensor_data(sensor_state, metrics_state=None, heartbeat=None, interval=0.3, seed=0):
+    for values in sensor_readings(seed):
+        if heartbeat is not None:
+            heartbeat.beat()
+        sensor_state.update(values)
+        time.sleep(interval)
+
+def fake_internet_data(weather_state, metrics_state=None, cache_file=None, heartbeat=None, interval=2.0, seed=0):
+    for values in weather_readings(seed):
+        if heartbeat is not None:
+            heartbeat.beat()
+        weather_state.update(values)
+        time.sleep(interval)
+
+def fake_socketio(display_state, metrics_state=None, preview_frames=None, preview_control=None, display_acks=None,
+                  url=None, heartbeat=None, interval=5.0, seed=0):
+    rng = random.Random(seed)
+    while True:
+        if heartbeat is not None:
+            heartbeat.beat()
+        display_state.update({'enabled': True, 'brightness': rng.randint(10, 100)})
+        time.sleep(interval)
@@ -0,0 +1,46 @@
+import time
+
+class FrameScheduler:
+    '''
+    Paces the main loop to a target frame rate. The clock decides each slot whether anything
+    changed enough to render, and the scheduler sleeps until the next slot or wall-clock second.
+    Keeps counts of rendered vs skipped slots and how much time was spent idle.
+    '''
+    def __init__(self, target_fps):
+        self.frame_interval = 1/target_fps
+        self.rendered = 0
+        self.skipped = 0
+        self.render_time = 0.0
+        self.idle_time = 0.0
+        self.started = time.monotonic()
+        self._next_slot = self.started
+
+    def frame_rendered(self, duration):
+        self.rendered += 1
+        self.render_time += duration
+
+    def frame_skipped(self):
+        self.skipped += 1
+
+    def sleep(self):
+        ''' Sleep until the next frame slot, or just past the next wall-clock second if that's sooner '''
+        now = time.monotonic()
+        self._next_slot += self.frame_interval
+        if self._next_slot < now:
+            # Running behind, don't try to catch up with a burst of frames
+            self._next_slot = now
+
+        until_next_second = 1.0 - (time.time() % 1.0) + 0.001
+        delay = min(self._next_slot - now, until_next_second)
+        if delay > 0:
+            time.sleep(delay)
+            self.idle_time += delay
+
+    def idle_percent(self):
+        elapsed = time.monotonic() - self.started
+        return 100*self.idle_time/elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        mean_render = 1000*self.render_time/self.rendered if self.rendered else 0.0
+        return (f"rendered {self.rendered} frames, skipped {self.skipped}, "
+                f"idle {self.idle_percent():.1f}%, mean render {mean_render:.2f} ms")
@@ -0,0 +1,106 @@
+"""
+BDF fonts packed into NumPy glyph atlases.
+
+Each glyph is rasterized once into its own column strip of a single boolean array that is one
+line box tall, so rendering a string is just concatenating slices of the atlas.
+"""
+import numpy as np
+
+REPLACEMENT_CODEPOINT = 0xFFFD
+
+def parse_bdf(path):
+    '''
+    Parse a BDF font file the same way the rgbmatrix library does
+    Returns (font width, font height, baseline, {codepoint: (mask, y_offset, device_width)})
+    where mask is a boolean array of shape (glyph height, device width)
+    '''
+    width, height, baseline = 0, 0, 0
+    glyphs = {}
+    codepoint = None
+    device_width = 0
+    bbx = (0, 0, 0, 0)
+    rows = None
+
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            keyword = parts[0]
+            if keyword == 'FONTBOUNDINGBOX':
+                width = int(parts[1])
+                height = int(parts[2])
+                baseline = height + int(parts[4])
+            elif keyword == 'ENCODING':
+                codepoint = int(parts[1])
+            elif keyword == 'DWIDTH':
+                device_width = int(parts[1])
+            elif keyword == 'BBX':
+                bbx = tuple(int(p) for p in parts[1:5])
+            elif keyword == 'BITMAP':
+                rows = []
+            elif keyword == 'ENDCHAR':
+                glyph_width, glyph_height, x_offset, y_offset = bbx
+                # Rows are padded to whole bytes of the bounding box width, however many hex
+                # digits were written out
+                num_bits = -(-glyph_width//8)*8
+                mask = np.zeros((glyph_height, device_width), dtype=bool)
+                for y, bits in enumerate(rows[:glyph_height]):
+                    for x in range(device_width):
+                        bit = x - x_offset
+                        if 0 <= bit < num_bits and (bits >> (num_bits - 1 - bit)) & 1:
+                            mask[y, x] = True
+                glyphs[codepoint] = (mask, y_offset, device_width)
+                rows = None
+            elif rows is not None:
+                rows.append(int(keyword, 16))
+
+    return width, height, baseline, glyphs
+
+class GlyphAtlas:
+    def __init__(self, path):
+        self.width, self.height, self.baseline, glyphs = parse_bdf(path)
+
+        # Every glyph gets a strip one line box tall and device width wide, positioned relative
+        # to the baseline. Anything outside of the line box is clipped.
+        total_width = sum(device_width for _, _, device_width in glyphs.values())
+        self.atlas = np.zeros((self.height, total_width), dtype=bool)
+        self._columns = {}
+        x = 0
+        for codepoint, (mask, y_offset, device_width) in glyphs.items():
+            top = self.baseline - mask.shape[0] - y_offset
+            src_top = max(-top, 0)
+            dest_top = max(top, 0)
+            rows = min(mask.shape[0] - src_top, self.height - dest_top)
+            if rows > 0:
+                self.atlas[dest_top:dest_top + rows, x:x + device_width] = mask[src_top:src_top + rows]
+            self._columns[codepoint] = (x, x + device_width)
+            x += device_width
+
+    @classmethod
+    def from_table(cls, width, height, baseline, atlas, columns):
+        ''' An atlas from already rasterized glyphs, like the ones in the asset pack '''
+        self = cls.__new__(cls)
+        self.width, self.height, self.baseline = width, height, baseline
+        self.atlas = atlas
+        self._columns = columns
+        return self
+
+    def _glyph_columns(self, codepoint):
+        return self._columns.get(codepoint, self._columns.get(REPLACEMENT_CODEPOINT))
+
+    def character_width(self, codepoint):
+        ''' Device width of a glyph, or -1 if the font doesn't have it '''
+        columns = self._columns.get(codepoint)
+        return columns[1] - columns[0] if columns is not None else -1
+
+    def render(self, text):
+        ''' Returns a boolean mask of shape (line height, total advance) with the text drawn in it '''
+        strips = []
+        for char in text:
+            columns = self._glyph_columns(ord(char))
+            if columns is not None:
+                strips.append(self.atlas[:, columns[0]:columns[1]])
+        if not strips:
+            return np.zeros((self.height, 0), dtype=bool)
+        return np.concatenate(strips, axis=1)
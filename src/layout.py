@@ -0,0 +1,288 @@
+"""
+Declarative layout of the clock face.
+
+The layout is a list of widgets (static images, text fields, icons, the clock and the date),
+each with a position, a font or images and the inputs it shows, like "sensor.temp" or
+"time.seconds". It can be replaced with a "layout" list in the config file.
+
+At startup the layout is compiled into a RenderPlan that knows which widgets depend on which
+inputs. Every frame the clock hands it the current inputs, and only the widgets bound to an input
+that changed (or whose refresh interval ran out) are formatted and drawn again.
+"""
+from abc import ABC, abstractmethod
+
+import emulated_graphics as graphics
+
+WHITE = (255, 255, 255)
+# Shown instead of white when a widget's data is missing
+MISSING_COLOR = (81, 0, 255)
+
+# Inputs the clock provides on top of the weather.* and sensor.* mailbox fields
+TIME_INPUTS = ('time.hours_minutes', 'time.seconds', 'time.am_pm', 'time.date', 'time.daytime')
+DERIVED_INPUTS = ('weather.high_low_temp', 'sun.time', 'sun.is_sunrise')
+# True while the worker process a group of inputs comes from is down, see supervisor.py
+STALE_INPUTS = ('weather.stale', 'sensor.stale')
+
+# The size DEFAULT_LAYOUT is laid out for, a single 64x32 panel
+DEFAULT_LAYOUT_SIZE = (64, 32)
+DEFAULT_LAYOUT = [
+    {"type": "image", "image": "inside_humid", "x": 0, "y": 27},
+    {"type": "image", "image": "outside_humid", "x": 13, "y": 27},
+    {"type": "image", "image": "co2", "x": 27, "y": 27},
+    {"type": "image", "image": "aqi", "x": 49, "y": 27},
+    {"type": "image", "image": "inside_temp", "x": 49, "y": 0},
+    {"type": "image", "image": "outside_temp", "x": 49, "y": 7},
+
+    {"type": "clock", "name": "time", "show": "hours_minutes", "font": "time",
+     "x": -6, "y": 20, "rect": [0, 0, 37, 20]},
+    {"type": "clock", "name": "seconds", "show": "seconds", "font": "small",
+     "x": 37, "y": 19, "rect": [37, 14, 8, 5]},
+    {"type": "clock", "name": "am_pm", "show": "am_pm", "font": "am_pm",
+     "x": 45, "y": 18, "rect": [45, 14, 4, 4], "colors": {"A": [255, 255, 0], "P": [120, 120, 255]}},
+    {"type": "date", "name": "date", "font": "date", "center_x": 25, "y": 26, "rect": [0, 21, 46, 5]},
+
+    {"type": "icon", "name": "weather_icon", "bind": "weather.icon", "images": "weather",
+     "x": 37, "y": 1, "rect": [37, 1, 11, 11]},
+    {"type": "text", "name": "inside_temp", "bind": "sensor.temp", "digits": 2, "leading_space": True,
+     "font": "small", "x": 53, "y": 5, "rect": [54, 0, 10, 5]},
+    {"type": "text", "name": "outside_temp", "bind": "weather.temp", "digits": 2, "leading_space": True,
+     "font": "small", "x": 53, "y": 12, "rect": [54, 7, 10, 5]},
+    {"type": "icon", "name": "high_low_icon", "bind": "time.daytime",
+     "images": {"true": "high_temp", "false": "low_temp"}, "x": 49, "y": 14, "rect": [49, 14, 5, 5]},
+    {"type": "text", "name": "high_low_temp", "bind": "weather.high_low_temp", "digits": 2, "leading_space": True,
+     "font": "small", "x": 53, "y": 19, "rect": [54, 14, 10, 5]},
+    {"type": "icon", "name": "sun_icon", "bind": "sun.is_sunrise",
+     "images": {"true": "sunrise", "false": "sunset"}, "x": 46, "y": 22, "rect": [46, 22, 4, 3]},
+    {"type": "text", "name": "sun_time", "bind": "sun.time",
+     "font": "small", "x": 51, "y": 26, "rect": [51, 21, 13, 5]},
+    {"type": "text", "name": "inside_humid", "bind": "sensor.humid", "digits": 2,
+     "font": "small", "x": 4, "y": 32, "rect": [4, 27, 9, 5]},
+    {"type": "text", "name": "outside_humid", "bind": "weather.humid", "digits": 2,
+     "font": "small", "x": 17, "y": 32, "rect": [17, 27, 10, 5]},
+    {"type": "text", "name": "co2", "bind": "sensor.co2", "digits": 4, "color_map": "co2",
+     "font": "small", "x": 31, "y": 32, "rect": [31, 27, 18, 5]},
+    {"type": "text", "name": "aqi", "bind": "weather.aqi", "digits": 3, "color_bind": "weather.aqi_color",
+     "font": "small", "x": 53, "y": 32, "rect": [53, 27, 11, 5]},
+]
+
+def map_co2_color(co2):
+    if co2 < 1000:
+        return (96, 208, 62) # green
+    elif co2 < 2000:
+        return (245, 253, 84) # yellow
+    else:
+        return (234, 51, 36) # red
+
+COLOR_MAPS = {
+    'co2': map_co2_color,
+}
+
+def format_number(value, digits, leading_space=False):
+    ''' Returns (text, missing), zero padded to digits or question marks if value is None '''
+    if value is None:
+        output = "?"*digits
+        if leading_space:
+            output = " " + output
+        return output, True
+    output = str(round(float(value))).rjust(digits, '0')
+    if leading_space and value < pow(10, digits) and value >= 0:
+        output = " " + output
+    return output, False
+
+class _Widget(ABC):
+    ''' A widget bound to some inputs, drawn into its own rect of the compositor '''
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.rect = spec['rect']
+        # Redraw at least this often even if none of the inputs changed
+        self.refresh = spec.get('refresh')
+        self.next_refresh = 0
+        self.inputs = []
+
+    @abstractmethod
+    def update(self, compositor, inputs):
+        ''' Redraw the widget through compositor.update() from inputs. Returns True if it was redrawn '''
+
+class TextWidget(_Widget):
+    def __init__(self, spec, fonts):
+        super().__init__(spec)
+        self.font = fonts[spec['font']]
+        self.x, self.y = spec['x'], spec['y']
+        self.bind = spec['bind']
+        self.digits = spec.get('digits')
+        self.leading_space = spec.get('leading_space', False)
+        self.color = tuple(spec.get('color', WHITE))
+        self.missing_color = tuple(spec.get('missing_color', MISSING_COLOR))
+        # The color can come from another input, or from the value through one of COLOR_MAPS
+        self.color_bind = spec.get('color_bind')
+        self.color_map = COLOR_MAPS[spec['color_map']] if 'color_map' in spec else None
+        self.inputs = [self.bind] + ([self.color_bind] if self.color_bind else [])
+        # Values from a worker that's down are shown in the stale color until it's back
+        self.stale_bind = self.bind.split('.')[0] + '.stale'
+        if self.stale_bind in STALE_INPUTS:
+            self.inputs.append(self.stale_bind)
+        else:
+            self.stale_bind = None
+        self.stale_color = tuple(spec.get('stale_color', self.missing_color))
+
+    def text(self, inputs):
+        ''' Returns (text, color) '''
+        value = inputs.get(self.bind)
+        if self.digits is not None:
+            text, missing = format_number(value, self.digits, self.leading_space)
+        else:
+            text, missing = ("?" if value is None else str(value)), value is None
+        if missing:
+            return text, self.missing_color
+        if self.stale_bind is not None and inputs.get(self.stale_bind):
+            return text, self.stale_color
+        if self.color_bind is not None:
+            color = inputs.get(self.color_bind)
+            return text, (tuple(color) if color is not None else self.missing_color)
+        if self.color_map is not None:
+            return text, self.color_map(value)
+        return text, self.color
+
+    def draw(self, layer, text, color):
+        graphics.DrawText(layer, self.font, self.x, self.y, graphics.Color(*color), text)
+
+    def update(self, compositor, inputs):
+        text, color = self.text(inputs)
+        return compositor.update(self.name, (text,) + color, lambda layer: self.draw(layer, text, color))
+
+class ClockWidget(TextWidget):
+    ''' Part of the current time: "hours_minutes", "seconds" or "am_pm", colored per value with colors '''
+    def __init__(self, spec, fonts):
+        spec = dict(spec, bind=f"time.{spec['show']}")
+        super().__init__(spec, fonts)
+        self.colors = {text: tuple(color) for text, color in spec.get('colors', {}).items()}
+
+    def text(self, inputs):
+        text = inputs.get(self.bind)
+        return text, self.colors.get(text, self.color)
+
+class DateWidget(TextWidget):
+    ''' The date, centered on center_x '''
+    def __init__(self, spec, fonts):
+        spec = dict(spec, bind='time.date', x=spec['center_x'])
+        super().__init__(spec, fonts)
+
+    def text(self, inputs):
+        return inputs.get(self.bind), self.color
+
+    def draw(self, layer, text, color):
+        # Centered on the full bounding box of the last glyph rather than its advance
+        width = sum(self.font.CharacterWidth(ord(c)) for c in text[:-1]) + self.font.width
+        graphics.DrawText(layer, self.font, self.x - width//2, self.y, graphics.Color(*color), text)
+
+class IconWidget(_Widget):
+    ''' An image picked by the value of an input, falling back to the "default" image '''
+    def __init__(self, spec, images, image_tables):
+        super().__init__(spec)
+        self.x, self.y = spec['x'], spec['y']
+        self.bind = spec['bind']
+        table = spec['images']
+        if isinstance(table, str):
+            table = image_tables[table]
+        self.images = {value: images[name] for value, name in table.items()}
+        self.inputs = [self.bind]
+
+    def update(self, compositor, inputs):
+        value = inputs.get(self.bind)
+        key = str(value).lower() if isinstance(value, bool) else str(value)
+        image = self.images.get(key, self.images.get('default'))
+        if image is None:
+            return False
+        return compositor.update(self.name, id(image), lambda layer: layer.SetImage(image, self.x, self.y))
+
+class RenderPlan:
+    def __init__(self, static_images, widgets):
+        self.static_images = static_images
+        self.widgets = widgets
+        self._dependents = {}
+        for widget in widgets:
+            for name in widget.inputs:
+                self._dependents.setdefault(name, []).append(widget)
+        # Every input some widget is bound to
+        self.inputs = set(self._dependents)
+        self._values = {}
+        self._first = True
+
+    def uses(self, prefix):
+        ''' Whether any widget is bound to an input in a group like "sun" '''
+        return any(name.startswith(prefix + '.') for name in self.inputs)
+
+    def install(self, compositor):
+        ''' Prerender the static images and reserve a rect for every widget '''
+        for image, x, y in self.static_images:
+            compositor.add_static_image(image, x, y)
+        for widget in self.widgets:
+            compositor.add_widget(widget.name, *widget.rect)
+
+    def update(self, compositor, inputs, now):
+        '''
+        Update the widgets bound to inputs that changed since the last call, plus any due for a
+        refresh. Returns how many widgets were evaluated.
+        '''
+        if self._first:
+            due = set(self.widgets)
+            self._first = False
+        else:
+            due = set()
+            for name, dependents in self._dependents.items():
+                value = inputs.get(name)
+                if value != self._values.get(name):
+                    due.update(dependents)
+        for name in self.inputs:
+            self._values[name] = inputs.get(name)
+
+        evaluated = 0
+        for widget in self.widgets:
+            if widget.refresh is not None and now >= widget.next_refresh:
+                due.add(widget)
+            if widget in due:
+                widget.update(compositor, inputs)
+                if widget.refresh is not None:
+                    widget.next_refresh = now + widget.refresh
+                evaluated += 1
+        return evaluated
+
+def compile_layout(spec, fonts, images, image_tables, available_inputs):
+    '''
+    Check a layout and turn it into a RenderPlan. fonts and images are the loaded assets by name,
+    image_tables named {value: image name} tables icons can refer to, like "weather".
+    Raises ValueError naming the widget if something in it is wrong.
+    '''
+    static_images = []
+    widgets = []
+    names = set()
+    for index, widget_spec in enumerate(spec):
+        label = widget_spec.get('name', f"#{index}")
+        try:
+            kind = widget_spec['type']
+            if kind == 'image':
+                static_images.append((images[widget_spec['image']], widget_spec['x'], widget_spec['y']))
+                continue
+            elif kind == 'text':
+                widget = TextWidget(widget_spec, fonts)
+            elif kind == 'clock':
+                widget = ClockWidget(widget_spec, fonts)
+            elif kind == 'date':
+                widget = DateWidget(widget_spec, fonts)
+            elif kind == 'icon':
+                widget = IconWidget(widget_spec, images, image_tables)
+            else:
+                raise ValueError(f"unknown widget type {kind!r}")
+        except KeyError as e:
+            raise ValueError(f"Layout widget {label}: missing or unknown {e}")
+        except ValueError as e:
+            raise ValueError(f"Layout widget {label}: {e}")
+
+        if widget.name in names:
+            raise ValueError(f"Layout widget {label}: the name is used twice")
+        names.add(widget.name)
+        for name in widget.inputs:
+            if name not in available_inputs:
+                raise ValueError(f"Layout widget {label}: unknown input {name!r}")
+        widgets.append(widget)
+    return RenderPlan(static_images, widgets)
@@ -0,0 +1,128 @@
+"""
+Lightweight runtime metrics rendered in the Prometheus text exposition format.
+
+The worker processes publish their own numbers (HTTP and I2C latency, error counts) through
+shared memory mailboxes laid out by the *_metric_fields helpers below, and the renderer collects
+those together with its own frame timings into one snapshot that's handed to the webserver.
+"""
+import math
+
+# Seconds, from well under a frame at 30 fps up to a badly stalled loop
+TIMING_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0)
+# For things that take up to seconds, like a display change getting to the panel
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, buckets=TIMING_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class Metrics:
+    ''' A set of named metric families, each with samples keyed by their labels '''
+    def __init__(self, prefix='ledclock'):
+        self.prefix = prefix
+        # name: (type, help, {label tuple: value or Histogram})
+        self._families = {}
+
+    def _family(self, name, kind, help_text):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help_text, {})
+        return family[2]
+
+    def set(self, name, value, help_text='', kind='gauge', **labels):
+        self._family(name, kind, help_text)[tuple(labels.items())] = value
+
+    def observe(self, name, value, help_text='', buckets=TIMING_BUCKETS, **labels):
+        samples = self._family(name, 'histogram', help_text)
+        key = tuple(labels.items())
+        if key not in samples:
+            samples[key] = Histogram(buckets)
+        samples[key].observe(value)
+
+    def render(self):
+        ''' Everything in the Prometheus text format '''
+        lines = []
+        for name, (kind, help_text, samples) in self._families.items():
+            full_name = f'{self.prefix}_{name}'
+            if help_text:
+                lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for key, value in samples.items():
+                labels = dict(key)
+                if kind != 'histogram':
+                    lines.append(f'{full_name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    lines.append(f'{full_name}_bucket{_format_labels({**labels, "le": bound})} {cumulative}')
+                lines.append(f'{full_name}_bucket{_format_labels({**labels, "le": "+Inf"})} {value.count}')
+                lines.append(f'{full_name}_sum{_format_labels(labels)} {_format_value(value.sum)}')
+                lines.append(f'{full_name}_count{_format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+    def values(self):
+        ''' Flat {"name{labels}": value} of the gauges and counters, for the socketio event '''
+        flat = {}
+        for name, (kind, _, samples) in self._families.items():
+            if kind == 'histogram':
+                continue
+            for key, value in samples.items():
+                flat[f'{self.prefix}_{name}{_format_labels(dict(key))}'] = value
+        return flat
+
+def fetch_metric_fields(source_names):
+    ''' Mailbox layout the weather fetchers publish their HTTP metrics in '''
+    fields = {}
+    for name in source_names:
+        fields[f'{name}_requests'] = 'float'
+        fields[f'{name}_errors'] = 'float'
+        fields[f'{name}_http_status'] = 'float'
+        fields[f'{name}_http_latency'] = 'float'
+        fields[f'{name}_last_success'] = 'float'
+    return fields
+
+def sensor_metric_fields(device_names):
+    ''' Mailbox layout the sensor process publishes its I2C metrics in '''
+    fields = {}
+    for name in device_names:
+        fields[f'{name}_reads'] = 'float'
+        fields[f'{name}_errors'] = 'float'
+        fields[f'{name}_failures'] = 'float'
+        fields[f'{name}_latency'] = 'float'
+    return fields
+
+def sensor_history_fields(channel_names, window_names):
+    ''' Mailbox layout the sensor process publishes the stats from its history in '''
+    fields = {}
+    for name in channel_names:
+        fields[f'{name}_smoothed'] = 'float'
+        for window in window_names:
+            fields[f'{name}_{window}_min'] = 'float'
+            fields[f'{name}_{window}_max'] = 'float'
+            fields[f'{name}_{window}_trend'] = 'float'
+    return fields
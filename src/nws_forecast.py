@@ -0,0 +1,105 @@
+"""
+Parsing of the NWS forecastGridData payload.
+
+The gridpoint response is large and we only need a couple of its series, so instead of parsing
+the whole document the series are located in the raw text and only those objects are decoded.
+Each series is turned into a sorted index of (start, end, value) intervals so looking up the
+value valid at some time is a bisect.
+"""
+from bisect import bisect_right
+from datetime import datetime
+import json
+import re
+
+FORECAST_SERIES = ('minTemperature', 'maxTemperature')
+
+_DURATION_RE = re.compile(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?$')
+_decoder = json.JSONDecoder()
+
+def _to_f(c):
+    ''' Convert to farenheight '''
+    return (float(c)*9/5) + 32
+
+def parse_valid_time(valid_time):
+    '''
+    Convert an iso date string with duration to start and end unix timestamps
+    Example input: "2022-06-05T17:00:00+00:00/PT14H"
+    Returns (start, end) or None if it can't be parsed
+    '''
+    try:
+        start_str, duration_str = valid_time.split('/')
+        start = datetime.fromisoformat(start_str).timestamp()
+    except ValueError:
+        return None
+
+    match = _DURATION_RE.match(duration_str)
+    if not match:
+        return None
+    days, hours, minutes = (int(g) if g else 0 for g in match.groups())
+    return start, start + ((days*24 + hours)*60 + minutes)*60
+
+class IntervalIndex:
+    def __init__(self, intervals):
+        ''' intervals: iterable of (start, end, value) '''
+        intervals = sorted(intervals)
+        self.starts = [i[0] for i in intervals]
+        self.ends = [i[1] for i in intervals]
+        self.values = [i[2] for i in intervals]
+
+    def value_at(self, t):
+        '''
+        Value of the interval containing t. If t falls in a gap (like during the day for
+        overnight lows) the next upcoming interval's value is used instead.
+        '''
+        i = bisect_right(self.starts, t) - 1
+        if i >= 0 and t < self.ends[i]:
+            return self.values[i]
+        if i + 1 < len(self.starts):
+            return self.values[i + 1]
+        return None
+
+    def next_change(self, t):
+        ''' Timestamp after t at which value_at(t) might change, or None '''
+        i = bisect_right(self.starts, t) - 1
+        if i >= 0 and t < self.ends[i]:
+            return self.ends[i]
+        if i + 1 < len(self.starts):
+            return self.starts[i + 1]
+        return None
+
+    def to_list(self):
+        return list(zip(self.starts, self.ends, self.values))
+
+def _decode_series(text, name):
+    ''' Decode only the object following "name": in the feature's properties in the raw json text '''
+    key = f'"{name}"'
+    pos = text.find(key, max(text.find('"properties"'), 0))
+    if pos < 0:
+        raise KeyError(name)
+    pos = text.index(':', pos + len(key)) + 1
+    while text[pos] in ' \t\r\n':
+        pos += 1
+    series, _ = _decoder.raw_decode(text, pos)
+    return series
+
+def parse_forecast_grid(text, names=FORECAST_SERIES):
+    '''
+    Returns {series name: IntervalIndex} of temperature series in Fahrenheit
+    Raises KeyError or ValueError if the payload doesn't look right
+    '''
+    indexes = {}
+    for name in names:
+        intervals = []
+        for data_point in _decode_series(text, name)['values']:
+            valid = parse_valid_time(data_point['validTime'])
+            if valid is not None and data_point['value'] is not None:
+                intervals.append((valid[0], valid[1], _to_f(data_point['value'])))
+        indexes[name] = IntervalIndex(intervals)
+    return indexes
+
+def forecast_values(indexes, t):
+    ''' The low and high temperatures valid at time t, from {series name: IntervalIndex} '''
+    return {
+        'low_temp': indexes['minTemperature'].value_at(t),
+        'high_temp': indexes['maxTemperature'].value_at(t),
+    }
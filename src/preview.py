@@ -0,0 +1,100 @@
+"""
+Live preview of the panel for the web UI.
+
+The renderer hands the composed frame to the socketio process only while someone is watching,
+at a capped rate and only when the compositor says the frame changed. The socketio process then
+diffs it against the last frame it sent and only sends the 8x8 tiles that changed (merged into
+horizontal runs), with a full keyframe whenever a new viewer joins.
+"""
+import base64
+
+import numpy as np
+
+from fade import DISPLAY_LUT
+
+TILE_SIZE = 8
+
+# Layout of the mailboxes between the renderer and the socketio process
+PREVIEW_CONTROL_FIELDS = {
+    'viewers': 'float',
+}
+
+def preview_frame_fields(width, height):
+    ''' Mailbox layout for the frames of a width x height panel, with room for a whole base64 frame '''
+    return {
+        # base64 takes 4 characters for every 3 bytes, one pixel
+        'frame': ('text', 4*width*height),
+        'width': 'float',
+        'height': 'float',
+        'brightness': 'float',
+    }
+
+def pack_frame(pixels):
+    return base64.b64encode(np.ascontiguousarray(pixels).tobytes()).decode()
+
+def unpack_frame(text, width, height):
+    return np.frombuffer(base64.b64decode(text), dtype=np.uint8).reshape(height, width, 3)
+
+def changed_rects(frame, previous, tile=TILE_SIZE):
+    ''' (x, y, width, height) of the tiles that differ, adjacent ones in a row merged together '''
+    height, width, _ = frame.shape
+    rows, cols = -(-height//tile), -(-width//tile)
+    changed = np.zeros((rows*tile, cols*tile), dtype=bool)
+    changed[:height, :width] = (frame != previous).any(axis=2)
+    dirty = changed.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    rects = []
+    for row in range(rows):
+        col = 0
+        while col < cols:
+            if not dirty[row, col]:
+                col += 1
+                continue
+            start = col
+            while col < cols and dirty[row, col]:
+                col += 1
+            x, y = start*tile, row*tile
+            rects.append((x, y, min(col*tile, width) - x, min(tile, height - y)))
+    return rects
+
+class PreviewStreamer:
+    ''' Turns a sequence of frames into keyframe/delta messages for the web UI '''
+    def __init__(self):
+        self.previous = None
+        self.seq = 0
+        self.brightness = None
+        self.keyframe_requested = True
+
+    def message(self, frame, brightness):
+        ''' The message to send for frame, or None if it looks the same as the last one sent '''
+        keyframe = self.keyframe_requested or self.previous is None or self.previous.shape != frame.shape
+        if keyframe:
+            height, width, _ = frame.shape
+            rects = [(0, 0, width, height)]
+        else:
+            rects = changed_rects(frame, self.previous)
+            if not rects and brightness == self.brightness:
+                return None
+
+        self.previous = frame
+        self.brightness = brightness
+        self.keyframe_requested = False
+        self.seq += 1
+        level = min(max(int(round(brightness)), 0), 100)
+        return {
+            'seq': self.seq,
+            'key': keyframe,
+            'width': frame.shape[1],
+            'height': frame.shape[0],
+            # How bright full white looks at this brightness on a normal screen, for a CSS filter
+            'brightness': int(DISPLAY_LUT[level, 255])/255,
+            'rects': [[x, y, w, h, pack_frame(frame[y:y + h, x:x + w])] for x, y, w, h in rects],
+        }
+
+    def keyframe(self):
+        ''' A keyframe of the last frame, for a viewer that just joined '''
+        if self.previous is None:
+            self.keyframe_requested = True
+            return None
+        self.keyframe_requested = True
+        return self.message(self.previous, self.brightness)
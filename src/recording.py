@@ -0,0 +1,92 @@
+"""
+Record the clock's inputs so a run can be replayed frame for frame, see replay.py.
+
+A recording is a gzipped file of JSON lines. The first line is the config the clock ran with
+(without API keys and URLs), then there's a line for every rendered frame with the wall clock
+time "t", the monotonic time since recording started "m", the UTC offset "z" and, for every
+mailbox written since the previous frame, its values and their timestamps:
+
+    {"t": 1700000000.02, "m": 0.51, "z": -21600, "sensor": [{"temp": 70.1, ...}, {"temp": 1700000000.0, ...}]}
+
+When a worker goes down or comes back up the frame also has "stale", {input group: stale}.
+
+A frame with nothing new is about 50 bytes before compression, so a day at one frame a second
+is a few hundred KB on disk.
+"""
+import gzip
+import json
+import os
+import time
+
+RECORDING_EXTENSION = '.jsonl.gz'
+RECORDING_VERSION = 1
+# The mailboxes recorded, in the order they're fed back in
+MAILBOXES = ('weather', 'sensor', 'display')
+# Seconds between flushes, so a crash or power cut loses at most this much
+FLUSH_INTERVAL = 30
+
+def public_config(config):
+    ''' The config without API keys, URLs or the recording settings '''
+    return {key: value for key, value in config.items()
+            if not key.endswith('_key') and key not in ('api_urls', 'record_dir')}
+
+class InputRecorder:
+    def __init__(self, path, config, time_source):
+        self.path = path
+        self.time_source = time_source
+        self.start = time_source.monotonic()
+        self.next_flush = self.start + FLUSH_INTERVAL
+        self.frames = 0
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._write({'version': RECORDING_VERSION, 'start': time_source.time(), 'z': time_source.utc_offset(),
+                     'config': public_config(config)})
+
+    @classmethod
+    def in_directory(cls, directory, config, time_source):
+        ''' Start a new recording in directory, named after the local time it starts at '''
+        os.makedirs(directory, exist_ok=True)
+        name = time.strftime('%Y%m%d-%H%M%S', time.localtime(time_source.time())) + RECORDING_EXTENSION
+        return cls(os.path.join(directory, name), config, time_source)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def record(self, snapshots):
+        '''
+        Log one frame. snapshots is {mailbox: (values, timestamps)} for the mailboxes written
+        since the previous frame, plus "stale" if that changed.
+        '''
+        monotonic = self.time_source.monotonic()
+        record = {'t': round(self.time_source.time(), 3), 'm': round(monotonic - self.start, 4),
+                  'z': self.time_source.utc_offset()}
+        for name, snapshot in snapshots.items():
+            record[name] = list(snapshot) if name in MAILBOXES else snapshot
+        self._write(record)
+        self.frames += 1
+        if monotonic >= self.next_flush:
+            self.next_flush = monotonic + FLUSH_INTERVAL
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def read_recording(path):
+    ''' Returns (header, frames) where frames is a generator of the frame records in order '''
+    f = gzip.open(path, 'rt', encoding='utf-8')
+    header = json.loads(f.readline())
+    if header.get('version') != RECORDING_VERSION:
+        f.close()
+        raise ValueError(f"{path} is a version {header.get('version')} recording, "
+                         f"expected version {RECORDING_VERSION}")
+
+    def frames():
+        with f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except (EOFError, json.JSONDecodeError):
+                # A recording that was cut off mid write, e.g. by a power cut
+                return
+    return header, frames()
@@ -0,0 +1,275 @@
+"""
+Replay recorded clock inputs at full speed, check every frame against golden frames and report
+what each frame cost to render. Run from the root of the project:
+
+    python3 src/replay.py recordings/20240614-055945.jsonl.gz --golden golden/day1 --update
+    python3 src/replay.py recordings/20240614-055945.jsonl.gz --golden golden/day1
+
+Set "record_dir" in the config file to record the inputs of every frame the clock renders. The
+clock is rebuilt from the recorded config on the emulated panel, and its time comes from the
+recording, so a replay renders exactly the same frames on any machine. --make-corpus writes a
+short synthetic recording of the states that are easy to get wrong.
+
+The golden frames are a hash of every frame's pixels plus its brightness, in golden.json, and a
+PNG of every --png-every'th frame to look at. The replay exits with status 1 if any frame differs.
+"""
+import argparse
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import hashlib
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+import emulated_matrix
+from benchmark import report
+from recording import InputRecorder, MAILBOXES, read_recording
+from run_clock import LEDClock, CONFIG_FILE, DISPLAY_FIELDS, SENSOR_FIELDS, WEATHER_FIELDS
+from time_source import FixedTime
+
+GOLDEN_FILE = 'golden.json'
+EXAMPLE_CONFIG_FILE = "example.config.json"
+
+@contextmanager
+def _utc_offset(offset):
+    '''
+    Run in a fixed time zone offset from UTC. The sunrise and sunset times are converted with the
+    process' time zone, so it has to be the recorded one.
+    '''
+    previous = os.environ.get('TZ')
+    hours, seconds = divmod(abs(offset), 3600)
+    # POSIX TZ offsets are the hours to add to local time to get UTC, the opposite sign
+    os.environ['TZ'] = f"REC{'-' if offset >= 0 else '+'}{hours}:{seconds//60:02d}"
+    time.tzset()
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = previous
+        time.tzset()
+
+def _feed(state, values, timestamps):
+    ''' Write recorded values into a mailbox, in as many updates as there were distinct timestamps '''
+    by_timestamp = {}
+    for name, timestamp in timestamps.items():
+        if timestamp:
+            by_timestamp.setdefault(timestamp, {})[name] = values[name]
+    for timestamp, fields in sorted(by_timestamp.items()):
+        state.update(fields, timestamp)
+
+def frame_hash(pixels, brightness):
+    return f"{hashlib.sha1(pixels.tobytes()).hexdigest()[:16]}/{brightness}"
+
+def replay(path, config_overrides=None):
+    '''
+    Render every frame of a recording. Yields (local time, clock, render seconds) after each
+    frame, with the frame in clock.panel_pixels.
+    '''
+    header, frames = read_recording(path)
+    config = dict(header['config'], **(config_overrides or {}))
+    config.pop('record_dir', None)
+    time_source = FixedTime(header['start'], 0.0, header['z'])
+
+    with _utc_offset(header['z']):
+        clock = LEDClock(backend=emulated_matrix, config=config, sensor_source=None, weather_source=None,
+                         socketio_source=None, weather_cache_file=None, time_source=time_source)
+        states = {'weather': clock.weather_state, 'sensor': clock.sensor_state, 'display': clock.display_state}
+        try:
+            for record in frames:
+                time_source.set(record['t'], record['m'], record['z'])
+                for name in MAILBOXES:
+                    if name in record:
+                        _feed(states[name], *record[name])
+                if 'stale' in record:
+                    clock.stale = record['stale']
+                start = time.perf_counter()
+                clock._draw_loop()
+                yield time_source.now(), clock, time.perf_counter() - start
+        finally:
+            clock.stop()
+
+def _png_name(index):
+    return f'frame_{index:06d}.png'
+
+def make_corpus(path, config, utc_offset=0, day=date(2024, 6, 14)):
+    '''
+    Write a synthetic recording that goes through the states that are easy to get wrong: missing
+    data, every CO2 and AQI color, negative and 3 digit numbers, the switches between the high
+    and low temperature, noon, midnight and brightness fades
+    '''
+    def before(text, seconds):
+        ''' The local time some seconds before a "%H:%M" time on day '''
+        return datetime.combine(day, datetime.strptime(text, '%H:%M').time()) - timedelta(seconds=seconds)
+
+    time_source = FixedTime(utc_offset=utc_offset)
+    epoch = datetime(1970, 1, 1)
+    now = {'local': before(config['high_temp_start'], 15), 'monotonic': 0.0}
+
+    def wall():
+        return (now['local'] - epoch).total_seconds() - utc_offset
+
+    time_source.set(wall(), 0.0, utc_offset)
+    recorder = InputRecorder(path, config, time_source)
+    fields = {'weather': WEATHER_FIELDS, 'sensor': SENSOR_FIELDS, 'display': DISPLAY_FIELDS}
+    values = {name: dict.fromkeys(fields[name]) for name in MAILBOXES}
+    timestamps = {name: dict.fromkeys(fields[name], 0.0) for name in MAILBOXES}
+    written = set()
+
+    def write(mailbox, **changes):
+        values[mailbox].update(changes)
+        timestamps[mailbox].update(dict.fromkeys(changes, round(wall(), 3)))
+        written.add(mailbox)
+
+    def run(seconds, fps=1):
+        for _ in range(round(seconds*fps)):
+            time_source.set(wall(), now['monotonic'], utc_offset)
+            recorder.record({name: (dict(values[name]), dict(timestamps[name])) for name in written})
+            written.clear()
+            now['local'] += timedelta(seconds=1/fps)
+            now['monotonic'] += 1/fps
+
+    # Nothing has arrived yet, then the sensors and the web UI, then part of the weather
+    run(3)
+    write('display', enabled=True, brightness=100)
+    write('sensor', temp=71.6, humid=38.2, co2=640, light=150)
+    run(3)
+    write('weather', temp=58.3, humid=81)
+    run(3)
+    # The rest of the weather, on the way past high_temp_start
+    write('weather', low_temp=52.1, high_temp=77.9, icon='01d', aqi=42, aqi_color=(0, 228, 0))
+    run(10)
+
+    for co2 in (999, 1000, 1999, 2000, 9999):
+        write('sensor', co2=co2)
+        run(2)
+    for aqi, color in ((75, (255, 255, 0)), (130, (255, 126, 0)), (180, (255, 0, 0)),
+                       (250, (143, 63, 151)), (420, (126, 0, 35)), (60, None)):
+        write('weather', aqi=aqi, aqi_color=color)
+        run(2)
+    for temp, humid, icon in ((-4.6, 100, '13n'), (104.5, 0, '10d'), (9.5, 5, '50d'), (0, 99.6, 'bogus')):
+        write('weather', temp=temp, humid=humid, icon=icon)
+        write('sensor', temp=temp, humid=humid)
+        run(2)
+
+    # Brightness fades from the web UI and the light sensor, at the full frame rate
+    fps = config.get('target_fps', 30)
+    write('display', brightness=30)
+    run(1.5, fps)
+    write('display', enabled=False)
+    run(1.5, fps)
+    write('display', enabled=True, brightness=100)
+    run(1.5, fps)
+    write('sensor', light=2)
+    run(1.5, fps)
+    write('sensor', light=400)
+    run(1.5, fps)
+
+    # The wall clock jumps ahead to each of these, the monotonic time carries on
+    for text in ('12:00', config['high_temp_end']):
+        now['local'] = before(text, 3)
+        run(6)
+    now['local'] = datetime.combine(day + timedelta(days=1), datetime.min.time()) - timedelta(seconds=3)
+    run(6)
+    recorder.close()
+    return recorder.frames
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='recording to replay, or to write with --make-corpus')
+    parser.add_argument('--golden', default=None, metavar='DIR', help='directory of golden frames to check against')
+    parser.add_argument('--update', action='store_true', help='write the replayed frames as the golden frames')
+    parser.add_argument('--png-every', type=int, default=60, metavar='N',
+                        help='with --update, save every Nth golden frame as a PNG (default 60)')
+    parser.add_argument('--dump-dir', default=None, help='write frames that differ from the golden ones here as PNGs')
+    parser.add_argument('--config', default=None,
+                        help='config file whose settings replace the recorded ones, e.g. to try a new layout')
+    parser.add_argument('--slowest', type=int, default=10, help='list this many of the slowest frames')
+    parser.add_argument('--make-corpus', action='store_true',
+                        help='write a synthetic recording to test with instead of replaying one')
+    args = parser.parse_args()
+
+    overrides = None
+    if args.config is not None:
+        with open(args.config) as f:
+            overrides = json.load(f)
+
+    if args.make_corpus:
+        config_file = CONFIG_FILE if os.path.exists(CONFIG_FILE) else EXAMPLE_CONFIG_FILE
+        with open(config_file) as f:
+            config = dict(json.load(f), **(overrides or {}))
+        frames = make_corpus(args.recording, config)
+        print(f"Wrote {frames} frames to {args.recording}")
+        return
+
+    golden = None
+    golden_file = None
+    if args.golden is not None:
+        golden_file = os.path.join(args.golden, GOLDEN_FILE)
+        if args.update:
+            os.makedirs(args.golden, exist_ok=True)
+            for name in os.listdir(args.golden):
+                if name.startswith('frame_') and name.endswith('.png'):
+                    os.remove(os.path.join(args.golden, name))
+        else:
+            with open(golden_file) as f:
+                golden = json.load(f)['frames']
+    if args.dump_dir is not None:
+        os.makedirs(args.dump_dir, exist_ok=True)
+
+    hashes = []
+    mismatches = []
+    frame_times = []
+    frame_starts = []
+    stage_totals = {}
+    start = time.perf_counter()
+    for index, (local_time, clock, seconds) in enumerate(replay(args.recording, overrides)):
+        frame_times.append(seconds)
+        frame_starts.append(local_time)
+        for name, duration in clock.stage_timer.last_frame.items():
+            stage_totals[name] = stage_totals.get(name, 0.0) + duration
+
+        if args.golden is None:
+            continue
+        digest = frame_hash(clock.panel_pixels, clock.brightness)
+        hashes.append(digest)
+        if args.update:
+            if index % args.png_every == 0:
+                Image.fromarray(clock.panel_pixels).save(os.path.join(args.golden, _png_name(index)))
+        elif index >= len(golden) or golden[index] != digest:
+            mismatches.append((index, local_time))
+            if args.dump_dir is not None:
+                Image.fromarray(clock.panel_pixels).save(os.path.join(args.dump_dir, _png_name(index)))
+    total_time = time.perf_counter() - start
+
+    if not frame_times:
+        print(f"{args.recording} has no frames")
+        return
+    report(frame_times, stage_totals, total_time)
+    print("slowest frames:")
+    slowest = sorted(range(len(frame_times)), key=lambda i: -frame_times[i])[:args.slowest]
+    for index in slowest:
+        print(f"  #{index:<7} {frame_starts[index]:%Y-%m-%d %H:%M:%S.%f}  {frame_times[index]*1000:8.3f} ms")
+
+    if args.golden is None:
+        return
+    if args.update:
+        with open(golden_file, 'w') as f:
+            json.dump({'recording': os.path.basename(args.recording), 'frames': hashes}, f, indent=0)
+        print(f"Wrote {len(hashes)} golden frames to {args.golden}")
+        return
+
+    if len(golden) != len(hashes):
+        print(f"The recording has {len(hashes)} frames but there are {len(golden)} golden ones")
+    print(f"{len(mismatches)} of {len(hashes)} frames differ from {args.golden}")
+    for index, local_time in mismatches[:20]:
+        print(f"  #{index:<7} {local_time:%Y-%m-%d %H:%M:%S.%f}")
+    if mismatches or len(golden) != len(hashes):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,72 @@
 import time
-from datetime import datetime, timedelta
+_IMPORT_TIME = time.perf_counter()
+from collections import deque
+from datetime import datetime
 import json
-import queue
-import multiprocessing
-import re
+import os
 import sys
-
-from dateutil.tz import tzlocal
-import ephem
-import requests
-from rgbmatrix import RGBMatrix, RGBMatrixOptions, graphics
-from PIL import Image, ImageOps
-from bdfparser import Font
-import board
-import socketio
-
-import adafruit_sht31d as sht31d
-import adafruit_sgp30 as sgp30
-import adafruit_veml7700 as veml7700
+import threading
+
+from PIL import Image
+
+# Only what the renderer needs is imported here. socketio, requests, ephem and the sensor
+# libraries are slow to import, so they're imported by the worker processes that use them, or on
+# first use, after the first frame is on the panel.
+import emulated_graphics as graphics
+from animation import AnimationEngine
+from asset_pack import ASSET_PACK_FILE, load_pack
+from auto_brightness import AutoBrightness, PowerMonitor, estimate_panel_watts
+from fade import Fade
+from compositor import Compositor
+from frame_scheduler import FrameScheduler
+from layout import DEFAULT_LAYOUT, DEFAULT_LAYOUT_SIZE, DERIVED_INPUTS, STALE_INPUTS, TIME_INPUTS, compile_layout
+from metrics import LATENCY_BUCKETS, Metrics, fetch_metric_fields, sensor_history_fields, sensor_metric_fields
+from preview import PREVIEW_CONTROL_FIELDS, PreviewStreamer, pack_frame, preview_frame_fields, unpack_frame
+from sensor_history import SensorHistory, WINDOWS as HISTORY_WINDOWS
+from shared_state import SharedState
+from stage_timer import StageTimer
+from supervisor import Supervisor
+from time_source import SystemTime
+from weather_cache import WeatherCache, WEATHER_CACHE_FILE, WEATHER_SOURCES
+
+_IMPORTS_DONE = time.perf_counter()
 
 CONFIG_FILE = "config.json"
 SENSOR_BASELINES_FILE = "baselines.txt"
+SENSOR_HISTORY_SAVE_INTERVAL = 60*10
+SENSOR_BASELINE_SAVE_INTERVAL = 60*60
+
+# Seconds between reads of each sensor. The SGP30's baseline algorithm expects a reading every second.
+SENSOR_INTERVALS = {
+    'sht31d': 2,
+    'sgp30': 1,
+    'veml7700': 0.3,
+    'history': 10,
+}
+SENSOR_DEVICES = ('sht31d', 'sgp30', 'veml7700')
+
+# Seconds a worker can go without a heartbeat, including at startup, before it's restarted
+WORKER_HANG_TIMEOUTS = {
+    'internet': 15,
+    'sensor': 10,
+    'socketio': 10,
+}
+# The worker each group of layout inputs comes from
+STALE_WORKERS = {
+    'weather': 'internet',
+    'sensor': 'sensor',
+}
 
-WEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={key}&units=imperial"
-PURPLEAIR_API_URL = "https://ethanj.me/aqi/api?lat={lat}&lon={lon}&radius=2&correction=none"
-NWS_GRIDPOINT_API_URL = "https://api.weather.gov/points/{lat},{lon}"
+# Seconds between metrics snapshots handed to the webserver
+METRICS_INTERVAL = 5
+
+WEBSERVER_URL = 'http://localhost'
+
+# How often the socketio process checks the mailboxes for metrics and preview frames to send
+SOCKETIO_POLL_INTERVAL = 0.05
+# Seconds between attempts to connect to the webserver, doubling from min to max
+SOCKETIO_RETRY_MIN = 0.1
+SOCKETIO_RETRY_MAX = 2
 
 EMPTY_WEATHER_DATA = {
     'temp': None,
@@ -42,7 +84,64 @@ EMPTY_SENSOR_DATA = {
     'co2': None,
 }
 
+# Layouts of the shared memory mailboxes the worker processes write into
+WEATHER_FIELDS = {
+    'temp': 'float',
+    'low_temp': 'float',
+    'high_temp': 'float',
+    'humid': 'float',
+    'icon': 'str',
+    'aqi': 'float',
+    'aqi_color': 'rgb',
+}
+
+SENSOR_FIELDS = {
+    'humid': 'float',
+    'temp': 'float',
+    'co2': 'float',
+    'light': 'float',
+}
+
+DISPLAY_FIELDS = {
+    'enabled': 'bool',
+    'brightness': 'float',
+    # The webserver's version of the state, acknowledged back to it once it's on the panel
+    'version': 'float',
+}
+# The last ACK_HISTORY acknowledgements as JSON, so the socketio process can't miss one
+DISPLAY_ACK_FIELDS = {
+    'payload': 'text',
+}
+ACK_HISTORY = 16
+
+WEATHER_METRIC_FIELDS = fetch_metric_fields(WEATHER_SOURCES)
+SENSOR_METRIC_FIELDS = dict(sensor_metric_fields(SENSOR_DEVICES), **sensor_history_fields(SENSOR_FIELDS, HISTORY_WINDOWS))
+METRICS_EXPORT_FIELDS = {
+    'payload': 'text',
+}
+
 WEATHER_ICONS_PATH = 'resources/weather_icons/'
+SYMBOL_ICONS_PATH = 'resources/symbol_icons/'
+
+FONT_FILES = {
+    'time': 'resources/fonts/8x20_numerics.bdf',
+    'small': 'resources/fonts/3x5_numerics.bdf',
+    'date': 'resources/fonts/4x5_text.bdf',
+    'am_pm': 'resources/fonts/am_pm.bdf',
+}
+
+SYMBOL_ICONS = {
+    'inside_humid': 'inside_humid.png',
+    'outside_humid': 'outside_humid.png',
+    'co2': 'co2.png',
+    'aqi': 'aqi.png',
+    'inside_temp': 'inside_temp.png',
+    'outside_temp': 'outside_temp.png',
+    'high_temp': 'high_temp-color.png',
+    'low_temp': 'low_temp-color.png',
+    'sunrise': 'sunrise.png',
+    'sunset': 'sunset.png',
+}
 
 WEATHER_ICONS = {
     '01d': 'clear_day.png',
@@ -66,42 +165,111 @@ WEATHER_ICONS = {
     'default': 'unkown.png'
 }
 
-def _handle_socketio(socketio_queue):
+def image_files():
+    ''' {name: path} of every image the clock draws, weather icons are named after their file '''
+    images = {name: SYMBOL_ICONS_PATH + filename for name, filename in SYMBOL_ICONS.items()}
+    for filename in set(WEATHER_ICONS.values()):
+        images['weather/' + filename] = WEATHER_ICONS_PATH + filename
+    return images
+
+def _process_age():
+    ''' Seconds since this process started, including interpreter startup and imports '''
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks/os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _IMPORT_TIME
+
+def _handle_socketio(display_state, metrics_state=None, preview_frames=None, preview_control=None,
+                     display_acks=None, url=WEBSERVER_URL, heartbeat=None):
+    import socketio
+
+    # The webserver holds the display state. It sends it when we connect and again whenever it changes.
+    state = None
+
+    def message(data):
+        nonlocal state
+        # Every version is passed on even if the values didn't change, so it gets acknowledged
+        new_state = {'enabled': data['enabled'], 'brightness': data['brightness'], 'version': data.get('version')}
+        if new_state != state:
+            state = new_state
+            display_state.update(state)
+
+    # Socketio handlers run on the client's own thread
+    streamer = PreviewStreamer()
+    streamer_lock = threading.Lock()
+
+    def preview_viewers(data):
+        if preview_control is not None:
+            preview_control.update({'viewers': data['count']})
+
+    def preview_keyframe():
+        with streamer_lock:
+            frame_message = streamer.keyframe()
+        if frame_message is not None:
+            sio.emit('preview_frame', frame_message)
 
     connected = False
+    retry_delay = SOCKETIO_RETRY_MIN
     while not connected:
+        if heartbeat is not None:
+            heartbeat.beat()
         try:
             sio = socketio.Client()
-            sio.connect('http://localhost')
+            # Registered before connecting so the state sent on connect isn't missed
+            sio.on('display_state', message)
+            sio.on('preview_viewers', preview_viewers)
+            sio.on('preview_keyframe', preview_keyframe)
+            sio.connect(url)
             connected = True
         except socketio.exceptions.ConnectionError:
-            pass
-        time.sleep(1)
-
-    state = {'enabled': True, 'brightness': 100}
-
-    @sio.on('display_state')
-    def message(data):
-        nonlocal state
-        state = data
-        socketio_queue.put(state)
-
-    # Mechanism to get state to state-less flask server when a new javascript client connnects
-    @sio.on('get_state')
-    def get_state():
-        nonlocal state
-        sio.emit('display_state', state)
-
-def _map_co2_color(co2):
-    if co2 < 1000: 
-        return (96, 208, 62) # green
-    elif co2 < 2000: 
-        return (245, 253, 84) # yellow
-    else: 
-        return (234, 51, 36) # red
-
+            # Retry quickly at first, the webserver is often starting up at the same time
+            time.sleep(retry_delay)
+            retry_delay = min(2*retry_delay, SOCKETIO_RETRY_MAX)
+
+    # Forward metrics snapshots, preview frames and acknowledgements from the renderer to the webserver
+    metrics_version = 0
+    preview_version = 0
+    acks_version = 0
+    acked_seq = 0
+    while True:
+        # The client reconnects by itself. If it doesn't, the supervisor restarts this process
+        if heartbeat is not None and sio.connected:
+            heartbeat.beat()
+        if metrics_state is not None and metrics_state.version != metrics_version:
+            metrics_version, metrics, _ = metrics_state.snapshot()
+            if metrics['payload'] is not None:
+                sio.emit('metrics', json.loads(metrics['payload']))
+
+        if preview_frames is not None and preview_frames.version != preview_version:
+            preview_version, preview, _ = preview_frames.snapshot()
+            if preview['frame'] is not None:
+                frame = unpack_frame(preview['frame'], int(preview['width']), int(preview['height']))
+                with streamer_lock:
+                    frame_message = streamer.message(frame, preview['brightness'])
+                if frame_message is not None:
+                    sio.emit('preview_frame', frame_message)
+
+        if display_acks is not None and display_acks.version != acks_version:
+            acks_version, acks, _ = display_acks.snapshot()
+            for ack in json.loads(acks['payload'] or '[]'):
+                if ack['seq'] > acked_seq:
+                    acked_seq = ack['seq']
+                    sio.emit('display_ack', ack)
+
+        time.sleep(SOCKETIO_POLL_INTERVAL)
+
+def _refresh_sensor_data(sensor_state, metrics_state=None, heartbeat=None):
+    # Hardware libraries are only importable on the pi, so keep them out of the main process
+    import board
+    import adafruit_sht31d as sht31d
+    import adafruit_sgp30 as sgp30
+    import adafruit_veml7700 as veml7700
+    from sensor_poller import PollScheduler, SensorTask, write_baselines
 
-def _refresh_sensor_data(sensor_queue):
     # Load sensor baselines
     try:
         with open(SENSOR_BASELINES_FILE, 'r') as f:
@@ -117,149 +285,146 @@ def _refresh_sensor_data(sensor_queue):
     if eco2_baseline is not None and tvoc_baseline is not None:
         air_sensor.set_iaq_baseline(eco2_baseline, tvoc_baseline)
     light_sensor = veml7700.VEML7700(i2c)
-    
-    sensor_data = dict(EMPTY_SENSOR_DATA)
-    sensor_poll_timer = 0 # Force to trigger at startup
-    save_baseline_timer = time.time()
-    while True:
-        if time.time() - sensor_poll_timer > 10:
-            sensor_poll_timer = time.time()
-
-            temp = temp_humid.temperature
-            humid = temp_humid.relative_humidity
-
-            air_sensor.set_iaq_relative_humidity(celcius=temp, relative_humidity=humid)
-            co2 = air_sensor.iaq_measure()[0]
-
-            sensor_data['temp'] = 9*temp/5+32
-            sensor_data['humid'] = humid
-            sensor_data['co2'] = co2
-            if time.time() > save_baseline_timer + 60*60:
-                save_baseline_timer = time.time()
-                with open(SENSOR_BASELINES_FILE, 'w') as f:
-                    print("Updating baselines:")
-                    print(f"baseline_co2 = {air_sensor.baseline_eCO2}, baseline_voc = {air_sensor.baseline_TVOC}")
-                    f.write(str(air_sensor.baseline_eCO2) + ',' + str(air_sensor.baseline_TVOC) + '\n')
-
-        sensor_data['light'] = light_sensor.light
-        sensor_queue.put(sensor_data)
-        time.sleep(0.3)
-    
-def _iso_to_datetime_range(iso):
-    """
-    Convert an iso date string with duration to start and end datetime objects
-    Example input: "2022-06-05T17:00:00+00:00/PT14H"
-    Returns (datetime, datetime)
-    """
-
-    try:
-        start_str, duration_str = iso.split('/')
-        start_utc = datetime.fromisoformat(start_str)
-    except ValueError:
-        return None, None
-
-    start = start_utc.astimezone(tzlocal())
-
-    match = re.match(r'PT(\d+)H', duration_str)
-    if not match:
-        return None, None
 
-    duration_hrs = match.group(1)
+    history = SensorHistory(SENSOR_FIELDS, SENSOR_INTERVALS['history'])
+    history.load()
 
-    end = start + timedelta(hours=int(duration_hrs))
+    sensor_data = dict(EMPTY_SENSOR_DATA)
 
-    return start, end
+    def read_temp_humid():
+        temp, humid = temp_humid.measurements
+        # The SGP30 compensates its readings for humidity, keep it up to date
+        air_sensor.set_iaq_relative_humidity(celcius=temp, relative_humidity=humid)
+        return {'temp': 9*temp/5+32, 'humid': humid}
+
+    def read_air():
+        return {'co2': air_sensor.iaq_measure()[0]}
+
+    def read_light():
+        return {'light': light_sensor.light}
+
+    def record_history():
+        history.record(sensor_data, time.time())
+
+    def save_baselines():
+        eco2_baseline, tvoc_baseline = air_sensor.baseline_eCO2, air_sensor.baseline_TVOC
+        print("Updating baselines:")
+        print(f"baseline_co2 = {eco2_baseline}, baseline_voc = {tvoc_baseline}")
+        write_baselines(SENSOR_BASELINES_FILE, eco2_baseline, tvoc_baseline)
+        print(f"Sensor stats: {scheduler.stats()}")
+
+    def publish_metrics():
+        if metrics_state is None:
+            return
+        values = {}
+        for task in scheduler.tasks:
+            if task.name in SENSOR_DEVICES:
+                values[f'{task.name}_reads'] = task.reads
+                values[f'{task.name}_errors'] = task.errors
+                values[f'{task.name}_failures'] = task.failures
+                values[f'{task.name}_latency'] = task.last_latency
+        for name, channel in history.channels.items():
+            values[f'{name}_smoothed'] = channel.smoothed
+            for window in HISTORY_WINDOWS:
+                stats = channel.stats(window)
+                for stat in ('min', 'max', 'trend'):
+                    values[f'{name}_{window}_{stat}'] = stats[stat]
+        metrics_state.update(values)
+
+    scheduler = PollScheduler([
+        SensorTask('sht31d', SENSOR_INTERVALS['sht31d'], read_temp_humid),
+        SensorTask('sgp30', SENSOR_INTERVALS['sgp30'], read_air),
+        SensorTask('veml7700', SENSOR_INTERVALS['veml7700'], read_light),
+        SensorTask('history', SENSOR_INTERVALS['history'], record_history),
+        SensorTask('save_history', SENSOR_HISTORY_SAVE_INTERVAL, history.save,
+                   first_delay=SENSOR_HISTORY_SAVE_INTERVAL),
+        SensorTask('sgp30_baseline', SENSOR_BASELINE_SAVE_INTERVAL, save_baselines,
+                   first_delay=SENSOR_BASELINE_SAVE_INTERVAL),
+        SensorTask('metrics', METRICS_INTERVAL, publish_metrics),
+    ])
+    while True:
+        if heartbeat is not None:
+            heartbeat.beat()
+        values = scheduler.run_due()
+        if values:
+            sensor_data.update(values)
+            sensor_state.update(values)
+        scheduler.sleep_until_next()
 
-def _to_f(c):
-    ''' Convert to farenheight '''
-    return (float(c)*9/5) + 32
+def _refresh_internet_data(weather_state, metrics_state=None, cache_file=WEATHER_CACHE_FILE, heartbeat=None):
+    from weather_fetcher import run_fetchers
 
-def _refresh_internet_data(weather_queue):
     with open(CONFIG_FILE) as f:
         config = json.load(f)
 
-    while True:
-        weather_data = dict(EMPTY_WEATHER_DATA)
-        network_error = False
-        nws_forecast_api_url = None
-
-        try:
-            r = requests.get(WEATHER_API_URL.format(lat=config['lat'], lon=config['lon'], key=config['openweather_api_key']))
-            if r.status_code == 200:
-                try:
-                    data = r.json()
-                    weather_data['temp']      = data['main']['temp']
-                    weather_data['humid']     = data['main']['humidity']
-                    weather_data['icon']      = data['weather'][0]['icon']
-                except KeyError:
-                    print("Openweather data poorly formatted!")
-        except requests.exceptions.RequestException:
-            network_error = True
-            print("Network error!")
-
-        try:
-            r = requests.get(PURPLEAIR_API_URL.format(lat=config['lat'], lon=config['lon']))
-            if r.status_code == 200:
-                try:
-                    data = r.json()
-                    weather_data['aqi']       = data['aqi']
-                    weather_data['aqi_color'] = (data['color']['r'], data['color']['g'], data['color']['b'])
-                except KeyError:
-                    print("Purpleair dash data poorly formatted!")
-        except requests.exceptions.RequestException:
-            network_error = True
-            print("Network error!")
-
-        if not nws_forecast_api_url:
-            try:
-                r = requests.get(NWS_GRIDPOINT_API_URL.format(lat=config['lat'], lon=config['lon']))
-                if r.status_code == 200:
-                    try:
-                        data = r.json()
-                        nws_forecast_api_url = data['properties']['forecastGridData']
-                    except KeyError:
-                        print("Error parsing NWS data")
-            except requests.exceptions.RequestException:
-                network_error = True
-                print("Network error!")
-
-        try:
-            r = requests.get(nws_forecast_api_url)
-            if r.status_code == 200:
-                try:
-                    now = datetime.now()
-                    data = r.json()
-                    now = datetime.now().astimezone(tzlocal())
-
-                    for data_point in data['properties']['minTemperature']['values']:
-                        start, end = _iso_to_datetime_range(data_point['validTime'])
-                        if end > now:
-                            weather_data['low_temp'] = _to_f(data_point['value'])
-
-                    for data_point in data['properties']['maxTemperature']['values']:
-                        start, end = _iso_to_datetime_range(data_point['validTime'])
-                        if end > now:
-                            weather_data['high_temp'] = _to_f(data_point['value'])
-                except KeyError:
-                    print("Error parsing NWS data")
-        except requests.exceptions.RequestException:
-            network_error = True
-            print("Network error!")
-
-        weather_queue.put(weather_data)
-        if not network_error:
-            time.sleep(60*2)
-        else:
-            # Keep checking network more frequently in case it's back up
-            time.sleep(0.5)
+    run_fetchers(config, weather_state, WeatherCache(cache_file), metrics_state, heartbeat)
+
+def _load_display_backend(name):
+    '''
+    Returns a module exposing RGBMatrix, RGBMatrixOptions and graphics.
+    "rgbmatrix" drives the real panel, "emulated" renders into memory.
+    '''
+    if name == 'emulated':
+        import emulated_matrix
+        return emulated_matrix
+    elif name == 'rgbmatrix':
+        import rgbmatrix
+        import rgbmatrix.graphics
+        return rgbmatrix
+    else:
+        raise ValueError(f"Unknown display backend: {name}")
 
 class LEDClock:
-    def __init__(self):
-        self.matrix = RGBMatrix(options = self._get_options())
+    def __init__(self, backend=None, config_file=CONFIG_FILE,
+                 sensor_source=_refresh_sensor_data,
+                 weather_source=_refresh_internet_data,
+                 socketio_source=_handle_socketio,
+                 weather_cache_file=WEATHER_CACHE_FILE,
+                 config=None, time_source=None):
+        '''
+        A source of None leaves that worker process out, e.g. when replaying recorded inputs.
+        config is used instead of reading config_file if it's given. weather_cache_file seeds the
+        weather at startup and the internet worker keeps it up to date, None uses no cache file.
+
+        Only what's needed to show the time is set up here. The first frame finishes the startup
+        (see _finish_startup()), so the panel isn't dark while everything else loads.
+        '''
+        # Seconds each phase of startup took, in order, see _startup_report()
+        self.startup_phases = {}
+        self._phase_start = time.perf_counter()
+        # Times from the process starting to the first frame, and to the whole clock face
+        self.startup = {}
+
+        if config is None:
+            with open(config_file) as f:
+                config = json.load(f)
+        self.config = config
+        # Everything the rendered frame depends on reads the time from here, see time_source.py
+        self.time_source = time_source or SystemTime()
+        self._lap('config')
+
+        self.backend = backend or _load_display_backend(self.config.get('display_backend', 'rgbmatrix'))
+        self.matrix = self.backend.RGBMatrix(options = self._get_options())
         self.offscreen_canvas = self.matrix.CreateFrameCanvas()
+        self._lap('matrix')
+        self.stage_timer = StageTimer()
+        # The face is composed at the size its layout was designed for and scaled up to fill bigger panels
+        self.layout_spec = self.config.get('layout', DEFAULT_LAYOUT)
+        layout_size = self.config.get('layout_size', DEFAULT_LAYOUT_SIZE if 'layout' not in self.config
+                                      else (self.matrix.width, self.matrix.height))
+        self.compositor = Compositor(*layout_size, self.matrix.width, self.matrix.height)
+        # Effects composited over the clock, like alerts or transitions. See show()
+        self.animations = AnimationEngine(self.matrix.width, self.matrix.height, clock=self.time_source.monotonic)
+        self.animated = False
+        # What's on the panel: the composed clock, or the animation frame drawn over it
+        self.panel_pixels = self.compositor.panel_frame()
+        # Created on first use, ephem is slow to import
+        self.sun_events = None
+        self.scheduler = FrameScheduler(self.config.get('target_fps', 30))
+        self.drawn_second = None
+        # Set when something other than the inputs changed what's on the panel
+        self.redraw_pending = False
 
-        with open(CONFIG_FILE) as f:
-            self.config = json.load(f)
         self.high_temp_start = datetime.strptime(self.config["high_temp_start"], "%H:%M").time()
         self.high_temp_end = datetime.strptime(self.config["high_temp_end"], "%H:%M").time()
 
@@ -267,103 +432,223 @@ class LEDClock:
         self.enabled = True
         self.brightness = 0
         self.target_brightness = 100
-
-        self.time_font = graphics.Font()
-        self.time_font.LoadFont('resources/fonts/8x20_numerics.bdf')
-        self.small_font = graphics.Font()
-        self.small_font.LoadFont('resources/fonts/3x5_numerics.bdf')
-        self.date_font = Font('resources/fonts/4x5_text.bdf')
-
-        self.am_pm_font = graphics.Font()
-        self.am_pm_font.LoadFont('resources/fonts/am_pm.bdf')
-
-        self.white = graphics.Color(255, 255, 255)
-        self.purple = graphics.Color(81, 0, 255)
-        self.am_color = graphics.Color(255, 255, 0)
-        self.pm_color = graphics.Color(120, 120, 255)
-
-        self.inside_humid_img = Image.open('resources/symbol_icons/inside_humid.png').convert('RGB')
-        self.outside_humid_img = Image.open('resources/symbol_icons/outside_humid.png').convert('RGB')
-        self.co2_img = Image.open('resources/symbol_icons/co2.png').convert('RGB')
-        self.aqi_img = Image.open('resources/symbol_icons/aqi.png').convert('RGB')
-        self.inside_temp_img = Image.open('resources/symbol_icons/inside_temp.png').convert('RGB')
-        self.outside_temp_img = Image.open('resources/symbol_icons/outside_temp.png').convert('RGB')
-        self.high_temp_img = Image.open('resources/symbol_icons/high_temp-color.png').convert('RGB')
-        self.low_temp_img = Image.open('resources/symbol_icons/low_temp-color.png').convert('RGB')
-        self.sunrise_img = Image.open('resources/symbol_icons/sunrise.png').convert('RGB')
-        self.sunset_img = Image.open('resources/symbol_icons/sunset.png').convert('RGB')
-
-        self.weather_icons = {}
-        for icon_id, filename in WEATHER_ICONS.items():
-            self.weather_icons[icon_id] = Image.open(WEATHER_ICONS_PATH + filename).convert('RGB')
-
+        # Brightness asked for over socketio. With auto brightness on it scales the ambient light curve
+        self.user_brightness = 100
+        self.auto_brightness = AutoBrightness.from_config(self.config)
+        # Fades run on wall time, so they take as long whatever the frame rate
+        self.fade = Fade.from_config(self.config, value=self.brightness, clock=self.time_source.monotonic)
+        self.fade.start(self.target_brightness)
+        self.power_monitor = PowerMonitor()
+        self.panel_watts = estimate_panel_watts(self.panel_pixels, 0)
+        self._lap('renderer')
+
+        # Text is drawn in software into the compositor's layers, so these are not the backend's fonts.
+        # The first frame only has the time on it, so only its font is loaded for now.
+        self._open_assets()
+        first_spec = [widget for widget in self.layout_spec
+                      if widget.get('type') == 'clock' and widget.get('show') == 'hours_minutes']
+        self._load_fonts({widget['font'] for widget in first_spec})
+        # Compiled into a plan of which widget shows which input, for now just the time
+        self.layout = compile_layout(first_spec, self.fonts, {}, {}, self._layout_inputs())
+        self.layout.install(self.compositor)
+        self.inputs = {}
+        self._lap('time_font')
 
         self.weather_data = dict(EMPTY_WEATHER_DATA)
-        self.weather_queue = multiprocessing.Queue()
+        self.weather_timestamps = {}
+        self.weather_state = SharedState(WEATHER_FIELDS)
+        self.weather_version = 0
+        self.weather_cache_file = weather_cache_file
+        if weather_cache_file is not None:
+            # Show the last known weather on the very first frame instead of waiting on the network
+            WeatherCache(weather_cache_file).seed(self.weather_state)
 
         self.sensor_data = dict(EMPTY_SENSOR_DATA)
-        self.sensor_queue = multiprocessing.Queue()
-
-        self.socketio_queue = multiprocessing.Queue()
-
-        self.internet_process = multiprocessing.Process(target=_refresh_internet_data, args=[self.weather_queue])
-        self.internet_process.start()
-
-        self.sensor_process = multiprocessing.Process(target=_refresh_sensor_data, args=[self.sensor_queue])
-        self.sensor_process.start()
+        self.sensor_timestamps = {}
+        self.sensor_state = SharedState(SENSOR_FIELDS)
+        self.sensor_version = 0
+
+        self.display_state = SharedState(DISPLAY_FIELDS)
+        self.display_version = 0
+        # The display state change on its way to the panel, acknowledged once the fade to it is done
+        self.display_command = None
+        self.display_acks = SharedState(DISPLAY_ACK_FIELDS)
+        self.acks = deque(maxlen=ACK_HISTORY)
+        self.ack_seq = 0
+
+        self.metrics = Metrics()
+        self.weather_metrics = SharedState(WEATHER_METRIC_FIELDS)
+        self.sensor_metrics = SharedState(SENSOR_METRIC_FIELDS)
+        self.metrics_export = SharedState(METRICS_EXPORT_FIELDS)
+        self.next_metrics_export = time.monotonic() + METRICS_INTERVAL
+
+        # The preview is only exported while the webserver says someone is watching
+        self.preview_frames = SharedState(preview_frame_fields(self.matrix.width, self.matrix.height))
+        self.preview_control = SharedState(PREVIEW_CONTROL_FIELDS)
+        self.preview_control_version = 0
+        self.preview_viewers = 0
+        self.preview_interval = 1/self.config.get('preview_fps', 5)
+        self.next_preview_export = 0
+        self.preview_exported = None
+
+        # Writes every frame's inputs to a file for replay.py, if record_dir is set
+        self.recorder = None
+        if self.config.get('record_dir'):
+            from recording import InputRecorder
+            self.recorder = InputRecorder.in_directory(self.config['record_dir'], self.config, self.time_source)
+
+        # Restarts the workers if they die or hang, their data shows as stale until they're back.
+        # They're started once the first frame is up.
+        self.supervisor = Supervisor()
+        self.worker_sources = {'internet': weather_source, 'sensor': sensor_source, 'socketio': socketio_source}
+        # {input group: whether it's stale}, see _update_stale(), and what the last frame showed
+        self.stale = {group: False for group in STALE_WORKERS}
+        self.shown_stale = None
+        self._lap('mailboxes')
+
+    def _lap(self, phase):
+        ''' Record the time since the last startup phase ended as phase '''
+        now = time.perf_counter()
+        self.startup_phases[phase] = now - self._phase_start
+        self._phase_start = now
+
+    def _open_assets(self):
+        ''' Memory map the precompiled asset pack, or load from resources/ if it's out of date '''
+        self.image_files = image_files()
+        self.asset_pack = load_pack(ASSET_PACK_FILE, FONT_FILES, self.image_files)
+        if self.asset_pack is None:
+            print(f"{ASSET_PACK_FILE} is missing or out of date, loading fonts and icons from resources/. "
+                  "Run src/asset_pack.py to rebuild it.")
+        self.fonts = {}
+        self.images = {}
+        # Icon codes from the weather APIs to image names
+        self.weather_icons = {icon_id: 'weather/' + filename for icon_id, filename in WEATHER_ICONS.items()}
+
+    def _load_fonts(self, names):
+        for name in names:
+            if name in self.fonts:
+                continue
+            self.fonts[name] = graphics.Font()
+            if self.asset_pack is None:
+                self.fonts[name].LoadFont(FONT_FILES[name])
+            else:
+                self.fonts[name].LoadAtlas(self.asset_pack.font_atlas(name))
 
-        self.socketio_process = multiprocessing.Process(target=_handle_socketio, args=[self.socketio_queue])
-        self.socketio_process.start()
+    def _load_images(self):
+        if self.asset_pack is None:
+            self.images = {name: Image.open(path).convert('RGB') for name, path in self.image_files.items()}
+        else:
+            self.images = {name: self.asset_pack.image(name) for name in self.image_files}
+
+    def _finish_startup(self):
+        '''
+        Load the rest of the assets, put up the whole clock face and start the workers. Runs right
+        after the first frame is on the panel.
+        '''
+        self._phase_start = time.perf_counter()
+        self._load_fonts(FONT_FILES)
+        self._lap('fonts')
+        self._load_images()
+        self._lap('images')
+
+        self.layout = compile_layout(self.layout_spec, self.fonts, self.images,
+                                     {'weather': self.weather_icons}, self._layout_inputs())
+        self.layout.install(self.compositor)
+        self.redraw_pending = True
+        self._lap('layout')
+
+        self.supervisor.add('internet', self.worker_sources['internet'],
+                            (self.weather_state, self.weather_metrics, self.weather_cache_file),
+                            WORKER_HANG_TIMEOUTS['internet'])
+        self.supervisor.add('sensor', self.worker_sources['sensor'], (self.sensor_state, self.sensor_metrics),
+                            WORKER_HANG_TIMEOUTS['sensor'])
+        self.supervisor.add('socketio', self.worker_sources['socketio'],
+                            (self.display_state, self.metrics_export, self.preview_frames, self.preview_control,
+                             self.display_acks, self.config.get('webserver_url', WEBSERVER_URL)),
+                            WORKER_HANG_TIMEOUTS['socketio'])
+        self._lap('workers')
+        self.startup['ready'] = _process_age()
+        print(self._startup_report())
+
+    def _startup_report(self):
+        phases = ', '.join(f"{name} {1000*seconds:.1f} ms" for name, seconds in self.startup_phases.items())
+        return (f"First frame {self.startup['first_frame']:.2f} s after start, whole clock face "
+                f"{self.startup['ready']:.2f} s, from {'the asset pack' if self.asset_pack else 'source files'}\n"
+                f"  {phases}")
+
+    def _layout_inputs(self):
+        ''' Names of every input a layout widget can be bound to '''
+        return (set(TIME_INPUTS) | set(DERIVED_INPUTS) | set(STALE_INPUTS)
+                | {f'weather.{field}' for field in WEATHER_FIELDS}
+                | {f'sensor.{field}' for field in SENSOR_FIELDS})
 
     def _get_options(self):
-        options = RGBMatrixOptions()
-        options.rows = 32
-        options.cols = 64
+        options = self.backend.RGBMatrixOptions()
+        # A single 64x32 panel by default. chain_length panels are daisy chained side by side and
+        # parallel chains stacked on top of each other
+        panel = self.config.get('panel', {})
+        options.rows = panel.get('rows', 32)
+        options.cols = panel.get('cols', 64)
+        options.chain_length = panel.get('chain_length', 1)
+        options.parallel = panel.get('parallel', 1)
         options.gpio_slowdown = 3
         options.drop_privileges = False
+        # Refresh settings. PWM bits are lowered at runtime by the night power profiles,
+        # the refresh rate limit can only be set at startup.
+        options.pwm_bits = self.config.get('pwm_bits', 11)
+        options.limit_refresh_rate_hz = self.config.get('limit_refresh_rate_hz', 0)
         return options
 
 
     def _get_sun_set_rise_time(self):
         ''' Get either the sunrise or sunset time depending on which is sooner '''
-
-        def to_degrees_str(decimal):
-            minutes = 60*(decimal - int(decimal))
-            seconds = 60*(minutes - int(minutes))
-            return f"{int(decimal)}:{int(minutes)}:{seconds}"
-
-        o = ephem.Observer()
-        o.lat = to_degrees_str(self.config['lat'])
-        o.long = to_degrees_str(self.config['lon'])
-        o.date = datetime.utcnow()
-
-        sun = ephem.Sun(o)
-        sunrise = ephem.localtime(o.next_rising(sun))
-        sunset = ephem.localtime(o.next_setting(sun))
-
-        if sunrise < sunset:
-            return sunrise, True
-        else:
-            return sunset, False
-
-    def _format_weather_datapoint(self, datapoint, size, leading_space=False):
-        if datapoint is not None:
-            output = str(round(float(datapoint))).rjust(size, '0')
-            if leading_space and datapoint < pow(10, size) and datapoint >= 0:
-                output = " " + output
-            return output, self.white
+        if self.sun_events is None:
+            from sun_events import SunEventCache
+            self.sun_events = SunEventCache()
+        return self.sun_events.next_event(self.config['lat'], self.config['lon'], self.time_source.now())
+
+    def _update_target_brightness(self):
+        if not self.enabled:
+            self.target_brightness = 0
+        elif self.auto_brightness is not None and self.auto_brightness.brightness is not None:
+            self.target_brightness = round(self.user_brightness*self.auto_brightness.brightness/100)
         else:
-            output = "?"*size
-            if leading_space:
-                output = " " + output
-            return output, self.purple
-
-    def _draw_loop(self):
-        start_loop = time.time()
-        canvas = self.offscreen_canvas
-        canvas.Clear()
-
-        now = datetime.now()
+            self.target_brightness = self.user_brightness
+        self.fade.start(self.target_brightness)
+
+    def _apply_power_profile(self):
+        pwm_bits = self.auto_brightness.profile['pwm_bits']
+        if self.matrix.pwmBits != pwm_bits:
+            self.matrix.pwmBits = pwm_bits
+
+    def _power_profile_name(self):
+        return self.auto_brightness.profile['name'] if self.auto_brightness is not None else 'fixed'
+
+    def show(self, effect):
+        ''' Run an animation.Effect over the clock until it finishes '''
+        return self.animations.add(effect)
+
+    def _needs_redraw(self):
+        '''
+        True if the wall-clock second ticked, a mailbox was written or a fade or animation is in
+        progress (including the frame right after one ends, to put the plain clock back)
+        '''
+        if int(self.time_source.time()) != self.drawn_second:
+            return True
+        if self.animations.active or self.animated:
+            return True
+        if round(self.fade.value()) != self.brightness:
+            return True
+        if self.stale != self.shown_stale or self.redraw_pending:
+            return True
+        return (self.weather_state.version != self.weather_version
+                or self.sensor_state.version != self.sensor_version
+                or self.display_state.version != self.display_version)
+
+    def _update_inputs(self):
+        ''' Refresh the time and mailbox inputs the layout widgets are bound to '''
+        inputs = self.inputs
+        now = self.time_source.now()
         hours = now.hour
         am = True
         if hours > 12:
@@ -371,114 +656,256 @@ class LEDClock:
             am = False
         if hours == 0:
             hours = 12
+        weekday = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN'][now.weekday()]
+        month = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'][now.month - 1]
+        inputs['time.hours_minutes'] = f'{str(hours).rjust(2, " ")}:{str(now.minute).rjust(2, "0")}'
+        inputs['time.seconds'] = str(now.second).rjust(2, '0')
+        inputs['time.am_pm'] = 'A' if am else 'P'
+        inputs['time.date'] = f'{weekday} {month} {now.day}'
+        daytime = self.high_temp_start < now.time() < self.high_temp_end
+        inputs['time.daytime'] = daytime
+
+        for field, value in self.weather_data.items():
+            inputs[f'weather.{field}'] = value
+        for field, value in self.sensor_data.items():
+            inputs[f'sensor.{field}'] = value
+        # The day's high during the day and the night's low otherwise
+        inputs['weather.high_low_temp'] = self.weather_data['high_temp' if daytime else 'low_temp']
+        for group, stale in self.stale.items():
+            inputs[f'{group}.stale'] = stale
+
+    def _update_stale(self):
+        ''' Restart workers that died or hung and mark the inputs that came from them stale until they're back '''
+        self.supervisor.check()
+        for group, worker in STALE_WORKERS.items():
+            self.stale[group] = self.supervisor.stale(worker)
 
-        hours = str(hours).rjust(2, ' ')
-        minutes = str(now.minute).rjust(2, '0')
-        seconds = str(now.second).rjust(2, '0')
-        weekday = str(['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN'][now.weekday()])
-        month = str(['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'][now.month - 1])
-        days = str(now.day)
-
-        graphics.DrawText(canvas, self.time_font,  -6, 20, self.white, f'{hours}:{minutes}')
-        graphics.DrawText(canvas, self.small_font, 37, 19, self.white, f'{seconds}')
-        byte_img = self.date_font.draw(f'{weekday} {month} {days}')
-        img = ImageOps.invert(Image.frombytes('RGB', (byte_img.width(), byte_img.height()), byte_img.tobytes('RGB'))).convert('RGB')
-        center_x = 25
-        canvas.SetImage(img, center_x - byte_img.width()//2, 21)
-
-        inside_temp, inside_temp_color     = self._format_weather_datapoint(self.sensor_data['temp'], 2, True)
-        outside_temp, outside_temp_color   = self._format_weather_datapoint(self.weather_data['temp'], 2, True)
-        high_temp, high_temp_color         = self._format_weather_datapoint(self.weather_data['high_temp'], 2, True)
-        low_temp, low_temp_color           = self._format_weather_datapoint(self.weather_data['low_temp'], 2, True)
-        outside_humid, outside_humid_color = self._format_weather_datapoint(self.weather_data['humid'], 2)
-        inside_humid, inside_humid_color   = self._format_weather_datapoint(self.sensor_data['humid'], 2)
-
-        sun_time, is_sunrise = self._get_sun_set_rise_time()
-        sun_time = sun_time.strftime("%-I:%M")
-        sun_time_icon = self.sunrise_img if is_sunrise else self.sunset_img
-
-        co2, _                             = self._format_weather_datapoint(self.sensor_data['co2'], 4)
-        co2_color = graphics.Color(*_map_co2_color(self.sensor_data['co2'])) if self.sensor_data['co2'] is not None else self.purple
-
-        aqi, _                             = self._format_weather_datapoint(self.weather_data['aqi'], 3)
-        aqi_color = graphics.Color(*self.weather_data['aqi_color']) if self.weather_data['aqi_color'] is not None else self.purple
-
-        graphics.DrawText(canvas, self.small_font, 53, 5, inside_temp_color, f"{inside_temp}")
-        graphics.DrawText(canvas, self.small_font, 53, 12, outside_temp_color, f"{outside_temp}")
-        graphics.DrawText(canvas, self.small_font, 51, 26, self.white, f"{sun_time}")
-        graphics.DrawText(canvas, self.small_font, 4, 32, outside_humid_color, f"{inside_humid}")
-        graphics.DrawText(canvas, self.small_font, 17, 32, outside_humid_color, f"{outside_humid}")
-        graphics.DrawText(canvas, self.small_font, 31, 32, co2_color, f"{co2}")
-        graphics.DrawText(canvas, self.small_font, 53, 32, aqi_color, f"{aqi}")
-
-        now = datetime.now().time()
-        if now > self.high_temp_start and now < self.high_temp_end:
-            graphics.DrawText(canvas, self.small_font, 53, 19, high_temp_color, f"{high_temp}")
-            canvas.SetImage(self.high_temp_img, 49, 14)
-        else:
-            graphics.DrawText(canvas, self.small_font, 53, 19, low_temp_color, f"{low_temp}")
-            canvas.SetImage(self.low_temp_img, 49, 14)
-
-        if (am):
-            graphics.DrawText(canvas, self.am_pm_font, 45, 18, self.am_color, 'A')
-        else:
-            graphics.DrawText(canvas, self.am_pm_font, 45, 18, self.pm_color, 'P')
-
-        # Draw weather icon
-        if self.weather_data['icon'] in self.weather_icons:
-            icon = self.weather_icons[self.weather_data['icon']]
-        else:
-            icon = self.weather_icons['default']
-        canvas.SetImage(icon, 37, 1)
-
-        # Draw symbol icons
-        canvas.SetImage(self.inside_humid_img, 0, 27)
-        canvas.SetImage(self.outside_humid_img, 13, 27)
-        canvas.SetImage(self.co2_img, 27, 27)
-        canvas.SetImage(self.aqi_img, 49, 27)
-        canvas.SetImage(self.inside_temp_img, 49,  0)
-        canvas.SetImage(self.outside_temp_img, 49, 7)
-        canvas.SetImage(sun_time_icon, 46, 22)
-
-        try:
-            self.weather_data = self.weather_queue.get_nowait()
-        except queue.Empty:
-            pass
-
-        try:
-            self.sensor_data = self.sensor_queue.get_nowait()
-        except queue.Empty:
-            pass
-
-        try:
-            state = self.socketio_queue.get_nowait()
-            self.enabled = state['enabled']
-            if self.enabled:
-                self.target_brightness = float(state['brightness'])
+    def _draw_loop(self):
+        start_loop = time.perf_counter()
+        self.drawn_second = int(self.time_source.time())
+        self.redraw_pending = False
+        stage = self.stage_timer.stage
+        self.stage_timer.begin_frame()
+
+        with stage('inputs'):
+            # Only copy out the mailboxes that were written since the last frame
+            snapshots = {}
+            if self.weather_state.version != self.weather_version:
+                self.weather_version, self.weather_data, self.weather_timestamps = self.weather_state.snapshot()
+                snapshots['weather'] = (self.weather_data, self.weather_timestamps)
+
+            if self.sensor_state.version != self.sensor_version:
+                self.sensor_version, self.sensor_data, self.sensor_timestamps = self.sensor_state.snapshot()
+                snapshots['sensor'] = (self.sensor_data, self.sensor_timestamps)
+                if self.auto_brightness is not None and self.auto_brightness.update(
+                        self.sensor_data['light'], self.sensor_timestamps['light']):
+                    self._apply_power_profile()
+                    self._update_target_brightness()
+
+            if self.display_state.version != self.display_version:
+                self.display_version, state, timestamps = self.display_state.snapshot()
+                snapshots['display'] = (state, timestamps)
+                self.enabled = state['enabled']
+                self.user_brightness = float(state['brightness'])
+                self._update_target_brightness()
+                if state['version'] is not None:
+                    self._track_display_command(int(state['version']), timestamps['version'])
+
+            if self.stale != self.shown_stale:
+                self.shown_stale = dict(self.stale)
+                snapshots['stale'] = self.shown_stale
+
+            if self.recorder is not None:
+                self.recorder.record(snapshots)
+            self._update_inputs()
+
+        if self.layout.uses('sun'):
+            with stage('sun'):
+                sun_time, is_sunrise = self._get_sun_set_rise_time()
+                self.inputs['sun.time'] = sun_time.strftime("%-I:%M")
+                self.inputs['sun.is_sunrise'] = is_sunrise
+
+        with stage('layout'):
+            self.layout.update(self.compositor, self.inputs, self.time_source.monotonic())
+
+        with stage('blit'):
+            self.animated = self.animations.active
+            if self.animated:
+                self.animations.push(self.offscreen_canvas, self.compositor.panel_frame())
+                self.panel_pixels = self.animations.output
             else:
-                self.target_brightness = 0
-        except queue.Empty:
-            pass
-
-        # Update brightness
-        if self.target_brightness > self.brightness:
-            self.brightness += 2.0
-            self.brightness = min(self.brightness, 100)
-        elif self.target_brightness < self.brightness:
-            self.brightness -= 2.0
-            self.brightness = max(self.brightness, 0)
-
-        self.matrix.brightness = self.brightness
-        self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
-        end_loop = time.time() - start_loop
+                self.compositor.blit(self.offscreen_canvas)
+                self.panel_pixels = self.compositor.panel_pixels
+        with stage('swap'):
+            self.brightness = round(self.fade.value())
+            self.matrix.brightness = self.brightness
+            self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
+            self.panel_watts = estimate_panel_watts(self.panel_pixels, self.brightness)
+            if self.display_command is not None:
+                self._update_display_command()
+        self.stage_timer.end_frame()
+        end_loop = time.perf_counter() - start_loop
+        self.scheduler.frame_rendered(end_loop)
+
+        if 'first_frame' not in self.startup:
+            self.startup['first_frame'] = _process_age()
+            # Everything before the clock was created
+            self.startup_phases = dict(interpreter=self.startup['first_frame'] - (time.perf_counter() - _IMPORT_TIME),
+                                       imports=_IMPORTS_DONE - _IMPORT_TIME, **self.startup_phases)
+            self._lap('first_frame')
+            self._finish_startup()
+
+        self.metrics.observe('frame_seconds', end_loop, 'Time to render a frame')
+        for name, duration in self.stage_timer.last_frame.items():
+            self.metrics.observe('stage_seconds', duration, 'Time spent in each stage of a frame', stage=name)
+
+    def _track_display_command(self, version, received):
+        ''' Follow a new display state from the webserver until it's on the panel '''
+        if self.display_command is not None:
+            self._acknowledge('superseded')
+        self.display_command = {'version': version, 'clock_received': received, 'drained': time.time()}
+
+    def _update_display_command(self):
+        ''' After a frame is swapped in, see how far the display state change has got '''
+        command = self.display_command
+        if 'shown' not in command:
+            command['shown'] = time.time()
+        if self.brightness == round(self.fade.target):
+            command['settled'] = time.time()
+            self._acknowledge('applied')
+
+    def _acknowledge(self, status):
+        ''' Hand the acknowledgement of the current display change to the socketio process '''
+        command = self.display_command
+        self.display_command = None
+        self.ack_seq += 1
+        self.acks.append(dict(command, status=status, seq=self.ack_seq))
+        self.display_acks.update({'payload': json.dumps(list(self.acks))})
+
+        hops = (('mailbox', 'clock_received', 'drained'), ('first_frame', 'drained', 'shown'),
+                ('fade', 'shown', 'settled'))
+        for hop, start, end in hops:
+            if start in command and end in command:
+                self.metrics.observe('display_command_seconds', command[end] - command[start],
+                                     'Time a display change from the webserver spent in each step on the clock',
+                                     buckets=LATENCY_BUCKETS, hop=hop)
+
+    def _collect_metrics(self):
+        ''' Pull everything that isn't recorded as it happens into the metrics '''
+        metrics = self.metrics
+        now = time.time()
+
+        for source, timestamps in (('weather', self.weather_timestamps), ('sensor', self.sensor_timestamps)):
+            for field, timestamp in timestamps.items():
+                metrics.set('data_age_seconds', now - timestamp if timestamp else None,
+                            'Seconds since a displayed field was last written', source=source, field=field)
+
+        _, fetches, _ = self.weather_metrics.snapshot()
+        for api in WEATHER_SOURCES:
+            metrics.set('fetch_requests_total', fetches[f'{api}_requests'] or 0, 'HTTP requests made', 'counter', api=api)
+            metrics.set('fetch_errors_total', fetches[f'{api}_errors'] or 0, 'Failed fetches', 'counter', api=api)
+            metrics.set('fetch_http_status', fetches[f'{api}_http_status'], 'Status of the last HTTP response', api=api)
+            metrics.set('fetch_latency_seconds', fetches[f'{api}_http_latency'], 'Latency of the last HTTP response', api=api)
+            last_success = fetches[f'{api}_last_success']
+            metrics.set('fetch_success_age_seconds', now - last_success if last_success else None,
+                        'Seconds since the last successful fetch', api=api)
+
+        _, reads, _ = self.sensor_metrics.snapshot()
+        for device in SENSOR_DEVICES:
+            metrics.set('i2c_reads_total', reads[f'{device}_reads'] or 0, 'Successful sensor reads', 'counter', device=device)
+            metrics.set('i2c_errors_total', reads[f'{device}_errors'] or 0, 'Sensor reads that raised a bus error', 'counter', device=device)
+            metrics.set('i2c_failures_total', reads[f'{device}_failures'] or 0, 'Sensor reads that failed after every retry', 'counter', device=device)
+            metrics.set('i2c_latency_seconds', reads[f'{device}_latency'], 'Latency of the last sensor read', device=device)
+        for field in SENSOR_FIELDS:
+            metrics.set('sensor_smoothed', reads[f'{field}_smoothed'], 'Sensor reading smoothed over a minute', field=field)
+            for window in HISTORY_WINDOWS:
+                metrics.set('sensor_min', reads[f'{field}_{window}_min'], 'Lowest sensor reading over the window',
+                            field=field, window=window)
+                metrics.set('sensor_max', reads[f'{field}_{window}_max'], 'Highest sensor reading over the window',
+                            field=field, window=window)
+                metrics.set('sensor_trend_per_hour', reads[f'{field}_{window}_trend'],
+                            'Least squares slope of the sensor readings over the window', field=field, window=window)
+
+        monotonic = time.monotonic()
+        for name, worker in self.supervisor.workers.items():
+            metrics.set('process_up', int(worker.healthy), 'Whether a worker process is running and beating', process=name)
+            metrics.set('process_restarts_total', worker.restarts, 'Times a worker was restarted', 'counter', process=name)
+            metrics.set('process_heartbeat_age_seconds', worker.heartbeat_age(monotonic),
+                        'Seconds since a worker last beat', process=name)
+            recoveries = worker.recoveries
+            metrics.set('process_recovery_seconds', recoveries[-1] if recoveries else None,
+                        'Time the last restart took, from the last heartbeat to the first one after it', process=name)
+            metrics.set('process_mttr_seconds', sum(recoveries)/len(recoveries) if recoveries else None,
+                        'Mean time to recovery of a worker', process=name)
+
+        metrics.set('frames_rendered_total', self.scheduler.rendered, 'Frames rendered', 'counter')
+        metrics.set('frames_skipped_total', self.scheduler.skipped, 'Frame slots skipped because nothing changed', 'counter')
+        metrics.set('idle_ratio', self.scheduler.idle_percent()/100, 'Fraction of time the main loop slept')
+        metrics.set('brightness', self.brightness, 'Current panel brightness in percent')
+        metrics.set('panel_watts', self.panel_watts, 'Estimated panel power draw')
+        metrics.set('first_frame_seconds', self.startup.get('first_frame'), 'Time from process start to the first frame')
+        metrics.set('ready_seconds', self.startup.get('ready'), 'Time from process start to the whole clock face')
+        for phase, seconds in self.startup_phases.items():
+            metrics.set('startup_phase_seconds', seconds, 'Time spent in each phase of startup', phase=phase)
+
+    def _export_preview(self):
+        ''' Hand the composed frame to the socketio process if someone's watching and it changed '''
+        if self.preview_control.version != self.preview_control_version:
+            self.preview_control_version, control, _ = self.preview_control.snapshot()
+            self.preview_viewers = control['viewers'] or 0
+            # Make sure a new viewer gets a frame even if nothing changes for a while
+            self.preview_exported = None
+        if not self.preview_viewers:
+            return
+
+        now = time.monotonic()
+        exported = (self.compositor.version, self.animations.version, self.brightness)
+        if exported == self.preview_exported or now < self.next_preview_export:
+            return
+        self.next_preview_export = now + self.preview_interval
+        self.preview_exported = exported
+        self.preview_frames.update({
+            'frame': pack_frame(self.panel_pixels),
+            'width': self.matrix.width,
+            'height': self.matrix.height,
+            'brightness': self.brightness,
+        })
+
+    def _export_metrics(self):
+        self._collect_metrics()
+        payload = {'time': time.time(), 'text': self.metrics.render(), 'values': self.metrics.values()}
+        self.metrics_export.update({'payload': json.dumps(payload)})
+
+    def _tick(self):
+        ''' One slot of the main loop: render only if something changed, then sleep until the next deadline '''
+        self._update_stale()
+        if self._needs_redraw():
+            self._draw_loop()
+        else:
+            self.scheduler.frame_skipped()
+        self.power_monitor.sample(self._power_profile_name(), self.panel_watts)
+        self._export_preview()
+        if time.monotonic() >= self.next_metrics_export:
+            self.next_metrics_export = time.monotonic() + METRICS_INTERVAL
+            self._export_metrics()
+        self.scheduler.sleep()
+
+    def stop(self):
+        ''' Stop the worker processes '''
+        self.supervisor.stop()
+        if self.recorder is not None:
+            self.recorder.close()
 
     def run(self):
         try:
             # Start loop
             print('Press CTRL-C to stop')
             while True:
-                self._draw_loop()
+                self._tick()
         except KeyboardInterrupt:
+            print(self.scheduler.report())
+            print(self.power_monitor.report())
+            print(self.supervisor.report())
             print('Exiting\n')
             sys.exit(0)
 
@@ -0,0 +1,252 @@
+"""
+Fixed-memory history of sensor readings.
+
+Every channel keeps raw samples in a ring buffer and rolls them up into 1 minute and then
+15 minute aggregates (mean/min/max), each tier in its own ring buffer, so memory use is
+bounded no matter how long the clock runs. Min/max/trend over the last hour and day are
+maintained incrementally so reading them is O(1).
+"""
+from collections import deque
+import math
+import os
+
+import numpy as np
+
+SENSOR_HISTORY_FILE = "sensor_history.npz"
+
+# name: (bucket seconds, seconds kept). Bucket 0 means raw samples, as often as they're recorded.
+TIERS = {
+    'raw': (0, 60*60),            # an hour
+    '1m': (60, 60*60*24*2),       # two days
+    '15m': (60*15, 60*60*24*30),  # thirty days
+}
+
+# Sliding windows every channel keeps stats over, name: (tier they're fed from, seconds)
+WINDOWS = {
+    '1h': ('raw', 60*60),
+    '24h': ('1m', 60*60*24),
+}
+
+def tier_capacity(tier, sample_interval):
+    ''' Samples a tier needs to hold its TIERS seconds, with raw samples every sample_interval seconds '''
+    bucket_seconds, seconds = TIERS[tier]
+    return math.ceil(seconds/(bucket_seconds or sample_interval))
+
+class RingBuffer:
+    ''' Samples of (time, mean, min, max) in preallocated arrays, oldest overwritten first '''
+    FIELDS = ('time', 'mean', 'min', 'max')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.full((len(self.FIELDS), capacity), np.nan)
+        self.head = 0
+        self.count = 0
+
+    def append(self, t, mean, low, high):
+        self.data[:, self.head] = (t, mean, low, high)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        if self.count == 0:
+            return None
+        return tuple(self.data[:, self.head - 1])
+
+    def ordered(self):
+        ''' All samples oldest first, shape (4, count) '''
+        if self.count < self.capacity:
+            return self.data[:, :self.count].copy()
+        return np.roll(self.data, -self.head, axis=1)
+
+class SlidingWindow:
+    '''
+    Min, max and least squares trend over the samples of the last `seconds`.
+    Monotonic deques and running sums make every query O(1) and appends amortized O(1).
+    The sums are of times relative to _t0, which is moved up to the oldest sample and the sums
+    recomputed once it's a whole window behind, so they don't lose precision over weeks.
+    '''
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._samples = deque()
+        self._mins = deque()
+        self._maxs = deque()
+        self._t0 = None
+        self._n = 0
+        self._sum_t = self._sum_v = self._sum_tt = self._sum_tv = 0.0
+
+    def append(self, t, mean, low, high):
+        if self._t0 is None:
+            self._t0 = t
+        x = t - self._t0
+        self._samples.append((t, mean))
+        self._n += 1
+        self._sum_t += x
+        self._sum_v += mean
+        self._sum_tt += x*x
+        self._sum_tv += x*mean
+
+        while self._mins and self._mins[-1][1] >= low:
+            self._mins.pop()
+        self._mins.append((t, low))
+        while self._maxs and self._maxs[-1][1] <= high:
+            self._maxs.pop()
+        self._maxs.append((t, high))
+
+        self._expire(t)
+        if t - self._t0 > 2*self.seconds:
+            self._rebase()
+
+    def _rebase(self):
+        ''' Measure times from the oldest sample and recompute the sums from scratch '''
+        self._t0 = self._samples[0][0]
+        self._sum_t = self._sum_v = self._sum_tt = self._sum_tv = 0.0
+        for t, v in self._samples:
+            x = t - self._t0
+            self._sum_t += x
+            self._sum_v += v
+            self._sum_tt += x*x
+            self._sum_tv += x*v
+
+    def _expire(self, now):
+        cutoff = now - self.seconds
+        while self._samples and self._samples[0][0] < cutoff:
+            t, v = self._samples.popleft()
+            x = t - self._t0
+            self._n -= 1
+            self._sum_t -= x
+            self._sum_v -= v
+            self._sum_tt -= x*x
+            self._sum_tv -= x*v
+        while self._mins and self._mins[0][0] < cutoff:
+            self._mins.popleft()
+        while self._maxs and self._maxs[0][0] < cutoff:
+            self._maxs.popleft()
+
+    def min(self):
+        return self._mins[0][1] if self._mins else None
+
+    def max(self):
+        return self._maxs[0][1] if self._maxs else None
+
+    def trend(self):
+        ''' Slope of the least squares fit in units per hour, None with too few samples '''
+        denominator = self._n*self._sum_tt - self._sum_t**2
+        if self._n < 2 or denominator <= 0:
+            return None
+        return 3600*(self._n*self._sum_tv - self._sum_t*self._sum_v)/denominator
+
+class ChannelHistory:
+    def __init__(self, sample_interval, smoothing_seconds=60):
+        self.tiers = {name: RingBuffer(tier_capacity(name, sample_interval)) for name in TIERS}
+        # Window name: (tier it is fed from, window)
+        self.windows = {name: (tier, SlidingWindow(seconds)) for name, (tier, seconds) in WINDOWS.items()}
+        self.smoothing_seconds = smoothing_seconds
+        self.smoothed = None
+        self._last_t = None
+        # Partially filled aggregate buckets: tier name -> [bucket start, sum, count, min, max]
+        self._buckets = {}
+
+    def append(self, t, value):
+        if value is None or math.isnan(value):
+            return
+
+        # Exponential moving average, time based so uneven sample spacing is handled
+        if self.smoothed is None:
+            self.smoothed = value
+        else:
+            alpha = 1 - math.exp(-max(t - self._last_t, 0)/self.smoothing_seconds)
+            self.smoothed += alpha*(value - self.smoothed)
+        self._last_t = t
+
+        self._add_to_tier('raw', t, value, value, value)
+
+    def _add_to_tier(self, tier_name, t, mean, low, high):
+        self.tiers[tier_name].append(t, mean, low, high)
+        for window_tier, window in self.windows.values():
+            if window_tier == tier_name:
+                window.append(t, mean, low, high)
+
+        # Roll up into the next coarser tier once a bucket of it is complete
+        names = list(TIERS)
+        index = names.index(tier_name)
+        if index + 1 == len(names):
+            return
+        next_tier = names[index + 1]
+        bucket_seconds = TIERS[next_tier][0]
+        bucket_start = t - t % bucket_seconds
+        bucket = self._buckets.get(next_tier)
+        if bucket is not None and bucket[0] != bucket_start:
+            start, total, count, bucket_low, bucket_high = bucket
+            bucket = None
+            self._add_to_tier(next_tier, start, total/count, bucket_low, bucket_high)
+        if bucket is None:
+            self._buckets[next_tier] = [bucket_start, mean, 1, low, high]
+        else:
+            bucket[1] += mean
+            bucket[2] += 1
+            bucket[3] = min(bucket[3], low)
+            bucket[4] = max(bucket[4], high)
+
+    def latest(self):
+        ''' (time, value) of the newest raw sample or None '''
+        sample = self.tiers['raw'].latest()
+        return (sample[0], sample[1]) if sample is not None else None
+
+    def stats(self, window='1h'):
+        ''' {'min', 'max', 'trend'} over one of the tracked windows ("1h" or "24h"), trend per hour '''
+        _, sliding_window = self.windows[window]
+        return {'min': sliding_window.min(), 'max': sliding_window.max(), 'trend': sliding_window.trend()}
+
+    def series(self, tier='raw'):
+        ''' (times, means, mins, maxs) arrays oldest first for plotting or analysis '''
+        return tuple(self.tiers[tier].ordered())
+
+class SensorHistory:
+    def __init__(self, channels, sample_interval, path=SENSOR_HISTORY_FILE):
+        ''' sample_interval is the seconds between calls to record(), which sizes the raw tier '''
+        self.path = path
+        self.channels = {name: ChannelHistory(sample_interval) for name in channels}
+
+    def record(self, sensor_data, t):
+        for name, channel in self.channels.items():
+            if sensor_data.get(name) is not None:
+                channel.append(t, sensor_data[name])
+
+    def save(self):
+        ''' Write every tier to a compressed .npz, via a temp file so a crash can't corrupt it '''
+        arrays = {}
+        for name, channel in self.channels.items():
+            for tier_name, tier in channel.tiers.items():
+                samples = tier.ordered()
+                # Times need float64 precision, readings are fine as float32
+                arrays[f'{name}/{tier_name}/time'] = samples[0]
+                arrays[f'{name}/{tier_name}/values'] = samples[1:].astype(np.float32)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        ''' Restore saved tiers and rebuild the sliding windows from them '''
+        try:
+            saved = np.load(self.path)
+        except (FileNotFoundError, IOError, ValueError):
+            print(f"Unable to read {self.path}, starting sensor history over")
+            return
+
+        with saved:
+            for name, channel in self.channels.items():
+                for tier_name, tier in channel.tiers.items():
+                    key = f'{name}/{tier_name}'
+                    if f'{key}/time' not in saved.files:
+                        continue
+                    times = saved[f'{key}/time'][-tier.capacity:]
+                    values = saved[f'{key}/values'].astype(np.float64)[:, -tier.capacity:]
+                    for t, (mean, low, high) in zip(times, values.T):
+                        tier.append(t, mean, low, high)
+                        for window_tier, window in channel.windows.values():
+                            if window_tier == tier_name:
+                                window.append(t, mean, low, high)
+                latest = channel.latest()
+                if latest is not None:
+                    channel._last_t, channel.smoothed = latest
@@ -0,0 +1,115 @@
+"""
+Deadline based scheduler for reading the I2C sensors.
+
+Every device declares how often it wants to be read and runs on its own deadline, so a slow
+or failing read of one sensor doesn't push back the others. Transient bus errors are retried
+shortly after instead of blocking the loop, and every read's latency and outcome is counted.
+"""
+import heapq
+import os
+import time
+
+# Errors the adafruit drivers raise for a flaky bus: OSError for NACKs/remote I/O errors,
+# RuntimeError for CRC mismatches
+TRANSIENT_ERRORS = (OSError, RuntimeError)
+
+RETRY_DELAY = 0.05
+MAX_RETRIES = 3
+
+class SensorTask:
+    def __init__(self, name, interval, read, first_delay=0):
+        '''
+        read is called with no arguments every interval seconds, the first time first_delay
+        seconds after starting. It returns a dict of sensor values or None if it has nothing to publish.
+        '''
+        self.name = name
+        self.interval = interval
+        self.read = read
+        self.first_delay = first_delay
+        self.reads = 0
+        self.errors = 0
+        self.failures = 0  # Reads that still failed after every retry
+        self.retries = 0
+        self.due = None  # Deadline the current read was scheduled for, kept while retrying
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_latency = None
+
+    def record_latency(self, latency):
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.last_latency = latency
+
+    def stats(self):
+        attempts = self.reads + self.errors
+        return {
+            'reads': self.reads,
+            'errors': self.errors,
+            'failures': self.failures,
+            'mean_latency_ms': 1000*self.latency_total/attempts if attempts else None,
+            'max_latency_ms': 1000*self.latency_max,
+        }
+
+class PollScheduler:
+    def __init__(self, tasks, clock=time.monotonic, sleep=time.sleep):
+        self.tasks = tasks
+        self.clock = clock
+        self._sleep = sleep
+        now = clock()
+        # (deadline, order, task), order breaks ties so tasks never get compared
+        self._queue = [(now + task.first_delay, i, task) for i, task in enumerate(tasks)]
+        heapq.heapify(self._queue)
+
+    def run_due(self):
+        '''
+        Run every task whose deadline has passed. Returns the values read, merged into one dict.
+        '''
+        values = {}
+        while self._queue and self._queue[0][0] <= self.clock():
+            deadline, order, task = heapq.heappop(self._queue)
+            if task.retries == 0:
+                task.due = deadline
+            start = self.clock()
+            try:
+                result = task.read()
+            except TRANSIENT_ERRORS as e:
+                task.record_latency(self.clock() - start)
+                task.errors += 1
+                if task.retries < MAX_RETRIES:
+                    task.retries += 1
+                    next_deadline = self.clock() + RETRY_DELAY
+                else:
+                    print(f"Sensor error! {task.name}: {e}")
+                    task.failures += 1
+                    task.retries = 0
+                    next_deadline = task.due + task.interval
+            else:
+                task.record_latency(self.clock() - start)
+                task.reads += 1
+                task.retries = 0
+                next_deadline = task.due + task.interval
+                if result:
+                    values.update(result)
+
+            # Don't try to catch up on missed deadlines, a late read is just late
+            next_deadline = max(next_deadline, self.clock())
+            heapq.heappush(self._queue, (next_deadline, order, task))
+        return values
+
+    def time_until_next(self):
+        return max(self._queue[0][0] - self.clock(), 0) if self._queue else None
+
+    def sleep_until_next(self):
+        self._sleep(self.time_until_next())
+
+    def stats(self):
+        return {task.name: task.stats() for task in self.tasks}
+
+def write_baselines(path, eco2_baseline, tvoc_baseline):
+    ''' Write to a temp file and rename it over the old baselines, so a power cut can't leave half a file '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(f"{eco2_baseline},{tvoc_baseline}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
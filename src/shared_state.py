@@ -0,0 +1,155 @@
+"""
+Latest-value mailbox shared between the worker processes and the renderer.
+
+Each field lives at a fixed offset in a block of shared memory together with the time it was
+last written. Nothing is pickled or queued, so the renderer can never fall behind.
+
+The mailbox is a seqlock: a writer makes the sequence number odd, overwrites the fields it changes
+in place and makes it even again. Readers never lock, they copy the buffer and try again if the
+sequence was odd or changed while they copied. Only writers take a lock, between themselves, and
+recover() replaces it when a writer was killed, possibly in the middle of a write.
+"""
+import math
+import multiprocessing
+import struct
+import time
+
+# Times snapshot() copies the buffer while it's being written before giving up
+SNAPSHOT_RETRIES = 100
+
+def _encode_str(value):
+    encoded = str(value).encode()
+    if len(encoded) > 16:
+        raise ValueError(f"{value!r} is too long for a str field, the limit is 16 bytes")
+    return encoded
+
+def _encode_text(value, size):
+    encoded = str(value).encode()
+    if len(encoded) > size:
+        raise ValueError(f"{len(encoded)} bytes is too long for a text field of {size} bytes")
+    return encoded
+
+def _text_kind(size):
+    return (f'{size}s',
+            lambda v: b'' if v is None else _encode_text(v, size),
+            lambda v: v.rstrip(b'\0').decode() or None)
+
+# Field kind: (struct format, encode, decode). None is stored as a sentinel value.
+_KINDS = {
+    'float': ('d',
+              lambda v: math.nan if v is None else float(v),
+              lambda v: None if math.isnan(v) else v),
+    'bool':  ('b',
+              lambda v: -1 if v is None else int(bool(v)),
+              lambda v: None if v < 0 else bool(v)),
+    'str':   ('16s',
+              lambda v: b'' if v is None else _encode_str(v),
+              lambda v: v.rstrip(b'\0').decode() or None),
+    # Larger payloads like the metrics snapshot, must fit in 64KB once encoded.
+    # ('text', size) makes a field of another size.
+    'text':  _text_kind(65536),
+    'rgb':   ('i',
+              lambda v: -1 if v is None else (int(v[0]) << 16) | (int(v[1]) << 8) | int(v[2]),
+              lambda v: None if v < 0 else ((v >> 16) & 0xFF, (v >> 8) & 0xFF, v & 0xFF)),
+}
+
+def _kind(kind):
+    if isinstance(kind, tuple):
+        name, size = kind
+        if name != 'text':
+            raise ValueError(f"Only text fields can be given a size, not {name}")
+        return _text_kind(size)
+    return _KINDS[kind]
+
+class SharedState:
+    def __init__(self, fields):
+        '''
+        fields: {name: kind} where kind is one of "float", "bool", "str", "text" or "rgb",
+        or ("text", size in bytes)
+        '''
+        self.fields = dict(fields)
+        self._formats = ['<' + _kind(kind)[0] + 'd' for kind in self.fields.values()]
+        self._offsets = []
+        size = 0
+        for fmt in self._formats:
+            self._offsets.append(size)
+            size += struct.calcsize(fmt)
+        self._buffer = multiprocessing.RawArray('B', size)
+        # Odd while a write is in progress, the version is half of it
+        self._sequence = multiprocessing.RawValue('Q', 0)
+        self._lock = multiprocessing.Lock()
+        self._init_struct()
+        self.update({name: None for name in self.fields}, 0.0)
+        self._sequence.value = 0
+        # The newest snapshot this process read, returned while a dead writer left the sequence odd
+        self._last = (0, bytes(self._buffer))
+
+    def _init_struct(self):
+        self._structs = [struct.Struct(fmt) for fmt in self._formats]
+        self._codecs = [_kind(kind) for kind in self.fields.values()]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_structs'], state['_codecs']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_struct()
+
+    @property
+    def version(self):
+        ''' Incremented on every update, cheap to poll '''
+        return self._sequence.value >> 1
+
+    def update(self, values, timestamp=None):
+        ''' Overwrite the fields present in values, stamping them with timestamp (default now) '''
+        if timestamp is None:
+            timestamp = time.time()
+        # Encode first, so a value that doesn't fit raises before anything is written
+        changes = [(self._structs[i], self._offsets[i], encode(values[name]))
+                   for i, (name, (_, encode, _)) in enumerate(zip(self.fields, self._codecs)) if name in values]
+        with self._lock:
+            self._sequence.value += 1
+            for field_struct, offset, value in changes:
+                field_struct.pack_into(self._buffer, offset, value, timestamp)
+            self._sequence.value += 1
+
+    def recover(self):
+        '''
+        Make the mailbox writable again after a writer process was killed. Call it before starting
+        the writer's replacement, while no other process is writing. A field the dead writer was
+        halfway through may be garbled until it's written again.
+        '''
+        self._lock = multiprocessing.Lock()
+        if self._sequence.value & 1:
+            self._sequence.value += 1
+
+    def _read(self):
+        ''' A consistent copy of the mailbox as (version, packed), or None if it kept changing '''
+        for _ in range(SNAPSHOT_RETRIES):
+            sequence = self._sequence.value
+            if sequence & 1:
+                continue
+            data = bytes(self._buffer)
+            if self._sequence.value == sequence:
+                return sequence >> 1, data
+        return None
+
+    def snapshot(self):
+        '''
+        Returns (version, {name: value}, {name: timestamp}) for the newest data.
+        A timestamp of 0 means the field was never written. Never waits on a writer: if one is in
+        the middle of a write every time it looks, it returns the previous snapshot again.
+        '''
+        read = self._read()
+        if read is None:
+            read = self._last
+        self._last = read
+        version, data = read
+        values, timestamps = {}, {}
+        for name, field_struct, offset, (_, _, decode) in zip(self.fields, self._structs, self._offsets, self._codecs):
+            value, timestamp = field_struct.unpack_from(data, offset)
+            values[name] = decode(value)
+            timestamps[name] = timestamp
+        return version, values, timestamps
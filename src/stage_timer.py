@@ -0,0 +1,25 @@
+import time
+from contextlib import contextmanager
+
+class StageTimer:
+    '''
+    Records how long each named stage of a frame took.
+    `last_frame` holds the timings of the most recently finished frame in seconds.
+    '''
+    def __init__(self):
+        self.current = {}
+        self.last_frame = {}
+
+    def begin_frame(self):
+        self.current = {}
+
+    def end_frame(self):
+        self.last_frame = self.current
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current[name] = self.current.get(name, 0.0) + time.perf_counter() - start
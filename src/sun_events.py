@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+import ephem
+
+def _to_degrees_str(decimal):
+    minutes = 60*(decimal - int(decimal))
+    seconds = 60*(minutes - int(minutes))
+    return f"{int(decimal)}:{int(minutes)}:{seconds}"
+
+class SunEventCache:
+    '''
+    Caches the next sunrise and sunset for a location.
+    They are only solved again once the sooner of the two has passed or the location changes.
+    '''
+    def __init__(self):
+        self.location = None
+        self.sunrise = None
+        self.sunset = None
+        self.solve_count = 0
+
+    def _solve(self, lat, lon, now):
+        o = ephem.Observer()
+        o.lat = _to_degrees_str(lat)
+        o.long = _to_degrees_str(lon)
+        # now is naive local time, ephem wants naive UTC
+        o.date = now.astimezone(timezone.utc).replace(tzinfo=None)
+
+        sun = ephem.Sun(o)
+        self.sunrise = ephem.localtime(o.next_rising(sun))
+        self.sunset = ephem.localtime(o.next_setting(sun))
+        self.location = (lat, lon)
+        self.solve_count += 1
+
+    def next_event(self, lat, lon, now=None):
+        '''
+        Get either the sunrise or sunset time depending on which is sooner
+        Returns (local datetime, is_sunrise)
+        '''
+        if now is None:
+            now = datetime.now()
+
+        if self.location != (lat, lon) or now >= min(self.sunrise, self.sunset):
+            self._solve(lat, lon, now)
+
+        if self.sunrise < self.sunset:
+            return self.sunrise, True
+        else:
+            return self.sunset, False
@@ -0,0 +1,189 @@
+"""
+Keeps the worker processes running.
+
+Every worker gets a heartbeat in shared memory that it bumps whenever it makes progress. The
+renderer checks on them a couple of times a second: a worker that exited, or hasn't beaten for
+longer than its hang timeout, is killed and started again after an exponential backoff. Until
+the new process beats for the first time its data is marked stale on the panel.
+
+The checks run on the render thread, so they never wait on a worker: a failed one is sent
+SIGTERM, then SIGKILL if it's still there a second later, and reaped once it has exited. Only
+then is its replacement started, after recovering the mailboxes in its args so a write the old
+process was killed in the middle of can't leave them locked. Those mailboxes must only be written
+by the worker and the renderer.
+
+Time to recovery is from a worker's last heartbeat before it failed to the first one from the
+process that replaced it, so it includes the time it took to notice.
+"""
+import multiprocessing
+import time
+
+from shared_state import SharedState
+
+# Seconds between checks on the workers
+CHECK_INTERVAL = 0.5
+# Restart backoff in seconds, doubling with every failure in a row up to the max
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+# A worker that's been up this long has recovered, its next failure starts the backoff over
+STABLE_AFTER = 60
+# Seconds a worker gets to exit after SIGTERM before it's killed
+TERMINATE_TIMEOUT = 1
+
+class Heartbeat:
+    ''' A monotonic timestamp in shared memory that a worker bumps to show it's still working '''
+    def __init__(self):
+        self._value = multiprocessing.RawValue('d', 0.0)
+
+    def beat(self):
+        # CLOCK_MONOTONIC is system wide on linux, so the renderer can compare it with its own
+        self._value.value = time.monotonic()
+
+    def last(self):
+        return self._value.value or None
+
+class Worker:
+    def __init__(self, name, target, args, hang_timeout):
+        '''
+        target(*args, heartbeat=...) runs in its own process and must beat at least every
+        hang_timeout seconds, including while it starts up
+        '''
+        self.name = name
+        self.target = target
+        self.args = args
+        self.hang_timeout = hang_timeout
+        self.heartbeat = Heartbeat()
+        self.process = None
+        # A failed process that hasn't exited yet, and when to stop asking it to
+        self.dying = None
+        self.kill_at = None
+        self.started = None
+        # Whether the current process has beaten since it started
+        self.healthy = False
+        self.restarts = 0
+        self.failures = 0
+        self.failed_at = None
+        self.restart_at = None
+        self.recoveries = []
+
+    def start(self, now):
+        self.process = multiprocessing.Process(target=self.target, args=self.args,
+                                               kwargs={'heartbeat': self.heartbeat}, name=self.name)
+        self.process.start()
+        self.started = now
+        self.restart_at = None
+
+    def heartbeat_age(self, now):
+        last = self.heartbeat.last()
+        return now - last if last is not None else None
+
+class Supervisor:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.workers = {}
+        self._next_check = 0
+
+    def add(self, name, target, args, hang_timeout):
+        ''' Start a worker. A target of None is left out, e.g. when replaying recorded inputs '''
+        if target is None:
+            return None
+        worker = Worker(name, target, args, hang_timeout)
+        worker.start(self.clock())
+        self.workers[name] = worker
+        return worker
+
+    def stale(self, name):
+        ''' Whether a worker's data can't be trusted because it's down or hasn't come back up yet '''
+        worker = self.workers.get(name)
+        return worker is not None and not worker.healthy
+
+    def _fail(self, worker, now, reason):
+        last = worker.heartbeat.last()
+        if worker.healthy or worker.failed_at is None:
+            # When it stopped working, for the time to recovery
+            worker.failed_at = last if last is not None and last >= worker.started else worker.started
+        worker.healthy = False
+        worker.failures += 1
+        delay = min(BACKOFF_MAX, BACKOFF_BASE*2**(worker.failures - 1))
+        print(f"Worker {worker.name} {reason}, restarting in {delay} s")
+
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.dying = worker.process
+        worker.kill_at = now + TERMINATE_TIMEOUT
+        worker.process = None
+        worker.restart_at = now + delay
+
+    def _reap(self, worker, now):
+        ''' Whether a failed worker has exited, killing it once it's had TERMINATE_TIMEOUT to '''
+        # is_alive() doesn't block, and reaps the process if it has exited
+        if worker.dying.is_alive():
+            if now >= worker.kill_at:
+                worker.dying.kill()
+            return False
+        worker.dying = None
+        return True
+
+    def _check(self, worker, now):
+        if worker.process is None:
+            if worker.dying is not None and not self._reap(worker, now):
+                return
+            if now >= worker.restart_at:
+                for arg in worker.args:
+                    if isinstance(arg, SharedState):
+                        arg.recover()
+                worker.restarts += 1
+                worker.start(now)
+            return
+
+        if not worker.process.is_alive():
+            self._fail(worker, now, f"exited with code {worker.process.exitcode}")
+            return
+        last = worker.heartbeat.last()
+        if last is None or last < worker.started:
+            # Still starting up
+            if now - worker.started > worker.hang_timeout:
+                self._fail(worker, now, f"didn't start within {worker.hang_timeout} s")
+            return
+        if now - last > worker.hang_timeout:
+            self._fail(worker, now, f"hung for {now - last:.1f} s")
+            return
+
+        if not worker.healthy:
+            worker.healthy = True
+            if worker.failed_at is not None:
+                worker.recoveries.append(last - worker.failed_at)
+                print(f"Worker {worker.name} recovered after {worker.recoveries[-1]:.1f} s")
+                worker.failed_at = None
+        if worker.failures and now - worker.started > STABLE_AFTER:
+            worker.failures = 0
+
+    def check(self):
+        ''' Restart workers that died or hung. Cheap to call every frame, it only looks every CHECK_INTERVAL '''
+        now = self.clock()
+        if now < self._next_check:
+            return
+        self._next_check = now + CHECK_INTERVAL
+        for worker in self.workers.values():
+            self._check(worker, now)
+
+    def stop(self):
+        for worker in self.workers.values():
+            for process in (worker.process, worker.dying):
+                if process is not None:
+                    process.terminate()
+                    process.join(TERMINATE_TIMEOUT)
+                    if process.is_alive():
+                        process.kill()
+                        process.join()
+            worker.process = worker.dying = None
+
+    def report(self):
+        lines = []
+        for worker in self.workers.values():
+            line = f"{worker.name}: {worker.restarts} restarts"
+            if worker.recoveries:
+                line += (f", mean time to recovery {sum(worker.recoveries)/len(worker.recoveries):.1f} s"
+                         f" (max {max(worker.recoveries):.1f} s)")
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,35 @@
+from collections import OrderedDict
+
+import numpy as np
+
+class TextCache:
+    '''
+    LRU cache of rendered strings keyed by (atlas, text, color).
+    Each entry is (rgb pixels, mask) ready to be copied onto a canvas.
+    '''
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def render(self, atlas, text, color):
+        key = (atlas, text, color)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        mask = atlas.render(text)
+        pixels = np.zeros(mask.shape + (3,), dtype=np.uint8)
+        pixels[mask] = color
+        entry = (pixels, mask)
+        self._entries[key] = entry
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
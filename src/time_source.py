@@ -0,0 +1,48 @@
+"""
+Where the renderer gets the time from.
+
+The clock normally reads the system clocks, but a replay of recorded inputs needs every frame
+to see the time it was recorded at, so LEDClock takes a time source instead of calling
+time.time(), time.monotonic() and datetime.now() directly.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+class SystemTime:
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        ''' Naive local time, like datetime.now() '''
+        return datetime.now()
+
+    def utc_offset(self):
+        ''' Seconds local time is ahead of UTC right now '''
+        return time.localtime().tm_gmtoff
+
+class FixedTime:
+    ''' Time that only moves when it's set, for replays '''
+    def __init__(self, wall=0.0, monotonic=0.0, utc_offset=0):
+        self.set(wall, monotonic, utc_offset)
+
+    def set(self, wall, monotonic, utc_offset=0):
+        self.wall = wall
+        self.mono = monotonic
+        self.offset = utc_offset
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+    def now(self):
+        # Local time where it was recorded, whatever time zone the replay runs in
+        local = timezone(timedelta(seconds=self.offset))
+        return datetime.fromtimestamp(self.wall, local).replace(tzinfo=None)
+
+    def utc_offset(self):
+        return self.offset
@@ -0,0 +1,117 @@
+"""
+On-disk cache of weather data that survives restarts.
+
+Holds the NWS forecast URL resolved for a lat/lon, plus the last good values of every source
+along with when they were fetched and the HTTP validators (ETag/Last-Modified) needed to make
+conditional requests.
+"""
+import json
+import os
+import threading
+import time
+
+from nws_forecast import IntervalIndex, forecast_values
+
+WEATHER_CACHE_FILE = "weather_cache.json"
+
+# Names of the weather_fetcher sources, here so the renderer can lay out their metrics without
+# importing weather_fetcher, which pulls in requests
+WEATHER_SOURCES = ('openweather', 'purpleair', 'nws')
+
+# Cached values older than this aren't worth showing at startup
+MAX_SEED_AGE = 60*60*12
+
+class WeatherCache:
+    def __init__(self, path=WEATHER_CACHE_FILE):
+        ''' A path of None keeps the cache in memory only '''
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {'gridpoints': {}, 'sources': {}}
+        if path is None:
+            return
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self._data['gridpoints'].update(data.get('gridpoints', {}))
+            self._data['sources'].update(data.get('sources', {}))
+        except (FileNotFoundError, IOError, ValueError):
+            pass
+
+    def _save(self):
+        ''' Write to a temp file and rename it over the cache, so a power cut can't leave half a file '''
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+
+    def gridpoint(self, lat, lon):
+        return self._data['gridpoints'].get(f"{lat},{lon}")
+
+    def set_gridpoint(self, lat, lon, url):
+        with self._lock:
+            self._data['gridpoints'][f"{lat},{lon}"] = url
+            self._save()
+
+    def clear_gridpoint(self, lat, lon):
+        with self._lock:
+            if self._data['gridpoints'].pop(f"{lat},{lon}", None) is not None:
+                self._save()
+
+    def validators(self, source, url):
+        ''' ETag/Last-Modified from the last good response, only if it was for the same URL '''
+        entry = self._data['sources'].get(source)
+        if entry is None or entry['url'] != url:
+            return {}
+        return entry['validators']
+
+    def values(self, source):
+        entry = self._data['sources'].get(source)
+        return entry['values'] if entry is not None else None
+
+    def fetched_time(self, source):
+        entry = self._data['sources'].get(source)
+        return entry['fetched'] if entry is not None else None
+
+    def index(self, source):
+        ''' Parsed data a source kept alongside its values, if any '''
+        entry = self._data['sources'].get(source)
+        return entry.get('index') if entry is not None else None
+
+    def store(self, source, url, validators, values, index=None):
+        with self._lock:
+            self._data['sources'][source] = {
+                'url': url,
+                'validators': validators,
+                'values': values,
+                'fetched': time.time(),
+            }
+            if index is not None:
+                self._data['sources'][source]['index'] = index
+            self._save()
+
+    def mark_fresh(self, source):
+        ''' The server said nothing changed, so the cached values are current as of now '''
+        with self._lock:
+            entry = self._data['sources'].get(source)
+            if entry is not None:
+                entry['fetched'] = time.time()
+                self._save()
+
+    def seed(self, weather_state, now=None):
+        '''
+        Load recent enough cached values into the weather mailbox, stamped with when they were
+        fetched. Sources that kept a forecast index (NWS) are evaluated at now instead, so a low
+        or high that has since ended isn't put back.
+        '''
+        if now is None:
+            now = time.time()
+        for source, entry in self._data['sources'].items():
+            if now - entry['fetched'] >= MAX_SEED_AGE:
+                continue
+            values = entry['values']
+            if 'index' in entry:
+                values = forecast_values({name: IntervalIndex(intervals) for name, intervals in entry['index'].items()},
+                                         now)
+            weather_state.update(values, timestamp=entry['fetched'])
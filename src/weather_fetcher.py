@@ -0,0 +1,303 @@
+"""
+Polls the weather and air quality APIs.
+
+Every source runs in its own thread with its own keep-alive session and refresh interval, so
+one slow or failing API doesn't hold up the others. Failures back off exponentially with jitter
+instead of hammering the API. Results are written straight into the shared weather mailbox.
+"""
+import random
+import threading
+import time
+
+import requests
+
+from nws_forecast import IntervalIndex, forecast_values, parse_forecast_grid
+from weather_cache import WEATHER_SOURCES
+
+WEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={key}&units=imperial"
+PURPLEAIR_API_URL = "https://ethanj.me/aqi/api?lat={lat}&lon={lon}&radius=2&correction=none"
+NWS_GRIDPOINT_API_URL = "https://api.weather.gov/points/{lat},{lon}"
+
+# (connect, read) timeouts in seconds
+HTTP_TIMEOUT = (3.05, 10)
+
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60*10
+
+# After failing for this long a source's fields are cleared so the display shows ?? again
+STALE_AFTER = 60*30
+
+# A fetch taking longer than this is stuck, well past every request's timeout
+FETCH_HANG_TIMEOUT = 60
+# Seconds between heartbeats while every poller is healthy
+HEARTBEAT_INTERVAL = 1
+
+class FetchError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        # HTTP status of the response that failed, None if it wasn't an HTTP error
+        self.status = status
+
+def _get(session, url, validators=None):
+    '''
+    GET url, conditionally if validators from a previous response are given
+    Returns (response, validators), or (None, validators) if the server says nothing changed
+    '''
+    headers = {}
+    if validators:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    r = session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+    if r.status_code == 304 and validators:
+        return None, validators
+    if r.status_code != 200:
+        raise FetchError(f"HTTP {r.status_code} from {url}", r.status_code)
+
+    new_validators = {}
+    if 'ETag' in r.headers:
+        new_validators['etag'] = r.headers['ETag']
+    if 'Last-Modified' in r.headers:
+        new_validators['last_modified'] = r.headers['Last-Modified']
+    return r, new_validators
+
+def _json(r):
+    try:
+        return r.json()
+    except ValueError:
+        raise FetchError(f"Invalid JSON from {r.url}")
+
+def _cached_get(session, cache, source, url):
+    ''' Conditional GET using the validators cached for source. The response is None if the cached values are still good '''
+    r, validators = _get(session, url, cache.validators(source, url))
+    if r is None:
+        cache.mark_fresh(source)
+    return r, validators
+
+class OpenWeatherSource:
+    name = 'openweather'
+    fields = ('temp', 'humid', 'icon')
+    default_interval = 60*2
+
+    def __init__(self, config, cache, url=WEATHER_API_URL):
+        self.url = url.format(lat=config['lat'], lon=config['lon'], key=config['openweather_api_key'])
+        self.cache = cache
+
+    def fetch(self, session):
+        r, validators = _cached_get(session, self.cache, self.name, self.url)
+        if r is None:
+            return self.cache.values(self.name)
+        data = _json(r)
+        try:
+            values = {
+                'temp': data['main']['temp'],
+                'humid': data['main']['humidity'],
+                'icon': data['weather'][0]['icon'],
+            }
+        except (KeyError, IndexError):
+            raise FetchError("Openweather data poorly formatted!")
+        self.cache.store(self.name, self.url, validators, values)
+        return values
+
+class PurpleAirSource:
+    name = 'purpleair'
+    fields = ('aqi', 'aqi_color')
+    default_interval = 60*2
+
+    def __init__(self, config, cache, url=PURPLEAIR_API_URL):
+        self.url = url.format(lat=config['lat'], lon=config['lon'])
+        self.cache = cache
+
+    def fetch(self, session):
+        r, validators = _cached_get(session, self.cache, self.name, self.url)
+        if r is None:
+            return self.cache.values(self.name)
+        data = _json(r)
+        try:
+            values = {
+                'aqi': data['aqi'],
+                'aqi_color': (data['color']['r'], data['color']['g'], data['color']['b']),
+            }
+        except KeyError:
+            raise FetchError("Purpleair dash data poorly formatted!")
+        self.cache.store(self.name, self.url, validators, values)
+        return values
+
+class NWSForecastSource:
+    name = 'nws'
+    fields = ('low_temp', 'high_temp')
+    default_interval = 60*15
+
+    def __init__(self, config, cache, url=NWS_GRIDPOINT_API_URL):
+        self.lat, self.lon = config['lat'], config['lon']
+        self.gridpoint_url = url.format(lat=self.lat, lon=self.lon)
+        self.cache = cache
+        # Resolved from the gridpoint lookup once per location and kept in the on-disk cache, until
+        # the forecast URL is not found or returns data that doesn't parse
+        self.forecast_url = cache.gridpoint(self.lat, self.lon)
+        # Parsed forecast series, kept between fetches so they can be re-evaluated as time passes
+        self.index = None
+        cached_index = cache.index(self.name)
+        if cached_index is not None:
+            self.index = {name: IntervalIndex(intervals) for name, intervals in cached_index.items()}
+
+    def fetch(self, session):
+        if not self.forecast_url:
+            r, _ = _get(session, self.gridpoint_url)
+            try:
+                self.forecast_url = _json(r)['properties']['forecastGridData']
+            except KeyError:
+                raise FetchError("Error parsing NWS data")
+            self.cache.set_gridpoint(self.lat, self.lon, self.forecast_url)
+
+        try:
+            r, validators = _cached_get(session, self.cache, self.name, self.forecast_url)
+        except FetchError as e:
+            # Other errors are usually the API having a bad moment, keep the URL for the retry
+            if e.status == 404:
+                self._forget_gridpoint()
+            raise
+        if r is None:
+            return self.evaluate()
+        try:
+            self.index = parse_forecast_grid(r.text)
+        except (KeyError, TypeError, ValueError):
+            self._forget_gridpoint()
+            raise FetchError("Error parsing NWS data")
+        values = self.evaluate()
+        self.cache.store(self.name, self.forecast_url, validators, values,
+                         index={name: index.to_list() for name, index in self.index.items()})
+        return values
+
+    def _forget_gridpoint(self):
+        ''' The gridpoint may have moved, look it up again next time '''
+        self.forecast_url = None
+        self.cache.clear_gridpoint(self.lat, self.lon)
+
+    def evaluate(self, t=None):
+        ''' Low and high valid at time t (default now) from the kept forecast index '''
+        if self.index is None:
+            return self.cache.values(self.name)
+        if t is None:
+            t = time.time()
+        return forecast_values(self.index, t)
+
+    def seconds_until_change(self):
+        ''' How long until the current low or high interval ends, so the poller can wake up for it '''
+        if self.index is None:
+            return None
+        now = time.time()
+        changes = [c for c in (index.next_change(now) for index in self.index.values()) if c is not None]
+        return min(changes) - now if changes else None
+
+def backoff_delay(failures):
+    ''' Exponential backoff with jitter: somewhere between half and all of BACKOFF_BASE*2^(failures-1) '''
+    delay = min(BACKOFF_MAX, BACKOFF_BASE*2**(failures - 1))
+    return delay/2 + random.uniform(0, delay/2)
+
+class SourcePoller(threading.Thread):
+    def __init__(self, source, weather_state, interval, last_success=None, metrics_state=None):
+        super().__init__(name=source.name, daemon=True)
+        self.source = source
+        self.weather_state = weather_state
+        self.interval = interval
+        self.failures = 0
+        self.last_success = last_success
+        self.metrics_state = metrics_state
+        self.requests = 0
+        self.errors = 0
+        self.http_status = None
+        self.http_latency = None
+        # Monotonic time the fetch in progress started, None between fetches
+        self.busy_since = None
+
+    def healthy(self):
+        ''' Running and not stuck in a fetch '''
+        busy_since = self.busy_since
+        return self.is_alive() and (busy_since is None or time.monotonic() - busy_since < FETCH_HANG_TIMEOUT)
+
+    def _record_response(self, r, *args, **kwargs):
+        ''' requests response hook, sees every response including the gridpoint lookup and 304s '''
+        self.requests += 1
+        self.http_status = r.status_code
+        self.http_latency = r.elapsed.total_seconds()
+
+    def _publish_metrics(self):
+        if self.metrics_state is None:
+            return
+        name = self.source.name
+        self.metrics_state.update({
+            f'{name}_requests': self.requests,
+            f'{name}_errors': self.errors,
+            f'{name}_http_status': self.http_status,
+            f'{name}_http_latency': self.http_latency,
+            f'{name}_last_success': self.last_success,
+        })
+
+    def poll_once(self, session):
+        ''' Fetch the source once, returns how long to wait before the next attempt '''
+        self.busy_since = time.monotonic()
+        try:
+            values = self.source.fetch(session)
+        except (requests.exceptions.RequestException, FetchError) as e:
+            self.failures += 1
+            self.errors += 1
+            print(f"Network error! {self.source.name}: {e}")
+            if self.last_success is None or time.time() - self.last_success > STALE_AFTER:
+                self.weather_state.update({field: None for field in self.source.fields})
+            self._publish_metrics()
+            return backoff_delay(self.failures)
+
+        self.failures = 0
+        self.last_success = time.time()
+        self.weather_state.update(values)
+        self._publish_metrics()
+
+        delay = self.interval
+        if hasattr(self.source, 'seconds_until_change'):
+            until_change = self.source.seconds_until_change()
+            if until_change is not None:
+                delay = min(delay, max(until_change, 1))
+        return delay
+
+    def run(self):
+        with requests.Session() as session:
+            session.hooks['response'].append(self._record_response)
+            while True:
+                delay = self.poll_once(session)
+                self.busy_since = None
+                time.sleep(delay)
+
+SOURCE_CLASSES = (OpenWeatherSource, PurpleAirSource, NWSForecastSource)
+assert tuple(source_class.name for source_class in SOURCE_CLASSES) == WEATHER_SOURCES, \
+    "weather_cache.WEATHER_SOURCES must list every source"
+
+def create_sources(config, cache):
+    ''' The config can override any source's URL template with "api_urls", e.g. to point at a stub server '''
+    urls = config.get('api_urls', {})
+    sources = []
+    for source_class in SOURCE_CLASSES:
+        if source_class.name in urls:
+            sources.append(source_class(config, cache, urls[source_class.name]))
+        else:
+            sources.append(source_class(config, cache))
+    return sources
+
+def run_fetchers(config, weather_state, cache, metrics_state=None, heartbeat=None):
+    '''
+    Poll every source until the process is stopped. heartbeat (a supervisor.Heartbeat) only
+    beats while every poller is running and none is stuck, so the process gets restarted if one
+    of them dies on an unexpected exception.
+    '''
+    intervals = config.get('refresh_intervals', {})
+    pollers = [SourcePoller(source, weather_state, intervals.get(source.name, source.default_interval),
+                            last_success=cache.fetched_time(source.name), metrics_state=metrics_state)
+               for source in create_sources(config, cache)]
+    for poller in pollers:
+        poller.start()
+    while True:
+        if heartbeat is not None and all(poller.healthy() for poller in pollers):
+            heartbeat.beat()
+        time.sleep(HEARTBEAT_INTERVAL)
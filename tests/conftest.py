@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# The modules in src/ import each other as top level modules, like when running src/run_clock.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+@pytest.fixture
+def in_repo_root(monkeypatch):
+    ''' The clock loads its fonts and icons from paths relative to the project root '''
+    monkeypatch.chdir(ROOT)
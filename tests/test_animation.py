@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from animation import AnimationEngine, Effect, Pulse, Scroll, Tint
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_effects_must_implement_apply():
+    class Incomplete(Effect):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_tint_fades_the_base_to_the_color_and_finishes():
+    clock = FakeClock()
+    engine = AnimationEngine(4, 2, clock=clock)
+    base = np.full((2, 4, 3), 200, dtype=np.uint8)
+    engine.add(Tint(color=(0, 0, 0), duration=1.0, easing='linear'))
+
+    assert engine.render(base).max() == 200
+    clock.now = 0.5
+    assert engine.render(base).max() == 100
+    clock.now = 1.0
+    assert engine.render(base).max() == 0
+    assert not engine.active
+
+def test_pulse_only_covers_its_rect():
+    engine = AnimationEngine(4, 4, clock=FakeClock())
+    engine.add(Pulse(color=(255, 0, 0), period=1.0, strength=1.0, rect=(1, 1, 2, 2)))
+    frame = engine.render(now=0.5)
+    assert frame[1:3, 1:3].tolist() == [[[255, 0, 0]]*2]*2
+    assert frame[0].max() == 0 and frame[3].max() == 0
+
+def test_scroll_wraps_around():
+    engine = AnimationEngine(4, 1, clock=FakeClock())
+    base = np.zeros((1, 4, 3), dtype=np.uint8)
+    base[0, 0] = 255
+    engine.add(Scroll(velocity=(-1, 0)))
+    assert engine.render(base, now=1.0)[0, 3].tolist() == [255]*3
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from auto_brightness import AutoBrightness, PowerMonitor, estimate_panel_watts, PANEL_IDLE_WATTS
+
+def test_follows_the_curve():
+    auto = AutoBrightness(curve=[(0, 10), (999, 100)], smoothing_seconds=1, hysteresis=0)
+    auto.update(0, t=0)
+    assert auto.brightness == 10
+    auto.update(999, t=1000)
+    assert auto.brightness == 100
+
+def test_interpolates_on_a_log_scale():
+    auto = AutoBrightness(curve=[(0, 0), (99, 100)], smoothing_seconds=1, hysteresis=0)
+    # log10(9 + 1) is half way to log10(99 + 1)
+    auto.update(9, t=0)
+    assert auto.brightness == 50
+
+def test_hysteresis_ignores_small_changes():
+    auto = AutoBrightness(curve=[(0, 0), (999, 100)], smoothing_seconds=1, hysteresis=5)
+    assert auto.update(99, t=0)
+    brightness = auto.brightness
+    assert not auto.update(110, t=100)
+    assert auto.brightness == brightness
+
+def test_smoothing_damps_a_flash():
+    auto = AutoBrightness(smoothing_seconds=10, hysteresis=0)
+    auto.update(10, t=0)
+    auto.update(1000, t=0.1)
+    assert auto.lux < 20
+
+def test_profiles_switch_with_hysteresis():
+    profiles = [{'name': 'night', 'max_lux': 5, 'pwm_bits': 7}, {'name': 'day', 'max_lux': None, 'pwm_bits': 11}]
+    auto = AutoBrightness(profiles=profiles, smoothing_seconds=0.001, profile_hysteresis=0.2)
+    auto.update(1, t=0)
+    assert auto.profile['name'] == 'night'
+    # Past the boundary but not by the margin
+    auto.update(5.5, t=1)
+    assert auto.profile['name'] == 'night'
+    auto.update(7, t=2)
+    assert auto.profile['name'] == 'day'
+    auto.update(4.5, t=3)
+    assert auto.profile['name'] == 'day'
+    auto.update(3, t=4)
+    assert auto.profile['name'] == 'night'
+
+def test_ignores_missing_readings():
+    auto = AutoBrightness()
+    assert not auto.update(None)
+    assert auto.brightness is None
+
+def test_from_config():
+    assert AutoBrightness.from_config({}) is None
+    assert AutoBrightness.from_config({'auto_brightness': {'enabled': False}}) is None
+    assert AutoBrightness.from_config({'auto_brightness': {'hysteresis': 1}}).hysteresis == 1
+
+def test_panel_watts():
+    black = np.zeros((32, 64, 3), dtype=np.uint8)
+    white = np.full((32, 64, 3), 255, dtype=np.uint8)
+    assert estimate_panel_watts(black, 100) == pytest.approx(PANEL_IDLE_WATTS)
+    assert estimate_panel_watts(white, 0) == pytest.approx(PANEL_IDLE_WATTS)
+    assert estimate_panel_watts(white, 100, full_white_watts=20) == pytest.approx(PANEL_IDLE_WATTS + 20)
+    assert estimate_panel_watts(white, 50) < estimate_panel_watts(white, 100)
+
+def test_power_monitor_attributes_time_to_the_previous_profile():
+    now = [0.0]
+    monitor = PowerMonitor(clock=lambda: now[0], cpu_clock=lambda: now[0]/2)
+    monitor.sample('day', 2.0)
+    now[0] = 10
+    monitor.sample('night', 1.0)
+    now[0] = 15
+    monitor.sample('night', 1.0)
+    assert monitor.totals['day'] == {'seconds': 10, 'cpu_seconds': 5, 'joules': 20}
+    assert monitor.totals['night']['seconds'] == 5
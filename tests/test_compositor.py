@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from compositor import Compositor
+
+def _draw_square(layer):
+    layer.SetImage(Image.new('RGB', (2, 2), (255, 0, 0)), 1, 1)
+
+def test_same_size_panel_uses_the_frame():
+    compositor = Compositor(64, 32)
+    assert compositor.scale == 1
+    assert compositor.panel_frame() is compositor.frame.pixels
+
+def test_layout_is_scaled_and_centered_on_a_bigger_panel():
+    compositor = Compositor(64, 32, 192, 64)
+    assert compositor.scale == 2 and compositor.offset == (32, 0)
+    compositor.add_widget('square', 0, 0, 4, 4)
+    compositor.update('square', 1, _draw_square)
+
+    panel = compositor.panel_frame()
+    assert panel.shape == (64, 192, 3)
+    red = np.argwhere((panel == (255, 0, 0)).all(axis=2))
+    assert (red.min(axis=0).tolist(), red.max(axis=0).tolist()) == ([2, 34], [5, 37])
+    assert np.array_equal(panel[:, 32:160], compositor.frame.pixels.repeat(2, axis=0).repeat(2, axis=1))
+    assert not panel[:, :32].any() and not panel[:, 160:].any()
+
+def test_panel_frame_follows_redraws():
+    compositor = Compositor(64, 32, 128, 64)
+    compositor.add_widget('square', 0, 0, 4, 4)
+    compositor.panel_frame()
+    compositor.update('square', 1, _draw_square)
+    assert compositor.panel_frame()[2, 2].tolist() == [255, 0, 0]
+
+def test_layout_bigger_than_the_panel():
+    with pytest.raises(ValueError):
+        Compositor(64, 32, 32, 16)
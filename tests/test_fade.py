@@ -0,0 +1,73 @@
+import pytest
+
+from fade import DISPLAY_LUT, LUMINANCE_LUT, Fade
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_fade_reaches_target_after_duration():
+    clock = FakeClock()
+    fade = Fade(duration=1.0, easing='linear', value=0, clock=clock)
+    fade.start(100)
+    assert fade.active
+    clock.now = 0.25
+    assert fade.value() == pytest.approx(25)
+    clock.now = 1.0
+    assert fade.value() == 100
+    assert not fade.active
+
+def test_retargeting_mid_fade_starts_from_the_current_value():
+    clock = FakeClock()
+    fade = Fade(duration=1.0, easing='linear', value=0, clock=clock)
+    fade.start(100)
+    clock.now = 0.5
+    fade.start(0)
+    assert fade.value() == pytest.approx(50)
+    clock.now = 1.0
+    assert fade.value() == pytest.approx(25)
+
+def test_same_target_doesnt_restart():
+    clock = FakeClock()
+    fade = Fade(duration=1.0, value=40, clock=clock)
+    fade.start(40)
+    assert not fade.active
+    assert fade.value() == 40
+
+def test_zero_duration_jumps():
+    fade = Fade(duration=0, value=0, clock=FakeClock())
+    fade.start(70)
+    assert fade.value() == 70
+
+@pytest.mark.parametrize('easing', ['linear', 'ease_in', 'ease_out', 'ease_in_out', 'sine'])
+def test_easings_are_monotonic_from_start_to_target(easing):
+    clock = FakeClock()
+    fade = Fade(duration=1.0, easing=easing, value=0, clock=clock)
+    fade.start(100)
+    values = []
+    for step in range(11):
+        clock.now = step/10
+        values.append(fade.value())
+    assert values[0] == pytest.approx(0)
+    assert values[-1] == 100
+    assert values == sorted(values)
+
+def test_unknown_easing():
+    with pytest.raises(ValueError):
+        Fade(easing='bounce')
+
+def test_from_config():
+    fade = Fade.from_config({'fade': {'duration': 2, 'easing': 'sine'}}, value=10)
+    assert fade.duration == 2
+    assert fade.target == 10
+
+def test_luts_are_dark_at_zero_and_full_at_100():
+    assert LUMINANCE_LUT[0].max() == 0
+    assert LUMINANCE_LUT[100, 255] == pytest.approx(255)
+    assert DISPLAY_LUT[100, 255] == 255
+    assert DISPLAY_LUT[0].max() == 0
+    # Dimming is perceptual: half brightness is much less than half the light
+    assert LUMINANCE_LUT[50, 255] < 255/4
@@ -0,0 +1,75 @@
+import pytest
+
+from layout import (DEFAULT_LAYOUT, DERIVED_INPUTS, STALE_INPUTS, TIME_INPUTS, _Widget, compile_layout,
+                    format_number)
+
+INPUTS = (set(TIME_INPUTS) | set(DERIVED_INPUTS) | set(STALE_INPUTS)
+          | {f'weather.{field}' for field in ('temp', 'humid', 'icon', 'aqi', 'aqi_color', 'low_temp', 'high_temp')}
+          | {f'sensor.{field}' for field in ('temp', 'humid', 'co2', 'light')})
+FONTS = dict.fromkeys(('time', 'small', 'date', 'am_pm'), object())
+
+class FakeCompositor:
+    ''' Records which widgets were drawn instead of drawing them '''
+    def __init__(self):
+        self.drawn = []
+
+    def update(self, name, key, draw):
+        self.drawn.append(name)
+        return True
+
+class Images(dict):
+    def __missing__(self, name):
+        return object()
+
+def _compile(spec):
+    return compile_layout(spec, FONTS, Images(), {'weather': {'01d': 'sun', 'default': 'unknown'}}, INPUTS)
+
+def test_default_layout_compiles():
+    plan = _compile(DEFAULT_LAYOUT)
+    assert len(plan.static_images) == sum(widget['type'] == 'image' for widget in DEFAULT_LAYOUT)
+    assert plan.uses('sun') and plan.uses('weather') and not plan.uses('display')
+
+@pytest.mark.parametrize('spec, message', [
+    ([{'type': 'sparkles', 'name': 'a'}], 'unknown widget type'),
+    ([{'type': 'text', 'name': 'a', 'bind': 'sensor.temp', 'font': 'small', 'x': 0, 'y': 0}], 'rect'),
+    ([{'type': 'text', 'name': 'a', 'bind': 'sensor.temp', 'font': 'huge', 'x': 0, 'y': 0, 'rect': [0, 0, 1, 1]}],
+     'huge'),
+    ([{'type': 'text', 'name': 'a', 'bind': 'sensor.pressure', 'font': 'small', 'x': 0, 'y': 0,
+       'rect': [0, 0, 1, 1]}], 'unknown input'),
+    ([{'type': 'clock', 'name': 'a', 'show': 'seconds', 'font': 'small', 'x': 0, 'y': 0, 'rect': [0, 0, 1, 1]}]*2,
+     'used twice'),
+])
+def test_bad_layouts_name_the_widget(spec, message):
+    with pytest.raises(ValueError, match=message) as error:
+        _compile(spec)
+    assert 'Layout widget' in str(error.value)
+
+def test_only_widgets_whose_inputs_changed_are_redrawn():
+    plan = _compile([
+        {'type': 'text', 'name': 'temp', 'bind': 'sensor.temp', 'digits': 2, 'font': 'small',
+         'x': 0, 'y': 5, 'rect': [0, 0, 10, 5]},
+        {'type': 'text', 'name': 'co2', 'bind': 'sensor.co2', 'digits': 4, 'color_map': 'co2', 'font': 'small',
+         'x': 0, 'y': 10, 'rect': [0, 5, 20, 5], 'refresh': 60},
+    ])
+    compositor = FakeCompositor()
+    assert plan.update(compositor, {'sensor.temp': 70, 'sensor.co2': 600}, now=0) == 2
+    assert plan.update(compositor, {'sensor.temp': 70, 'sensor.co2': 600}, now=1) == 0
+    assert plan.update(compositor, {'sensor.temp': 71, 'sensor.co2': 600}, now=2) == 1
+    assert compositor.drawn[-1] == 'temp'
+    # Refreshed when its interval runs out even though nothing changed
+    assert plan.update(compositor, {'sensor.temp': 71, 'sensor.co2': 600}, now=60) == 1
+    assert compositor.drawn[-1] == 'co2'
+
+def test_format_number():
+    assert format_number(None, 2) == ('??', True)
+    assert format_number(None, 2, leading_space=True) == (' ??', True)
+    assert format_number(7.4, 2) == ('07', False)
+    assert format_number(7, 2, leading_space=True) == (' 07', False)
+    assert format_number(-4.6, 2, leading_space=True) == ('-5', False)
+    assert format_number(104.5, 2, leading_space=True) == ('104', False)
+
+def test_widgets_must_implement_update():
+    class Incomplete(_Widget):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete({'name': 'a', 'rect': [0, 0, 1, 1]})
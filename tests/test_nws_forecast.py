@@ -0,0 +1,50 @@
+import json
+
+from nws_forecast import IntervalIndex, parse_forecast_grid, parse_valid_time
+
+def test_value_at_inside_an_interval():
+    index = IntervalIndex([(10, 20, 'a'), (30, 40, 'b')])
+    assert index.value_at(10) == 'a'
+    assert index.value_at(19.9) == 'a'
+    assert index.value_at(35) == 'b'
+
+def test_value_at_in_a_gap_uses_the_next_interval():
+    index = IntervalIndex([(30, 40, 'b'), (10, 20, 'a')])
+    assert index.value_at(5) == 'a'
+    assert index.value_at(20) == 'b'
+    assert index.value_at(40) is None
+
+def test_next_change():
+    index = IntervalIndex([(10, 20, 'a'), (30, 40, 'b')])
+    assert index.next_change(15) == 20
+    assert index.next_change(25) == 30
+    assert index.next_change(0) == 10
+    assert index.next_change(45) is None
+
+def test_empty_index():
+    index = IntervalIndex([])
+    assert index.value_at(0) is None
+    assert index.next_change(0) is None
+
+def test_to_list_round_trips():
+    intervals = [(10, 20, 1.5), (30, 40, 2.5)]
+    assert IntervalIndex(IntervalIndex(intervals).to_list()).to_list() == intervals
+
+def test_parse_valid_time():
+    assert parse_valid_time('1970-01-01T00:00:00+00:00/PT14H') == (0, 14*3600)
+    assert parse_valid_time('1970-01-01T00:00:00+00:00/P1DT2H30M') == (0, (26*60 + 30)*60)
+    assert parse_valid_time('garbage') is None
+    assert parse_valid_time('1970-01-01T00:00:00+00:00/14 hours') is None
+
+def test_parse_forecast_grid():
+    def series(*values):
+        return {'uom': 'wmoUnit:degC', 'values': [{'validTime': t, 'value': v} for t, v in values]}
+    text = json.dumps({'geometry': {'minTemperature': 'not this one'}, 'properties': {
+        'temperature': series(('1970-01-01T00:00:00+00:00/PT1H', 50)),
+        'maxTemperature': series(('1970-01-01T12:00:00+00:00/PT12H', 30)),
+        'minTemperature': series(('1970-01-01T00:00:00+00:00/PT12H', 0),
+                                 ('1970-01-02T00:00:00+00:00/PT12H', None)),
+    }})
+    indexes = parse_forecast_grid(text)
+    assert indexes['minTemperature'].to_list() == [(0, 12*3600, 32.0)]
+    assert indexes['maxTemperature'].value_at(0) == 86.0
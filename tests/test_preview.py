@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+import emulated_matrix
+from preview import PreviewStreamer, changed_rects, pack_frame, unpack_frame
+from run_clock import LEDClock
+
+def _frame(width=64, height=32, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+def test_pack_round_trip():
+    frame = _frame()
+    assert np.array_equal(unpack_frame(pack_frame(frame), 64, 32), frame)
+
+def test_pack_non_contiguous_slice():
+    frame = _frame()
+    part = frame[8:16, 24:40]
+    assert np.array_equal(unpack_frame(pack_frame(part), 16, 8), part)
+
+def test_changed_rects_merges_neighbours_in_a_row():
+    frame = _frame()
+    changed = frame.copy()
+    changed[2, 3] += 1
+    changed[2, 12] += 1
+    changed[30, 63] += 1
+    assert changed_rects(changed, frame) == [(0, 0, 16, 8), (56, 24, 8, 8)]
+    assert changed_rects(frame, frame) == []
+
+def test_streamer_sends_keyframe_then_deltas_that_rebuild_the_frame():
+    streamer = PreviewStreamer()
+    first = _frame()
+    message = streamer.message(first, 100)
+    assert message['key'] and message['rects'][0][:4] == [0, 0, 64, 32]
+
+    second = first.copy()
+    second[10:12, 40:50] = 0
+    message = streamer.message(second, 100)
+    assert not message['key']
+    rebuilt = first.copy()
+    for x, y, w, h, data in message['rects']:
+        rebuilt[y:y + h, x:x + w] = unpack_frame(data, w, h)
+    assert np.array_equal(rebuilt, second)
+
+    assert streamer.message(second.copy(), 100) is None
+    assert streamer.message(second, 50)['rects'] == []
+    assert streamer.keyframe()['key']
+
+# The biggest wall the config supports: 64x64 panels, 6 to a chain and 3 chains in parallel
+LARGEST_PANEL = {'rows': 64, 'cols': 64, 'chain_length': 6, 'parallel': 3}
+
+@pytest.mark.parametrize('panel', [{}, LARGEST_PANEL])
+def test_clock_exports_whole_frames_at_any_panel_size(in_repo_root, panel):
+    with open('example.config.json') as f:
+        config = dict(json.load(f), panel=panel)
+    clock = LEDClock(backend=emulated_matrix, config=config, sensor_source=None, weather_source=None,
+                     socketio_source=None, weather_cache_file=None)
+    try:
+        clock._draw_loop()
+        clock.preview_control.update({'viewers': 1})
+        clock._export_preview()
+        _, preview, _ = clock.preview_frames.snapshot()
+    finally:
+        clock.stop()
+    width, height = int(preview['width']), int(preview['height'])
+    assert (width, height) == (clock.matrix.width, clock.matrix.height)
+    assert np.array_equal(unpack_frame(preview['frame'], width, height), clock.panel_pixels)
@@ -0,0 +1,16 @@
+import json
+import os
+
+from replay import GOLDEN_FILE, frame_hash, replay
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def test_corpus_renders_the_golden_frames(in_repo_root):
+    ''' Regenerate with: python3 src/replay.py tests/data/corpus.jsonl.gz --golden tests/data/golden --update '''
+    with open(os.path.join(DATA_DIR, 'golden', GOLDEN_FILE)) as f:
+        golden = json.load(f)['frames']
+    hashes = [frame_hash(clock.panel_pixels, clock.brightness)
+              for _, clock, _ in replay(os.path.join(DATA_DIR, 'corpus.jsonl.gz'))]
+    assert len(hashes) == len(golden)
+    changed = [index for index, (digest, expected) in enumerate(zip(hashes, golden)) if digest != expected]
+    assert not changed, f"frames {changed} differ from tests/data/golden"
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from sensor_history import SlidingWindow
+
+def test_min_max_over_the_window():
+    window = SlidingWindow(10)
+    for t, value in enumerate([5, 3, 8, 1, 7]):
+        window.append(t, value, value, value)
+    assert (window.min(), window.max()) == (1, 8)
+
+def test_old_samples_expire():
+    window = SlidingWindow(10)
+    window.append(0, 100, 100, 100)
+    window.append(5, 1, 1, 1)
+    window.append(20, 50, 50, 50)
+    assert (window.min(), window.max()) == (50, 50)
+
+def test_uses_each_samples_low_and_high():
+    window = SlidingWindow(60)
+    window.append(0, 5, 2, 9)
+    assert (window.min(), window.max()) == (2, 9)
+
+def test_trend_is_per_hour():
+    window = SlidingWindow(3600)
+    assert window.trend() is None
+    for minute in range(30):
+        window.append(minute*60, minute/60, minute/60, minute/60)
+    assert window.trend() == pytest.approx(1)
+
+def test_empty():
+    window = SlidingWindow(60)
+    assert (window.min(), window.max(), window.trend()) == (None, None, None)
+
+def test_trend_stays_exact_after_weeks():
+    window = SlidingWindow(3600)
+    rng = np.random.default_rng(0)
+    # Three weeks of noisy readings every 10 seconds
+    times = 1.7e9 + 10*np.arange(3*7*24*360)
+    values = 400 + rng.normal(0, 50, len(times))
+    for t, value in zip(times, values):
+        window.append(t, value, value, value)
+    recent = times >= times[-1] - 3600
+    expected = 3600*np.polyfit(times[recent] - times[-1], values[recent], 1)[0]
+    assert window.trend() == pytest.approx(expected, rel=1e-9)
@@ -0,0 +1,89 @@
+import multiprocessing
+import time
+
+import pytest
+
+from shared_state import SharedState
+
+FIELDS = {'temp': 'float', 'on': 'bool', 'icon': 'str', 'payload': 'text', 'color': 'rgb'}
+
+def _write_forever(state):
+    i = 0
+    while True:
+        i += 1
+        state.update({'temp': float(i), 'payload': str(i)*1000})
+
+def test_starts_empty():
+    state = SharedState(FIELDS)
+    version, values, timestamps = state.snapshot()
+    assert version == 0
+    assert values == dict.fromkeys(FIELDS)
+    assert timestamps == dict.fromkeys(FIELDS, 0.0)
+
+def test_update_round_trips_every_kind():
+    state = SharedState(FIELDS)
+    state.update({'temp': 71.5, 'on': False, 'icon': '01d', 'payload': 'x'*60000, 'color': (1, 2, 3)}, 123.0)
+    version, values, timestamps = state.snapshot()
+    assert version == 1
+    assert values == {'temp': 71.5, 'on': False, 'icon': '01d', 'payload': 'x'*60000, 'color': (1, 2, 3)}
+    assert set(timestamps.values()) == {123.0}
+
+def test_update_only_touches_given_fields():
+    state = SharedState(FIELDS)
+    state.update({'temp': 1.0, 'icon': 'a'}, 10.0)
+    state.update({'icon': None}, 20.0)
+    _, values, timestamps = state.snapshot()
+    assert values['temp'] == 1.0 and values['icon'] is None
+    assert timestamps['temp'] == 10.0 and timestamps['icon'] == 20.0
+    assert state.version == 2
+
+def test_values_that_dont_fit_raise_without_writing():
+    state = SharedState(FIELDS)
+    with pytest.raises(ValueError):
+        state.update({'temp': 5.0, 'icon': 'x'*17})
+    with pytest.raises(ValueError):
+        state.update({'payload': 'x'*65537})
+    assert state.version == 0
+    assert state.snapshot()[1]['temp'] is None
+
+def test_reads_are_consistent_while_another_process_writes():
+    state = SharedState(FIELDS)
+    writer = multiprocessing.Process(target=_write_forever, args=(state,), daemon=True)
+    writer.start()
+    try:
+        end = time.monotonic() + 1
+        reads = 0
+        while time.monotonic() < end:
+            _, values, _ = state.snapshot()
+            if values['temp'] is not None:
+                assert values['payload'] == str(int(values['temp']))*1000
+                reads += 1
+        assert reads > 0
+    finally:
+        writer.kill()
+        writer.join()
+
+def test_snapshot_doesnt_wait_on_a_write_left_half_done():
+    state = SharedState(FIELDS)
+    state.update({'temp': 1.0})
+    _, before, _ = state.snapshot()
+    # What a writer killed in the middle of update() leaves behind
+    state._sequence.value += 1
+
+    start = time.perf_counter()
+    version, values, _ = state.snapshot()
+    assert time.perf_counter() - start < 0.1
+    assert (version, values) == (1, before)
+
+    state.recover()
+    state.update({'temp': 2.0})
+    version, values, _ = state.snapshot()
+    assert values['temp'] == 2.0
+    assert version == state.version
+
+def test_recover_replaces_a_lock_held_by_a_dead_writer():
+    state = SharedState(FIELDS)
+    state._lock.acquire()
+    state.recover()
+    state.update({'temp': 3.0})
+    assert state.snapshot()[1]['temp'] == 3.0
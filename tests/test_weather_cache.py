@@ -0,0 +1,52 @@
+import time
+
+from shared_state import SharedState
+from weather_cache import WeatherCache
+
+WEATHER_FIELDS = {'temp': 'float', 'low_temp': 'float', 'high_temp': 'float'}
+
+def test_store_survives_a_restart(tmp_path):
+    path = str(tmp_path/'cache.json')
+    WeatherCache(path).store('openweather', 'http://x', {'etag': '"1"'}, {'temp': 70.0})
+    cache = WeatherCache(path)
+    assert cache.values('openweather') == {'temp': 70.0}
+    assert cache.validators('openweather', 'http://x') == {'etag': '"1"'}
+    assert cache.validators('openweather', 'http://y') == {}
+
+def test_mark_fresh_is_saved(tmp_path):
+    path = str(tmp_path/'cache.json')
+    cache = WeatherCache(path)
+    cache.store('openweather', 'http://x', {}, {'temp': 70.0})
+    cache._data['sources']['openweather']['fetched'] = 0
+    cache.mark_fresh('openweather')
+    assert WeatherCache(path).fetched_time('openweather') > 0
+
+def test_seed_evaluates_the_forecast_at_the_current_time(tmp_path):
+    path = str(tmp_path/'cache.json')
+    t = time.time()
+    index = {'minTemperature': [(t, t + 100, 40.0), (t + 200, t + 300, 45.0)],
+             'maxTemperature': [(t + 100, t + 200, 80.0), (t + 300, t + 400, 85.0)]}
+    # Fetched while the first low and high were current
+    WeatherCache(path).store('nws', 'http://x', {}, {'low_temp': 40.0, 'high_temp': 80.0}, index=index)
+
+    cache = WeatherCache(path)
+    state = SharedState(WEATHER_FIELDS)
+    cache.seed(state, now=t + 250)
+    _, values, timestamps = state.snapshot()
+    assert (values['low_temp'], values['high_temp']) == (45.0, 85.0)
+    assert timestamps['low_temp'] == cache.fetched_time('nws')
+
+def test_seed_skips_old_values(tmp_path):
+    path = str(tmp_path/'cache.json')
+    WeatherCache(path).store('openweather', 'http://x', {}, {'temp': 70.0})
+    state = SharedState(WEATHER_FIELDS)
+    WeatherCache(path).seed(state, now=WeatherCache(path).fetched_time('openweather') + 60*60*24)
+    assert state.snapshot()[1]['temp'] is None
+
+def test_no_path_keeps_it_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = WeatherCache(None)
+    cache.set_gridpoint(1, 2, 'http://x')
+    cache.store('openweather', 'http://x', {}, {'temp': 70.0})
+    assert cache.gridpoint(1, 2) == 'http://x'
+    assert list(tmp_path.iterdir()) == []
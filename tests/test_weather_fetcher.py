@@ -0,0 +1,160 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+requests = pytest.importorskip('requests')
+
+import weather_fetcher
+from shared_state import SharedState
+from weather_cache import WeatherCache
+from weather_fetcher import (BACKOFF_BASE, FetchError, NWSForecastSource, OpenWeatherSource, PurpleAirSource,
+                             SourcePoller)
+
+CONFIG = {'lat': 30.25, 'lon': -97.75, 'openweather_api_key': 'key'}
+OPENWEATHER = {'main': {'temp': 71.5, 'humidity': 40}, 'weather': [{'icon': '01d'}]}
+FORECAST_GRID = {'properties': {
+    'minTemperature': {'values': [{'validTime': '2100-01-01T00:00:00+00:00/PT12H', 'value': 0}]},
+    'maxTemperature': {'values': [{'validTime': '2100-01-01T12:00:00+00:00/PT12H', 'value': 30}]},
+}}
+WEATHER_FIELDS = {'temp': 'float', 'humid': 'float', 'icon': 'str'}
+
+class StubServer(ThreadingHTTPServer):
+    ''' Answers each path with a (status, headers, body) response, or a function of the request headers returning one '''
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.routes = {}
+        self.requests = []
+        # Seconds to wait before answering, to make requests time out
+        self.delay = 0
+
+    def handle_error(self, request, client_address):
+        ''' A client that timed out hung up on us, that's expected '''
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.server.requests.append((path, dict(self.headers)))
+        response = self.server.routes[path]
+        status, headers, body = response(self.headers) if callable(response) else response
+        time.sleep(self.server.delay)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def _json_response(data, **headers):
+    return 200, headers, json.dumps(data).encode()
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def session():
+    with requests.Session() as session:
+        yield session
+
+@pytest.fixture
+def cache(tmp_path):
+    return WeatherCache(str(tmp_path/'weather_cache.json'))
+
+def _openweather(stub, cache):
+    return OpenWeatherSource(CONFIG, cache, stub.url + '/weather?lat={lat}&lon={lon}&appid={key}')
+
+def test_etag_and_304_reuse_the_cached_values(stub, session, cache):
+    def weather(headers):
+        if headers.get('If-None-Match') == '"v1"':
+            return 304, {}, b''
+        return _json_response(OPENWEATHER, ETag='"v1"')
+    stub.routes['/weather'] = weather
+    source = _openweather(stub, cache)
+
+    first = source.fetch(session)
+    cache._data['sources']['openweather']['fetched'] = 0
+    second = source.fetch(session)
+    assert first == second == {'temp': 71.5, 'humid': 40, 'icon': '01d'}
+    assert [headers.get('If-None-Match') for _, headers in stub.requests] == [None, '"v1"']
+    # The 304 says the cached values are current
+    assert cache.fetched_time('openweather') > 0
+
+def test_backoff_after_server_errors(stub, session, cache):
+    stub.routes['/weather'] = (503, {}, b'')
+    state = SharedState(WEATHER_FIELDS)
+    poller = SourcePoller(_openweather(stub, cache), state, interval=120)
+
+    delays = [poller.poll_once(session) for _ in range(3)]
+    for failures, delay in enumerate(delays, 1):
+        full = BACKOFF_BASE*2**(failures - 1)
+        assert full/2 <= delay <= full
+    assert poller.failures == poller.errors == 3
+
+    stub.routes['/weather'] = _json_response(OPENWEATHER)
+    assert poller.poll_once(session) == 120
+    assert poller.failures == 0
+    assert state.snapshot()[1]['temp'] == 71.5
+
+def test_backoff_after_timeouts(stub, session, cache, monkeypatch):
+    monkeypatch.setattr(weather_fetcher, 'HTTP_TIMEOUT', (1, 0.1))
+    stub.routes['/weather'] = _json_response(OPENWEATHER)
+    stub.delay = 0.5
+    poller = SourcePoller(_openweather(stub, cache), SharedState(WEATHER_FIELDS), interval=120)
+
+    delay = poller.poll_once(session)
+    assert BACKOFF_BASE/2 <= delay <= BACKOFF_BASE
+    assert poller.failures == 1
+
+@pytest.mark.parametrize('body', [b'{"main": ', b'<html>Bad gateway</html>', b''])
+def test_malformed_json_raises_fetch_error(stub, session, cache, body):
+    stub.routes['/weather'] = (200, {}, body)
+    stub.routes['/aqi'] = (200, {}, body)
+    with pytest.raises(FetchError):
+        _openweather(stub, cache).fetch(session)
+    with pytest.raises(FetchError):
+        PurpleAirSource(CONFIG, cache, stub.url + '/aqi?lat={lat}&lon={lon}').fetch(session)
+
+def _nws(stub, cache):
+    stub.routes['/points'] = _json_response({'properties': {'forecastGridData': stub.url + '/grid'}})
+    return NWSForecastSource(CONFIG, cache, stub.url + '/points?lat={lat}&lon={lon}')
+
+def _lookups(stub):
+    return sum(path == '/points' for path, _ in stub.requests)
+
+def test_nws_keeps_the_gridpoint_through_server_errors(stub, session, cache):
+    source = _nws(stub, cache)
+    stub.routes['/grid'] = (503, {}, b'')
+    with pytest.raises(FetchError) as error:
+        source.fetch(session)
+    assert error.value.status == 503
+
+    stub.routes['/grid'] = _json_response(FORECAST_GRID)
+    assert source.fetch(session) == {'low_temp': 32.0, 'high_temp': 86.0}
+    assert _lookups(stub) == 1
+    assert cache.gridpoint(CONFIG['lat'], CONFIG['lon']) == stub.url + '/grid'
+
+@pytest.mark.parametrize('grid', [(404, {}, b''), (200, {}, b'{"properties": {}}'), (200, {}, b'{"prop')])
+def test_nws_looks_the_gridpoint_up_again_when_the_forecast_is_gone_or_garbled(stub, session, cache, grid):
+    source = _nws(stub, cache)
+    stub.routes['/grid'] = grid
+    with pytest.raises(FetchError):
+        source.fetch(session)
+    assert cache.gridpoint(CONFIG['lat'], CONFIG['lon']) is None
+
+    stub.routes['/grid'] = _json_response(FORECAST_GRID)
+    source.fetch(session)
+    assert _lookups(stub) == 2
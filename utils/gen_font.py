@@ -1,87 +1,327 @@
+"""
+Compile the glyph sketches in resources/fonts/*.txt into BDF fonts.
+
+A sketch is a list of glyphs, each one a "=<char>" line followed by its rows drawn with '#' for
+a lit pixel and '.' for an unlit one. Optional "!<option> <value>" lines before the first glyph
+tweak the whole font:
+
+    !spacing 2      columns of space after every glyph (default 1)
+
+Only fonts whose sketch changed since the last run are rebuilt, tracked by a hash of each source
+in resources/fonts/.gen_font_state.json. Every BDF is parsed back with bdfparser and with the
+clock's own parser before it replaces the old one, and a BDF that was edited by hand (or never
+generated from its sketch) is left alone unless --force is given; --verbose lists them.
+
+    python3 utils/gen_font.py                       # rebuild whatever changed
+    python3 utils/gen_font.py --packed              # also write .glyphs packed bitmaps
+    python3 utils/gen_font.py --stdout my_font.txt  # just print one BDF
+
+The packed .glyphs format is little endian: an 8 byte magic b'LEDGLYPH', a format version byte,
+font width, height and glyph count (B, B, H), then per glyph its codepoint, device width, bounding
+box width and height and bounding box x and y offsets (I, B, B, B, b, b) followed by its rows, each
+padded to whole bytes (as by numpy.packbits).
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import struct
 import sys
-import math
-
-def pixels_to_hex(pixels, width):
-    pixels = pixels.strip()
-    pixel_bin = 0
-    for p in pixels:
-        pixel_bin <<= 1
-        if p == '#':
-           pixel_bin += 1
-
-    byte_width = int(math.ceil(width / 8))
-    pixel_bin <<= (byte_width*8-len(pixels))
-    return hex(pixel_bin)[2:]
-
-def parse_char(char, char_data):
-    bdf_data = ""
-    width = max(len(l.strip()) for l in char_data)
-    height = len(char_data)
-    codepoint = ord(char)
-    dwidth = width + 1
-    bdf_data += "\n"
-    bdf_data += f"STARTCHAR {char}\n"
-    bdf_data += f"ENCODING {codepoint}\n"
-    bdf_data += f"SWIDTH 500 0\n"
-    bdf_data += f"DWIDTH {dwidth} 0\n"
-    bdf_data += f"BBX {width} {height} 0 0\n"
-    bdf_data += "BITMAP\n"
-
-    for line in char_data:
-       bdf_data += pixels_to_hex(line, width) + '\n'
-
-    bdf_data += "ENDCHAR\n"
-    
-    return bdf_data, width, height
-
-def gen_header(name, width, height, num_chars):
-    bdf_file =  f"STARTFONT 2.1\n"
-    bdf_file += f"FONT {name}\n"
-    bdf_file += f"SIZE {width} {height} 75 75\n"
-    bdf_file += f"FONTBOUNDINGBOX {width} {height} 0 0\n"
-    bdf_file += f"STARTPROPERTIES 2\n"
-    bdf_file += f"FONT_ASCENT {height}\n"
-    bdf_file += f"FONT_DESCENT 0\n"
-    bdf_file += f"ENDPROPERTIES\n"
-    bdf_file += f"CHARS {num_chars}\n"
-    return bdf_file
-
-def parse_font(name, font_data):
-    char = None
-    char_data = []
-    max_width = 0
-    max_height = 0
-    bdf_file = ""
-    char_count = 1
-    
-    for line in font_data:
-        if len(line.strip()) == 0:
+import time
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from glyph_atlas import parse_bdf
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'fonts')
+STATE_FILE = '.gen_font_state.json'
+
+# Bump when the output for the same sketch changes so everything gets rebuilt
+COMPILER_VERSION = 3
+
+PACKED_MAGIC = b'LEDGLYPH'
+PACKED_FORMAT_VERSION = 1
+_PACKED_HEADER = struct.Struct('<8sBBBH')
+_PACKED_GLYPH = struct.Struct('<IBBBbb')
+
+DEFAULT_OPTIONS = {'spacing': 1}
+
+Glyph = namedtuple('Glyph', ['char', 'bitmap', 'device_width'])
+
+class SketchError(ValueError):
+    pass
+
+def parse_sketch(lines):
+    ''' Returns (options, [(char, [row strings])]) '''
+    options = dict(DEFAULT_OPTIONS)
+    glyphs = []
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
             # Ignore empty lines
             continue
-        elif line.startswith('='):
-            # Start new character
-            if char is not None:
-                new_char, width, height = parse_char(char, char_data)
-                bdf_file += new_char
-                max_width = max(width, max_width)
-                max_height = max(height, max_height)
-                char_count += 1
-            char = line[1]
-            char_data = []
+        if line.startswith('='):
+            if len(line) < 2:
+                raise SketchError(f"line {number}: missing character after '='")
+            glyphs.append((line[1], []))
+        elif line.startswith('!') and not glyphs:
+            option, _, value = line[1:].partition(' ')
+            if option not in DEFAULT_OPTIONS:
+                raise SketchError(f"line {number}: unknown option {option!r}")
+            try:
+                options[option] = int(value)
+            except ValueError:
+                raise SketchError(f"line {number}: {option} needs a number, not {value.strip()!r}")
         else:
-            char_data.append(line)
-    new_char, width, height = parse_char(char, char_data)
-    bdf_file += new_char
-    max_width = max(width, max_width)
-    max_height = max(height, max_height)
+            row = line.strip()
+            if not glyphs:
+                raise SketchError(f"line {number}: pixels before the first glyph")
+            if row.strip('.#'):
+                raise SketchError(f"line {number}: rows can only contain '.' and '#'")
+            glyphs[-1][1].append(row)
+    return options, glyphs
+
+def rasterize(rows):
+    ''' Boolean bitmap of shape (rows, longest row), shorter rows padded with unlit pixels '''
+    width = max((len(row) for row in rows), default=0)
+    bitmap = np.zeros((len(rows), width), dtype=bool)
+    for y, row in enumerate(rows):
+        bitmap[y, :len(row)] = np.frombuffer(row.encode(), dtype=np.uint8) == ord('#')
+    return bitmap
+
+def compile_glyphs(sketch_glyphs, options):
+    return [Glyph(char, bitmap, bitmap.shape[1] + options['spacing'])
+            for char, bitmap in ((char, rasterize(rows)) for char, rows in sketch_glyphs)]
+
+def _glyph_name(char):
+    # bdfparser (and most other tools) can't look up a glyph with a blank name
+    return char if char.isprintable() and not char.isspace() else f'uni{ord(char):04X}'
+
+def to_bdf(name, glyphs):
+    width = max((glyph.bitmap.shape[1] for glyph in glyphs), default=0)
+    height = max((glyph.bitmap.shape[0] for glyph in glyphs), default=0)
+    lines = [
+        "STARTFONT 2.1",
+        f"FONT {name}",
+        f"SIZE {width} {height} 75 75",
+        f"FONTBOUNDINGBOX {width} {height} 0 0",
+        "STARTPROPERTIES 2",
+        f"FONT_ASCENT {height}",
+        "FONT_DESCENT 0",
+        "ENDPROPERTIES",
+        f"CHARS {len(glyphs)}",
+    ]
+    for glyph in glyphs:
+        glyph_height, glyph_width = glyph.bitmap.shape
+        lines += [
+            "",
+            f"STARTCHAR {_glyph_name(glyph.char)}",
+            f"ENCODING {ord(glyph.char)}",
+            "SWIDTH 500 0",
+            f"DWIDTH {glyph.device_width} 0",
+            f"BBX {glyph_width} {glyph_height} 0 0",
+            "BITMAP",
+        ]
+        lines += [row.tobytes().hex() for row in np.packbits(glyph.bitmap, axis=1)]
+        lines.append("ENDCHAR")
+    lines += ["", "ENDFONT"]
+    return '\n'.join(lines) + '\n'
+
+def to_packed(glyphs):
+    width = max((glyph.bitmap.shape[1] for glyph in glyphs), default=0)
+    height = max((glyph.bitmap.shape[0] for glyph in glyphs), default=0)
+    chunks = [_PACKED_HEADER.pack(PACKED_MAGIC, PACKED_FORMAT_VERSION, width, height, len(glyphs))]
+    for glyph in glyphs:
+        glyph_height, glyph_width = glyph.bitmap.shape
+        chunks.append(_PACKED_GLYPH.pack(ord(glyph.char), glyph.device_width,
+                                         glyph_width, glyph_height, 0, 0))
+        chunks.append(np.packbits(glyph.bitmap, axis=1).tobytes())
+    return b''.join(chunks)
+
+def read_packed(data):
+    ''' Returns (width, height, {codepoint: (bitmap, device_width)}) from a .glyphs file '''
+    magic, version, width, height, count = _PACKED_HEADER.unpack_from(data)
+    if magic != PACKED_MAGIC or version != PACKED_FORMAT_VERSION:
+        raise ValueError("not a packed glyph file this version can read")
+    glyphs = {}
+    offset = _PACKED_HEADER.size
+    for _ in range(count):
+        codepoint, device_width, glyph_width, glyph_height, _, _ = _PACKED_GLYPH.unpack_from(data, offset)
+        offset += _PACKED_GLYPH.size
+        row_bytes = -(-glyph_width//8)
+        rows = np.frombuffer(data, dtype=np.uint8, count=row_bytes*glyph_height, offset=offset)
+        offset += row_bytes*glyph_height
+        bitmap = np.unpackbits(rows.reshape(glyph_height, row_bytes), axis=1, count=glyph_width)
+        glyphs[codepoint] = (bitmap.astype(bool), device_width)
+    return width, height, glyphs
+
+def _expected_mask(glyph):
+    ''' What the clock should draw for glyph: its bitmap cut or padded to the device width '''
+    mask = np.zeros((glyph.bitmap.shape[0], glyph.device_width), dtype=bool)
+    columns = min(glyph.bitmap.shape[1], glyph.device_width)
+    mask[:, :columns] = glyph.bitmap[:, :columns]
+    return mask
+
+def validate(bdf_path, glyphs, packed=None):
+    ''' Raise ValueError unless the BDF (and packed data) at bdf_path decode back to glyphs '''
+    _, _, _, parsed = parse_bdf(bdf_path)
+    if set(parsed) != {ord(glyph.char) for glyph in glyphs}:
+        raise ValueError("glyph set doesn't round-trip through the clock's BDF parser")
+    for glyph in glyphs:
+        mask, y_offset, device_width = parsed[ord(glyph.char)]
+        if device_width != glyph.device_width or y_offset != 0 or not np.array_equal(mask, _expected_mask(glyph)):
+            raise ValueError(f"{glyph.char!r} doesn't round-trip through the clock's BDF parser")
+
+    try:
+        from bdfparser import Font
+    except ImportError:
+        print("bdfparser isn't installed, only checked against the clock's parser")
+    else:
+        font = Font(bdf_path)
+        if font.length() != len(glyphs):
+            raise ValueError(f"bdfparser found {font.length()} glyphs, expected {len(glyphs)}")
+        for glyph in glyphs:
+            parsed_glyph = font.glyphbycp(ord(glyph.char))
+            if parsed_glyph is None:
+                raise ValueError(f"bdfparser can't find {glyph.char!r}")
+            data = np.array(parsed_glyph.draw(1).todata(2), dtype=bool).reshape(glyph.bitmap.shape)
+            if parsed_glyph.meta['dwx0'] != glyph.device_width or not np.array_equal(data, glyph.bitmap):
+                raise ValueError(f"{glyph.char!r} doesn't round-trip through bdfparser")
+
+    if packed is not None:
+        _, _, unpacked = read_packed(packed)
+        for glyph in glyphs:
+            bitmap, device_width = unpacked[ord(glyph.char)]
+            if device_width != glyph.device_width or not np.array_equal(bitmap, glyph.bitmap):
+                raise ValueError(f"{glyph.char!r} doesn't round-trip through the packed format")
+
+def _same_font(path_a, path_b):
+    ''' Whether two BDFs draw exactly the same thing on the clock '''
+    *metrics_a, glyphs_a = parse_bdf(path_a)
+    *metrics_b, glyphs_b = parse_bdf(path_b)
+    if metrics_a != metrics_b or set(glyphs_a) != set(glyphs_b):
+        return False
+    return all(a[1:] == b[1:] and np.array_equal(a[0], b[0])
+               for a, b in ((glyphs_a[cp], glyphs_b[cp]) for cp in glyphs_a))
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_state(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def build(source_path, state, packed=False, check=True, force=False, verbose=False):
+    '''
+    Rebuild one font if its sketch changed. Returns "built", "skipped" or "up to date".
+    state is the {source path: entry} dict from the state file and gets updated in place.
+    verbose says why a font was skipped.
+    '''
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    bdf_path = os.path.splitext(source_path)[0] + '.bdf'
+    packed_path = os.path.splitext(source_path)[0] + '.glyphs'
+
+    source_hash = _sha256(source + f'\0{COMPILER_VERSION}\0{packed}'.encode())
+    key = os.path.relpath(source_path, FONTS_DIR)
+    entry = state.get(key, {})
+    outputs = [bdf_path] + ([packed_path] if packed else [])
+    if not force and entry.get('source') == source_hash and all(os.path.exists(p) for p in outputs):
+        return 'up to date'
+
+    start = time.perf_counter()
+    options, sketch_glyphs = parse_sketch(source.decode().splitlines())
+    glyphs = compile_glyphs(sketch_glyphs, options)
+    bdf = to_bdf(name, glyphs).encode()
+    packed_data = to_packed(glyphs) if packed else None
+
+    tmp_path = bdf_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(bdf)
+    try:
+        if check:
+            validate(tmp_path, glyphs, packed_data)
+        # Don't clobber a BDF we didn't write last time unless it draws the same thing anyway
+        if not force and os.path.exists(bdf_path):
+            with open(bdf_path, 'rb') as f:
+                ours = _sha256(f.read()) == entry.get('bdf')
+            if not ours and not _same_font(bdf_path, tmp_path):
+                if verbose:
+                    print(f"Skipping {os.path.basename(bdf_path)}: it doesn't match "
+                          f"{os.path.basename(source_path)}, use --force to overwrite it")
+                return 'skipped'
+        os.replace(tmp_path, bdf_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if packed_data is not None:
+        with open(packed_path + '.tmp', 'wb') as f:
+            f.write(packed_data)
+        os.replace(packed_path + '.tmp', packed_path)
+
+    state[key] = {'source': source_hash, 'bdf': _sha256(bdf)}
+    print(f"Compiled {os.path.basename(source_path)} ({len(glyphs)} glyphs) "
+          f"in {1000*(time.perf_counter() - start):.1f} ms")
+    return 'built'
+
+def _has_glyphs(path):
+    with open(path) as f:
+        return any(line.startswith('=') for line in f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile glyph sketches into BDF fonts")
+    parser.add_argument('sources', nargs='*',
+                        help="sketches to compile (default: every resources/fonts/*.txt font)")
+    parser.add_argument('--packed', action='store_true', help="also write .glyphs packed bitmaps")
+    parser.add_argument('--force', action='store_true',
+                        help="rebuild everything, overwriting BDFs that don't match their sketch")
+    parser.add_argument('--no-validate', dest='check', action='store_false',
+                        help="skip parsing the output back")
+    parser.add_argument('--stdout', action='store_true', help="print the BDF of one sketch instead")
+    parser.add_argument('--verbose', action='store_true', help="say why each skipped font was skipped")
+    args = parser.parse_args()
+
+    if args.stdout:
+        if len(args.sources) != 1:
+            parser.error("--stdout takes exactly one sketch")
+        with open(args.sources[0]) as f:
+            options, sketch_glyphs = parse_sketch(f.readlines())
+        name = os.path.splitext(os.path.basename(args.sources[0]))[0]
+        # to_bdf() already ends with a newline
+        sys.stdout.write(to_bdf(name, compile_glyphs(sketch_glyphs, options)))
+        return
 
-    bdf_file = gen_header(name, max_width, max_height, char_count) + bdf_file
-    bdf_file += "\nENDFONT"
+    # Other .txt files live alongside the fonts, only sketches have glyphs in them
+    sources = args.sources or [path for path in sorted(glob.glob(os.path.join(FONTS_DIR, '*.txt')))
+                               if _has_glyphs(path)]
+    state_path = os.path.join(FONTS_DIR, STATE_FILE)
+    state = _load_state(state_path)
 
-    return bdf_file
+    results = {'built': 0, 'up to date': 0, 'skipped': 0, 'failed': 0}
+    for source_path in sources:
+        try:
+            results[build(source_path, state, args.packed, args.check, args.force, args.verbose)] += 1
+        except ValueError as e:
+            print(f"Error in {os.path.basename(source_path)}: {e}")
+            results['failed'] += 1
+    _save_state(state_path, state)
+    print(', '.join(f"{count} {result}" for result, count in results.items()))
+    if results['failed']:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    pathname = sys.argv[1]
-    font_name = pathname.split('.')[0]
-    with open(pathname) as f:
-        print(''.join(parse_font(font_name, f.readlines())))
+    main()
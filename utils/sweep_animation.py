@@ -1,22 +1,66 @@
+"""
+A line sweeping down the panel leaving a fading trail, drawn with the animation engine.
+
+    sudo python3 utils/sweep_animation.py
+    python3 utils/sweep_animation.py --emulated --benchmark 2000
+
+--benchmark times the engine against the original implementation, which redrew every row with
+its own DrawLine call and Color each frame.
+"""
+import argparse
+import os
+import sys
 import time
-from rgbmatrix import RGBMatrix, RGBMatrixOptions, graphics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from animation import AnimationEngine, Sweep
+
+def load_backend(emulated):
+    if emulated:
+        import emulated_matrix
+        return emulated_matrix
+    import rgbmatrix
+    import rgbmatrix.graphics
+    return rgbmatrix
 
 class SweepAnimation:
-    def __init__(self):
-        self.matrix = RGBMatrix(options = self.get_options())
+    def __init__(self, backend):
+        self.backend = backend
+        self.matrix = backend.RGBMatrix(options = self.get_options())
         self.offscreen_canvas = self.matrix.CreateFrameCanvas()
-        self.y_pos = 0
-        self.heat_level = [0]*self.offscreen_canvas.height
-        
+        self.engine = AnimationEngine(self.matrix.width, self.matrix.height)
+        self.engine.add(Sweep())
+
     def get_options(self):
-        options = RGBMatrixOptions()
+        options = self.backend.RGBMatrixOptions()
         options.rows = 32
         options.cols = 64
         options.gpio_slowdown = 4
         return options
 
     def draw_loop(self):
-        start = time.time()
+        self.engine.push(self.offscreen_canvas)
+        self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
+
+    def run(self):
+        try:
+            # Start loop
+            print("Press CTRL-C to stop")
+            while True:
+                self.draw_loop()
+        except KeyboardInterrupt:
+            print("Exiting\n")
+            sys.exit(0)
+
+class PerRowSweep(SweepAnimation):
+    ''' The original implementation, kept to benchmark against '''
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.y_pos = 0
+        self.heat_level = [0]*self.offscreen_canvas.height
+
+    def draw_loop(self):
+        graphics = self.backend.graphics
         canvas = self.offscreen_canvas
         canvas.Fill(0, 0, 0)
 
@@ -26,23 +70,34 @@ class SweepAnimation:
             graphics.DrawLine(canvas, 0, y, canvas.width-1, y, graphics.Color(0, int(self.heat_level[y]*100), int(self.heat_level[y]*255)))
         graphics.DrawLine(canvas, 0, self.y_pos, canvas.width-1, self.y_pos, graphics.Color(0, 255, 255))
 
-        if (self.y_pos <= canvas.height):
+        if (self.y_pos < canvas.height):
             self.heat_level[int(self.y_pos)] = 1.0
 
-
         self.y_pos = (self.y_pos + 0.2) % (canvas.height + 5)
         self.offscreen_canvas = self.matrix.SwapOnVSync(self.offscreen_canvas)
 
-    def run(self):
-        try:
-            # Start loop
-            print("Press CTRL-C to stop")
-            while True:
-                self.draw_loop()
-        except KeyboardInterrupt:
-            print("Exiting\n")
-            sys.exit(0)
+def benchmark(backend, frames):
+    results = {}
+    for name, cls in (('per row', PerRowSweep), ('engine', SweepAnimation)):
+        animation = cls(backend)
+        for _ in range(10):
+            animation.draw_loop()
+        start = time.perf_counter()
+        for _ in range(frames):
+            animation.draw_loop()
+        results[name] = frames/(time.perf_counter() - start)
+        print(f"{name:<8} {results[name]:9.1f} frames/sec")
+    print(f"speedup  {results['engine']/results['per row']:9.1f}x")
 
 if __name__ == "__main__":
-    anim = SweepAnimation()
-    anim.run()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--emulated', action='store_true', help="draw into memory instead of the panel")
+    parser.add_argument('--benchmark', type=int, default=None, metavar='FRAMES',
+                        help="time this many frames of both implementations instead of running")
+    args = parser.parse_args()
+
+    backend = load_backend(args.emulated)
+    if args.benchmark is not None:
+        benchmark(backend, args.benchmark)
+    else:
+        SweepAnimation(backend).run()
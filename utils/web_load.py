@@ -0,0 +1,155 @@
+"""
+Load test the path from the web UI to the panel: simulated pages send bursts of display state
+changes to the webserver and time how long each one takes to be acknowledged as shown.
+
+    python3 utils/web_load.py --url http://localhost --clients 5 --bursts 10
+
+Every change carries a trace, and the webserver acknowledges it back once the clock reports it
+on the panel, with the time it reached each hop. Changes merged into a newer one before the
+broadcast are "coalesced", ones a newer broadcast replaced before the fade to them finished are
+"superseded", and ones never acknowledged within --timeout are dropped. With --simulate-clock the
+tool also connects as a clock that acknowledges every broadcast straight away, to time the
+webserver on its own; don't use it with a real clock connected.
+
+Hop times compare timestamps from the machine running this tool, the webserver and the clock,
+so run it on the pi (or with synced clocks) to trust them. The end to end latency only uses this
+machine's clock.
+"""
+import argparse
+import random
+import threading
+import time
+
+import socketio
+
+STATUSES = ('applied', 'coalesced', 'superseded', 'unchanged', 'invalid')
+# (name, from, to) of every hop a change goes through, the timestamps are in the acknowledgement
+HOPS = (
+    ('to server', 'sent', 'server_received'),
+    ('server batching', 'server_received', 'broadcast'),
+    ('to clock', 'broadcast', 'clock_received'),
+    ('clock mailbox', 'clock_received', 'drained'),
+    ('first frame', 'drained', 'shown'),
+    ('fade', 'shown', 'settled'),
+    ('ack back', 'settled', 'acked'),
+)
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct/100*(len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class SimulatedPage:
+    def __init__(self, name, url):
+        self.name = name
+        self.sent = {}
+        self.acks = {}
+        self.count = 0
+        self._lock = threading.Lock()
+        self.sio = socketio.Client()
+        self.sio.on('display_ack', self._on_ack)
+        self.sio.connect(url)
+
+    def _on_ack(self, ack):
+        with self._lock:
+            if ack['id'] in self.sent and ack['id'] not in self.acks:
+                self.acks[ack['id']] = dict(ack, acked=time.time())
+
+    def send(self, state):
+        self.count += 1
+        trace = {'id': f'{self.name}-{self.count}', 'sent': time.time()}
+        with self._lock:
+            self.sent[trace['id']] = trace['sent']
+        self.sio.emit('display_state', dict(state, trace=trace))
+
+    def burst(self, size, interval, rng):
+        for _ in range(size):
+            self.send({'enabled': True, 'brightness': rng.randint(1, 100)})
+            time.sleep(interval)
+
+    def close(self):
+        self.sio.disconnect()
+
+def simulated_clock(url):
+    ''' A clock that acknowledges every display state as shown as soon as it arrives '''
+    sio = socketio.Client()
+
+    def display_state(data):
+        now = time.time()
+        sio.emit('display_ack', {'version': data['version'], 'status': 'applied', 'clock_received': now,
+                                 'drained': now, 'shown': now, 'settled': now})
+    sio.on('display_state', display_state)
+    sio.connect(url)
+    return sio
+
+def report(pages, timeout):
+    sent = sum(len(page.sent) for page in pages)
+    acks = [ack for page in pages for ack in page.acks.values()]
+    counts = {status: 0 for status in STATUSES}
+    for ack in acks:
+        counts[ack['status']] = counts.get(ack['status'], 0) + 1
+    print(f"commands:     {sent} from {len(pages)} clients")
+    for status, count in counts.items():
+        print(f"{status + ':':<13} {count}")
+    print(f"{'dropped:':<13} {sent - len(acks)} (no acknowledgement within {timeout} s)")
+
+    applied = [ack for ack in acks if ack['status'] in ('applied', 'coalesced')]
+    if not applied:
+        return
+    latencies = sorted(ack['acked'] - ack['sent'] for ack in applied)
+    print("end to end, sent to acknowledged, of applied and coalesced commands:")
+    for pct in (50, 90, 99):
+        print(f"  p{pct:<5} {1000*_percentile(latencies, pct):9.1f} ms")
+    print(f"  max    {1000*latencies[-1]:9.1f} ms")
+
+    print(f"per hop{'p50':>23}{'p99':>12}")
+    for name, start, end in HOPS:
+        times = sorted(ack[end] - ack[start] for ack in applied
+                       if ack.get(start) is not None and ack.get(end) is not None)
+        if times:
+            print(f"  {name:<16} {1000*_percentile(times, 50):9.1f} ms {1000*_percentile(times, 99):9.1f} ms")
+    batches = [ack['batch'] for ack in applied if ack['status'] == 'applied']
+    if batches:
+        print(f"changes per broadcast: mean {sum(batches)/len(batches):.1f}, max {max(batches)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost', help='webserver to connect to')
+    parser.add_argument('--clients', type=int, default=5, help='simulated pages sending at the same time')
+    parser.add_argument('--bursts', type=int, default=10, help='bursts each page sends')
+    parser.add_argument('--burst-size', type=int, default=20, help='changes in a burst')
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between changes in a burst')
+    parser.add_argument('--pause', type=float, default=2.0, help='seconds between bursts')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for the last acknowledgements')
+    parser.add_argument('--simulate-clock', action='store_true',
+                        help="acknowledge broadcasts straight away instead of waiting on a real clock")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    clock = simulated_clock(args.url) if args.simulate_clock else None
+    pages = [SimulatedPage(f'load{i}', args.url) for i in range(args.clients)]
+    rngs = [random.Random(args.seed + i) for i in range(args.clients)]
+    try:
+        for burst in range(args.bursts):
+            threads = [threading.Thread(target=page.burst, args=(args.burst_size, args.interval, rng))
+                       for page, rng in zip(pages, rngs)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if burst < args.bursts - 1:
+                time.sleep(args.pause)
+
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and any(len(page.acks) < len(page.sent) for page in pages):
+            time.sleep(0.05)
+    finally:
+        for page in pages:
+            page.close()
+        if clock is not None:
+            clock.disconnect()
+    report(pages, args.timeout)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,83 @@
+from collections import OrderedDict
 import json
+import os
+import time
 
-from flask import Flask, send_file, send_from_directory, g
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, request, send_file, send_from_directory, g
+from flask_socketio import SocketIO, emit, join_room, leave_room
 
 app = Flask(__name__)
 socketio = SocketIO(app, always_connect=True)
 
+DISPLAY_STATE_FILE = 'display_state.json'
+# Slider drags send a stream of updates, changes within this many seconds go out as one broadcast
+BROADCAST_DELAY = 0.1
+# Broadcasts the clock never acknowledged are forgotten once there are this many newer ones
+MAX_TRACED_BROADCASTS = 64
+
+# The server is the authority on the display state. Every change bumps the version.
+display_state = {'enabled': True, 'brightness': 100}
+state_version = 0
+broadcast_pending = False
+
+# Changes can carry a trace, {"id": ..., "sent": time}, to be acknowledged to the page that sent
+# them once the clock has shown them. These are the traces of the changes waiting to be
+# broadcast, and then the traces in each broadcast by version until the clock acknowledges it.
+pending_traces = []
+broadcast_traces = OrderedDict()
+
+# Newest metrics snapshot sent by the clock
+latest_metrics = None
+
+# Pages currently showing the live preview. The clock only sends frames while there are any.
+preview_viewers = set()
+
+def _load_display_state():
+    global state_version
+    try:
+        with open(DISPLAY_STATE_FILE) as f:
+            saved = json.load(f)
+        display_state.update(_validate_display_state(saved))
+        state_version = int(saved.get('version', 0))
+    except (FileNotFoundError, IOError, ValueError, KeyError, TypeError):
+        pass
+
+def _save_display_state():
+    ''' Write to a temp file and rename it over the old state, so a power cut can't leave half a file '''
+    tmp_path = DISPLAY_STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_versioned_state(), f)
+    os.replace(tmp_path, DISPLAY_STATE_FILE)
+
+def _validate_display_state(data):
+    ''' Raises KeyError, TypeError or ValueError if data isn't a display state '''
+    return {
+        'enabled': bool(data['enabled']),
+        'brightness': min(max(int(float(data['brightness'])), 0), 100),
+    }
+
+def _versioned_state():
+    return {**display_state, 'version': state_version}
+
+def _broadcast_display_state():
+    ''' Send the state to everyone once the burst of changes that scheduled this has settled '''
+    global broadcast_pending
+    socketio.sleep(BROADCAST_DELAY)
+    broadcast_pending = False
+    broadcast = time.time()
+    for trace in pending_traces:
+        trace['broadcast'] = broadcast
+    if pending_traces:
+        broadcast_traces[state_version] = list(pending_traces)
+        pending_traces.clear()
+        while len(broadcast_traces) > MAX_TRACED_BROADCASTS:
+            broadcast_traces.popitem(last=False)
+    socketio.emit('display_state', _versioned_state())
+    try:
+        _save_display_state()
+    except IOError as e:
+        print(f"Unable to save display state: {e}")
+
 @app.route('/')
 def root():
     return send_file('html/index.html')
@@ -14,13 +86,123 @@ def root():
 def static_js(path):
     return send_from_directory('js', path)
 
+@app.route('/metrics')
+def metrics():
+    ''' Prometheus scrape endpoint for the metrics the clock sends over socketio '''
+    if latest_metrics is None:
+        return Response("# No metrics received from the clock yet\n", status=503, mimetype='text/plain')
+    age = time.time() - latest_metrics['time']
+    # If the clock hangs the snapshot stops updating, so make that visible too
+    text = latest_metrics['text'] + (
+        "# HELP ledclock_metrics_age_seconds Seconds since the clock last sent metrics\n"
+        "# TYPE ledclock_metrics_age_seconds gauge\n"
+        f"ledclock_metrics_age_seconds {age}\n")
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+def _get_trace(data, received):
+    trace = data.get('trace') if isinstance(data, dict) else None
+    if not isinstance(trace, dict) or 'id' not in trace:
+        return None
+    return {'id': str(trace['id']), 'sent': trace.get('sent'), 'sid': request.sid, 'server_received': received}
+
+def _acknowledge(trace, status, **times):
+    '''
+    Tell the page that sent a change what happened to it: "applied" (it's on the panel),
+    "coalesced" (merged into a newer change in the same broadcast, which was applied),
+    "superseded" (a newer broadcast replaced it before the clock finished showing it),
+    "unchanged" or "invalid", with the time it reached every hop
+    '''
+    ack = {key: value for key, value in trace.items() if key != 'sid'}
+    socketio.emit('display_ack', dict(ack, status=status, **times), to=trace['sid'])
+
+def _preview_viewers_changed():
+    ''' Tell the clock how many are watching '''
+    socketio.emit('preview_viewers', {'count': len(preview_viewers)})
+
 @socketio.on('connect')
 def handle_connect(auth):
-    emit('get_state', broadcast=True)
+    # Only the new client needs the current state
+    emit('display_state', _versioned_state())
+    emit('preview_viewers', {'count': len(preview_viewers)})
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    if request.sid in preview_viewers:
+        preview_viewers.discard(request.sid)
+        _preview_viewers_changed()
+
+@socketio.on('preview_subscribe')
+def handle_preview_subscribe():
+    join_room('preview')
+    preview_viewers.add(request.sid)
+    _preview_viewers_changed()
+    # The new viewer needs a full frame to apply deltas to
+    socketio.emit('preview_keyframe')
+
+@socketio.on('preview_unsubscribe')
+def handle_preview_unsubscribe():
+    leave_room('preview')
+    if request.sid in preview_viewers:
+        preview_viewers.discard(request.sid)
+        _preview_viewers_changed()
+
+@socketio.on('preview_frame')
+def handle_preview_frame(data):
+    emit('preview_frame', data, to='preview')
 
 @socketio.on('display_state')
-def handle_enable(data):
-    emit('display_state', data, broadcast=True)
+def handle_display_state(data):
+    global state_version, broadcast_pending
+    trace = _get_trace(data, time.time())
+    try:
+        new_state = _validate_display_state(data)
+    except (KeyError, TypeError, ValueError):
+        if trace is not None:
+            _acknowledge(trace, 'invalid')
+        return
+    if new_state == display_state:
+        if trace is not None:
+            _acknowledge(trace, 'unchanged')
+        return
+
+    display_state.update(new_state)
+    state_version += 1
+    if trace is not None:
+        pending_traces.append(trace)
+    if not broadcast_pending:
+        broadcast_pending = True
+        socketio.start_background_task(_broadcast_display_state)
+
+@socketio.on('display_ack')
+def handle_display_ack(data):
+    '''
+    The clock finished showing a version of the state, or dropped it for a newer one. Older
+    broadcasts it never acknowledged were replaced by this one too.
+    '''
+    try:
+        version = int(data['version'])
+    except (KeyError, TypeError, ValueError):
+        return
+    times = {hop: data.get(hop) for hop in ('clock_received', 'drained', 'shown', 'settled')}
+    for traced_version in [v for v in broadcast_traces if v <= version]:
+        traces = broadcast_traces.pop(traced_version)
+        for i, trace in enumerate(traces):
+            if traced_version < version:
+                _acknowledge(trace, 'superseded', version=traced_version, batch=len(traces))
+                continue
+            if data.get('status') == 'superseded':
+                status = 'superseded'
+            else:
+                status = 'applied' if i == len(traces) - 1 else 'coalesced'
+            _acknowledge(trace, status, version=traced_version, batch=len(traces), **times)
+
+@socketio.on('metrics')
+def handle_metrics(data):
+    global latest_metrics
+    latest_metrics = data
+    emit('metrics', data, broadcast=True, include_self=False)
+
+_load_display_state()
 
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=80)
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 80)))
@@ -5,8 +5,36 @@ window.addEventListener('DOMContentLoaded', (event) => {
         "enabled": false,
         "brightness": 100
     };
+    let version = -1;
     let enable_switch = document.getElementById("enableSwitch");
-    enable_switch.disabled = false;
+
+    // While the slider is being dragged, don't let the server's (slightly older) state jump it back
+    const LOCAL_EDIT_HOLD_MS = 500;
+    let last_local_edit = 0;
+
+    // Coalesce slider drags into at most one update per SEND_INTERVAL_MS
+    const SEND_INTERVAL_MS = 50;
+    let send_timer = null;
+    // Every change is traced, the server acknowledges it with when it got to each hop
+    const client_id = Math.random().toString(36).slice(2, 8);
+    let trace_count = 0;
+    let send_state = () => {
+        if (send_timer === null) {
+            send_timer = setTimeout(() => {
+                send_timer = null;
+                let trace = {"id": `${client_id}-${++trace_count}`, "sent": Date.now()/1000};
+                socket.emit('display_state', {...state, "trace": trace});
+            }, SEND_INTERVAL_MS);
+        }
+    };
+
+    socket.on("display_ack", (ack) => {
+        let ms = (from, to) => (ack[from] && ack[to]) ? Math.round(1000*(ack[to] - ack[from])) : "?";
+        console.debug(`display change ${ack.id} ${ack.status} after ${ms("sent", "settled")} ms: ` +
+                      `server ${ms("sent", "server_received")}, broadcast ${ms("server_received", "broadcast")}, ` +
+                      `clock ${ms("broadcast", "clock_received")}, drained ${ms("clock_received", "drained")}, ` +
+                      `shown ${ms("drained", "shown")}, faded ${ms("shown", "settled")}`);
+    });
 
     let update_controls = () => {
         enable_switch.checked = state.enabled;
@@ -17,7 +45,8 @@ window.addEventListener('DOMContentLoaded', (event) => {
 
     enable_switch.addEventListener('change', () => {
         state.enabled = enable_switch.checked;
-        socket.emit('display_state', state);
+        last_local_edit = Date.now();
+        send_state();
         update_controls();
     });
 
@@ -25,12 +54,69 @@ window.addEventListener('DOMContentLoaded', (event) => {
     let brightness_slider = document.getElementById("brightnessSlider");
     brightness_slider.addEventListener('input', () => {
         state.brightness = brightness_slider.value;
+        last_local_edit = Date.now();
         update_controls();
-        socket.emit('display_state', state);
+        send_state();
+    });
+
+    socket.on("connect", () => {
+        // A restarted server may count versions from scratch
+        version = -1;
+        preview_seq = null;
+        if (!document.hidden) {
+            socket.emit('preview_subscribe');
+        }
+    });
+
+    // Live preview of the panel. Frames arrive as changed rects, with a keyframe when we subscribe.
+    let preview_canvas = document.getElementById("previewCanvas");
+    let preview_context = preview_canvas.getContext("2d");
+    let preview_seq = null;
+
+    socket.on("preview_frame", (frame) => {
+        if (frame.key) {
+            if (preview_canvas.width != frame.width || preview_canvas.height != frame.height) {
+                preview_canvas.width = frame.width;
+                preview_canvas.height = frame.height;
+            }
+        } else if (preview_seq === null || frame.seq != preview_seq + 1) {
+            // Missed a delta, ask for a fresh keyframe
+            preview_seq = null;
+            socket.emit('preview_subscribe');
+            return;
+        }
+        preview_seq = frame.seq;
+
+        for (const [x, y, w, h, data] of frame.rects) {
+            let rgb = atob(data);
+            let image = preview_context.createImageData(w, h);
+            for (let i = 0, j = 0; i < rgb.length; i += 3, j += 4) {
+                image.data[j] = rgb.charCodeAt(i);
+                image.data[j + 1] = rgb.charCodeAt(i + 1);
+                image.data[j + 2] = rgb.charCodeAt(i + 2);
+                image.data[j + 3] = 255;
+            }
+            preview_context.putImageData(image, x, y);
+        }
+        preview_canvas.style.filter = `brightness(${frame.brightness})`;
+    });
+
+    // Don't make the clock stream frames to a tab nobody is looking at
+    document.addEventListener("visibilitychange", () => {
+        socket.emit(document.hidden ? 'preview_unsubscribe' : 'preview_subscribe');
     });
 
     socket.on("display_state", (data) => {
-        state = data;
+        // The server sends the state on connect and after every change, with a version number
+        if (data.version < version) {
+            return;
+        }
+        version = data.version;
+        enable_switch.disabled = false;
+        if (Date.now() - last_local_edit < LOCAL_EDIT_HOLD_MS) {
+            return;
+        }
+        state = {"enabled": data.enabled, "brightness": data.brightness};
         update_controls();
     });
 });